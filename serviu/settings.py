@@ -117,11 +117,40 @@ DATABASES = {
         'USER': 'maverixt_serviuapp',
         'PASSWORD': 'Sabanamala25!',
         'HOST': 'localhost',
-        'PORT': '3306'
+        'PORT': '3306',
+        # Permite LOAD DATA LOCAL INFILE (importador con --carga nativa);
+        # el servidor también debe tener local_infile=ON
+        'OPTIONS': {'local_infile': True},
     }
     
 }
 
+# Cache
+# Caché local en memoria con descarte LRU por cantidad de entradas. Las
+# entradas no expiran por tiempo: se invalidan con la marca de versión de
+# datos (ver serviuapp/cache_utils.py).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'serviuapp',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    }
+}
+
+# Archivo con la marca de versión de los datos, compartido por todos los workers
+SERVIU_VERSION_DATOS_PATH = os.path.join(BASE_DIR, 'tmp', 'data_version')
+
+# Archivos subidos para importar, hasta que el proceso trabajador los procesa
+SERVIU_IMPORTACIONES_DIR = os.path.join(BASE_DIR, 'tmp', 'importaciones')
+
+# Caché de los Excel ya leídos (arreglos NumPy por huella del archivo) y su tamaño máximo en bytes
+SERVIU_CACHE_EXCEL_DIR = os.path.join(BASE_DIR, 'tmp', 'cache_excel')
+SERVIU_CACHE_EXCEL_MAXIMO = int(os.getenv('SERVIU_CACHE_EXCEL_MAXIMO', 1024 ** 3))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
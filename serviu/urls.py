@@ -38,7 +38,7 @@ from django.http import HttpResponse
 
 from django.contrib.auth import views as auth_views
 
-from serviuapp.views import dashboard, filtros, BeneficiariosLista, Busqueda, actualizarBeneficiarios, anadirBeneficiario, actualizarBeneficiarioDecreto, actualizarBeneficiarioResolucion,logs_view,limpiar_logs, get_chart_data, ChatView, nlp_analytics_dashboard, api_analyze_text
+from serviuapp.views import dashboard, filtros, filtros_detalle, filtros_exportar, BeneficiariosLista, Busqueda, busquedaMasiva, actualizarBeneficiarios, anadirBeneficiario, actualizarBeneficiarioDecreto, actualizarBeneficiarioResolucion,logs_view,limpiar_logs, importar, importacion_progreso, get_chart_data, get_charts_data, ChatView, nlp_analytics_dashboard, api_analyze_text
 
 
 
@@ -59,12 +59,17 @@ urlpatterns = [
     path('', dashboard, name="dashboard"),
 
     path('filtros/', filtros, name="filtros"),
+    path('filtros/detalle/', filtros_detalle, name="filtros_detalle"),
+    path('filtros/exportar/', filtros_exportar, name="filtros_exportar"),
 
     path('beneficiarios/', BeneficiariosLista, name="beneficiarios"),
 
     path('beneficiarios/anadir_beneficiario/', anadirBeneficiario, name="anadir_beneficiario"),
 
     path('beneficiarios/busqueda', Busqueda, name="busqueda"),
+    path('beneficiarios/busqueda_masiva/', busquedaMasiva, name="busqueda_masiva"),
+
+    path('chart_data/', get_charts_data, name='charts_data'),
 
     path('chart_data/<str:decreto>/', get_chart_data, name='chart_data'),
 
@@ -76,7 +81,11 @@ urlpatterns = [
 
     path('beneficiarios/actualizar_beneficiario/actualizar_resolucion/<int:id_resolucion>', actualizarBeneficiarioResolucion, name="actualizar_resolucion"),
 
+    path('importar/', importar, name='importar'),
+    path('importar/<int:id_trabajo>/progreso/', importacion_progreso, name='importacion_progreso'),
+
     path('logs/', logs_view, name='logs_view'),
+    path('logs/<int:id_trabajo>/', logs_view, name='resultados_importacion'),
 
     path('beneficiarios/logs/', logs_view, name='logs_view'),
 
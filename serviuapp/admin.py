@@ -5,6 +5,8 @@ from .resources import BeneficiariosResource
 
 class BeneficiariosAdmin(ImportExportModelAdmin):
     skip_import_confirm = True
+    # Una entrada de LogEntry por fila hace lenta la importación de archivos grandes
+    skip_admin_log = True
     resource_class = BeneficiariosResource
     list_display = ["id_beneficiario", "rut"]
 
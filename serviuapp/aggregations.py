@@ -0,0 +1,149 @@
+"""
+Conteos agregados de beneficiarios por decreto y tipología.
+
+Reemplaza las decenas de consultas COUNT(*) que hacían dashboard, filtros y
+get_chart_data (una por cada par decreto/tipología, cada una re-ejecutando el
+JOIN completo) por una sola consulta GROUP BY decreto, tipologia generada a
+partir del catálogo en serviuapp.catalog. La consulta se responde desde la
+tabla pre-agregada resumen_beneficiarios (ver serviuapp.resumen), que tiene
+unos cientos de filas en vez de las ~50k del JOIN.
+"""
+from django.db import connection
+
+from .cache_utils import obtener_o_calcular
+from .catalog import TOTAL_INCLUYE_BLANCO, catalogo, normalizar_clave
+
+
+def obtener_filtros(request):
+    """Lee los filtros comuna/provincia/año de la query string"""
+    return (
+        request.GET.getlist('comunas'),
+        request.GET.getlist('provincias'),
+        request.GET.getlist('ano_imputacion'),
+    )
+
+
+def obtener_decretos(request):
+    """Lee el filtro de decreto de la query string (solo lo usa la exportación); '' es "todos"."""
+    return [decreto for decreto in request.GET.getlist('decretos') if decreto]
+
+
+def construir_filtros(comunas, provincias, anos, beneficiario='b', resolucion='r', decretos=None, decreto='d'):
+    """Construye la cláusula WHERE y sus parámetros para los filtros del dashboard.
+
+    `beneficiario`, `resolucion` y `decreto` son los alias de tabla de las columnas filtradas.
+    """
+    filters = []
+    params = []
+
+    if comunas:
+        filters.append("{}.comuna IN ({})".format(beneficiario, ','.join(['%s'] * len(comunas))))
+        params.extend(comunas)
+
+    if provincias:
+        filters.append("{}.provincia IN ({})".format(beneficiario, ','.join(['%s'] * len(provincias))))
+        params.extend(provincias)
+
+    if anos:
+        filters.append("{}.ano_imputacion_res_of IN ({})".format(resolucion, ','.join(['%s'] * len(anos))))
+        params.extend(anos)
+
+    if decretos:
+        filters.append("{}.decreto IN ({})".format(decreto, ','.join(['%s'] * len(decretos))))
+        params.extend(decretos)
+
+    filter_sql = " WHERE " + " AND ".join(filters) if filters else ""
+    return filter_sql, params
+
+
+class ConteoDecretos:
+    """Resultado de la agregación: conteos por (decreto, tipología) normalizados"""
+
+    def __init__(self, filas):
+        self.conteos = {}
+        for decreto, tipologia, total in filas:
+            clave = (normalizar_clave(decreto), normalizar_clave(tipologia))
+            self.conteos[clave] = self.conteos.get(clave, 0) + int(total)
+
+    def get(self, decreto, tipologia):
+        """Conteo de una tipología dentro de un decreto (0 si no hay filas)"""
+        return self.conteos.get((normalizar_clave(decreto), normalizar_clave(tipologia)), 0)
+
+    def blanco(self, decreto):
+        """Conteo de filas del decreto sin tipología (NULL o vacía)"""
+        return self.get(decreto, None)
+
+    def total(self, decreto, incluir_blanco=True):
+        """Suma de las tipologías del catálogo para el decreto, con o sin los blancos"""
+        definicion = catalogo.decreto(decreto)
+        if definicion is None:
+            return 0
+        total = sum(self.get(decreto, t.nombre) for t in definicion.tipologias)
+        if incluir_blanco:
+            total += self.blanco(decreto)
+        return total
+
+    def por_decreto(self, decreto):
+        """Detalle de un decreto: {tipología: conteo, 'blanco': n, 'total': n}"""
+        definicion = catalogo.decreto(decreto)
+        tipologias = definicion.tipologias if definicion else []
+        detalle = {t.nombre: self.get(decreto, t.nombre) for t in tipologias}
+        detalle['blanco'] = self.blanco(decreto)
+        detalle['total'] = self.total(decreto)
+        return detalle
+
+    def serie_grafico(self, decreto):
+        """Datos para Chart.js de un decreto; dict vacío si no está en el catálogo"""
+        definicion = catalogo.decreto(decreto)
+        if definicion is None:
+            return {}
+        return {
+            'labels': [t.etiqueta for t in definicion.tipologias] + ['Sin tipología'],
+            'data': [self.get(decreto, t.nombre) for t in definicion.tipologias] + [self.blanco(decreto)],
+            'title': f'Distribución {definicion.codigo}',
+        }
+
+    def contexto(self, vista):
+        """Variables de plantilla de una vista ('dashboard' o 'filtros') según el catálogo"""
+        incluir_blanco = TOTAL_INCLUYE_BLANCO.get(vista, True)
+        context = {}
+        for decreto in catalogo:
+            for tipologia in decreto.tipologias:
+                if vista in tipologia.variables:
+                    context[tipologia.variables[vista]] = self.get(decreto.codigo, tipologia.nombre)
+            if vista in decreto.variables_blanco:
+                context[decreto.variables_blanco[vista]] = self.blanco(decreto.codigo)
+            if vista in decreto.variables_total:
+                context[decreto.variables_total[vista]] = self.total(decreto.codigo, incluir_blanco)
+        return context
+
+
+def construir_consulta(comunas=None, provincias=None, anos=None):
+    """Genera la consulta GROUP BY sobre el resumen, restringida a los decretos del catálogo"""
+    filter_sql, params = construir_filtros(comunas, provincias, anos, beneficiario='s', resolucion='s')
+
+    condicion_decretos = "s.decreto IN ({})".format(','.join(['%s'] * len(catalogo.codigos)))
+    filter_sql = f"{filter_sql} AND {condicion_decretos}" if filter_sql else f" WHERE {condicion_decretos}"
+    params = params + catalogo.codigos
+
+    query = f"""
+        SELECT s.decreto, s.tipologia, SUM(s.total) FROM resumen_beneficiarios s
+        {filter_sql}
+        GROUP BY s.decreto, s.tipologia
+    """
+    return query, params
+
+
+def contar_por_decreto(comunas=None, provincias=None, anos=None):
+    """Calcula todos los conteos decreto × tipología en una sola pasada GROUP BY.
+
+    El resultado se cachea por conjunto de filtros y versión de los datos.
+    """
+    def calcular():
+        query, params = construir_consulta(comunas, provincias, anos)
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return [(decreto, tipologia, int(total)) for decreto, tipologia, total in cursor.fetchall()]
+
+    filas = obtener_o_calcular('conteos', calcular, comunas=comunas, provincias=provincias, anos=anos)
+    return ConteoDecretos(filas)
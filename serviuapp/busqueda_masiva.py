@@ -0,0 +1,165 @@
+"""
+Búsqueda masiva de RUT.
+
+Recibe cientos de RUT pegados en un cuadro de texto o en una columna de un
+CSV/XLSX, los normaliza y los resuelve con consultas IN sobre el índice de
+rut_normalizado (ver serviuapp.rut), por lotes de TAMANO_LOTE_RUT. El
+resultado se genera lote a lote, en el orden de entrada, para enviarlo como
+tabla HTML en streaming o como planilla XLSX.
+"""
+import csv
+import io
+import os
+import re
+import tempfile
+
+from .rut import TAMANO_LOTE_RUT, buscar_ruts, normalizar_rut
+
+# Límite de RUT por búsqueda, para acotar el trabajo de una sola petición
+MAXIMO_RUTS = 10000
+
+ENCABEZADOS = [
+    'RUT consultado', 'RUT normalizado', 'Estado', 'id', 'Programa', 'Tipología', 'Nombres',
+    'Primer apellido', 'Segundo apellido', 'Comuna', 'Provincia', 'Resolución',
+    'Fecha resolución', 'Selección', 'Año imputación', 'Tramo',
+]
+
+ESTADO_ENCONTRADO = 'Encontrado'
+ESTADO_NO_ENCONTRADO = 'No encontrado'
+ESTADO_INVALIDO = 'RUT inválido'
+ESTADO_REPETIDO = 'Repetido'
+
+
+def leer_ruts_texto(texto):
+    """RUT pegados en texto libre, separados por saltos de línea, espacios, comas o punto y coma"""
+    return [valor for valor in re.split(r'[\s,;]+', texto or '') if valor]
+
+
+def _valor_celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _ruts_de_filas(filas):
+    """Toma la columna 'rut' (y 'dv' si existe) o, sin encabezado, la primera columna"""
+    filas = iter(filas)
+    primera = next(filas, None)
+    if primera is None:
+        return []
+
+    encabezado = [_valor_celda(valor).lower() for valor in primera]
+    if 'rut' in encabezado:
+        columna_rut = encabezado.index('rut')
+        columna_dv = encabezado.index('dv') if 'dv' in encabezado else None
+    else:
+        columna_rut, columna_dv = 0, None
+        filas = [primera, *filas]
+
+    ruts = []
+    for fila in filas:
+        if len(fila) <= columna_rut:
+            continue
+        rut = _valor_celda(fila[columna_rut])
+        if not rut:
+            continue
+        if columna_dv is not None and len(fila) > columna_dv and _valor_celda(fila[columna_dv]):
+            rut = f'{rut}-{_valor_celda(fila[columna_dv])}'
+        ruts.append(rut)
+    return ruts
+
+
+def leer_ruts_archivo(archivo):
+    """RUT de un archivo subido (.csv, .txt o .xlsx)"""
+    extension = os.path.splitext(archivo.name)[1].lower()
+
+    if extension == '.xlsx':
+        from openpyxl import load_workbook
+
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            return _ruts_de_filas(libro.active.iter_rows(values_only=True))
+        finally:
+            libro.close()
+
+    if extension in ('.csv', '.txt'):
+        contenido = archivo.read()
+        try:
+            texto = contenido.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            texto = contenido.decode('latin-1')
+        try:
+            dialecto = csv.Sniffer().sniff(texto[:4096], delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        return _ruts_de_filas(csv.reader(io.StringIO(texto), dialecto))
+
+    raise ValueError('Formato de archivo no soportado: use .csv, .txt o .xlsx')
+
+
+def _fila_resultado(consultado, normalizado, estado, fila=None):
+    if fila is None:
+        return [consultado, normalizado or '', estado] + [''] * (len(ENCABEZADOS) - 3)
+    # Posiciones de COLUMNAS_DETALLE (ver serviuapp.paginacion)
+    return [
+        consultado, normalizado, estado, fila[0], fila[18], fila[19], fila[3], fila[4], fila[5],
+        fila[6], fila[7], fila[12], fila[13], fila[14], fila[15], fila[20],
+    ]
+
+
+def lotes_resultado(entradas, tamano_lote=TAMANO_LOTE_RUT):
+    """Genera las filas de resultado por lotes, en el orden de las entradas.
+
+    Cada RUT consultado produce una fila por registro encontrado, o una sola
+    fila indicando que no se encontró, que es inválido o que ya se consultó.
+    """
+    vistos = set()
+    for inicio in range(0, len(entradas), tamano_lote):
+        lote = [(entrada, normalizar_rut(entrada)) for entrada in entradas[inicio:inicio + tamano_lote]]
+
+        nuevos = []
+        for _, normalizado in lote:
+            if normalizado and normalizado not in vistos:
+                vistos.add(normalizado)
+                nuevos.append(normalizado)
+
+        encontrados = buscar_ruts(nuevos)
+
+        filas = []
+        pendientes = set(nuevos)
+        for entrada, normalizado in lote:
+            if normalizado is None:
+                filas.append(_fila_resultado(entrada, None, ESTADO_INVALIDO))
+            elif normalizado not in pendientes:
+                filas.append(_fila_resultado(entrada, normalizado, ESTADO_REPETIDO))
+            elif normalizado in encontrados:
+                pendientes.discard(normalizado)
+                filas.extend(_fila_resultado(entrada, normalizado, ESTADO_ENCONTRADO, fila)
+                             for fila in encontrados[normalizado])
+            else:
+                pendientes.discard(normalizado)
+                filas.append(_fila_resultado(entrada, normalizado, ESTADO_NO_ENCONTRADO))
+        yield filas
+
+
+def generar_xlsx(entradas):
+    """Archivo temporal (se borra al cerrarlo) con la planilla XLSX de resultados, escrita en modo write-only"""
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Resultados')
+    hoja.append(ENCABEZADOS)
+    for filas in lotes_resultado(entradas):
+        for fila in filas:
+            hoja.append(fila)
+
+    salida = tempfile.TemporaryFile()
+    try:
+        libro.save(salida)
+        salida.seek(0)
+    except BaseException:
+        salida.close()
+        raise
+    return salida
@@ -0,0 +1,248 @@
+"""
+Caché columnar de los archivos Excel importados.
+
+Interpretar el XML de un .xlsx es la parte más lenta de la lectura, y es común
+volver a importar el mismo libro (o revisarlo en seco) varias veces. La
+primera lectura de cada archivo guarda sus celdas en
+SERVIU_CACHE_EXCEL_DIR/<sha256 del archivo>/ como arreglos NumPy (.npy), y
+las siguientes los cargan con mmap en vez de abrir el libro.
+
+Las celdas de openpyxl son de tipos mezclados (None, int, float, bool, str,
+datetime), así que cada columna se guarda como un arreglo int8 con el tipo de
+cada celda más un arreglo por tipo con solo los valores de ese tipo, en orden
+(el texto como UTF-8 de ancho fijo). Al leer se reconstruyen los mismos
+objetos de Python, de modo que la limpieza da exactamente el mismo resultado
+que leyendo el Excel. Si una columna trae otro tipo de celda el archivo no se
+guarda en la caché.
+
+Si se lee una hoja distinta de la activa, la entrada es la de la huella del
+archivo combinada con el nombre de la hoja (ver clave).
+
+La caché se limita a SERVIU_CACHE_EXCEL_MAXIMO bytes: al guardar una entrada
+se eliminan las usadas hace más tiempo (cada lectura actualiza la fecha de
+modificación de su directorio).
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Cambia si cambia el formato de los archivos; las entradas de otra versión se ignoran
+VERSION = 1
+
+# Tamaño máximo de la caché en disco cuando no se configura en settings
+MAXIMO_BYTES = 1024 ** 3
+
+NULO, ENTERO, BOOLEANO, REAL, TEXTO, FECHA = range(6)
+
+# Tipo de celda -> código; cualquier otro tipo hace que el archivo no se guarde
+CODIGOS = {
+    type(None): NULO, int: ENTERO, bool: BOOLEANO, float: REAL, str: TEXTO, datetime: FECHA,
+}
+
+# Arreglo en que se guardan los valores de cada tipo
+ARREGLOS = {ENTERO: 'entero', BOOLEANO: 'booleano', REAL: 'real', TEXTO: 'texto', FECHA: 'fecha'}
+
+METADATOS = 'metadatos.json'
+
+
+class NoCacheable(Exception):
+    """El archivo trae celdas que la caché no sabe guardar"""
+
+
+def directorio_cache():
+    return getattr(settings, 'SERVIU_CACHE_EXCEL_DIR', os.path.join(settings.BASE_DIR, 'tmp', 'cache_excel'))
+
+
+def maximo_bytes():
+    return getattr(settings, 'SERVIU_CACHE_EXCEL_MAXIMO', MAXIMO_BYTES)
+
+
+def cacheable(excel_file_path):
+    """Solo se guardan los .xlsx, que son los que se leen en streaming con openpyxl"""
+    return os.path.splitext(excel_file_path)[1].lower() in ('.xlsx', '.xlsm')
+
+
+def clave(huella, hoja=None):
+    """Clave de la entrada: la huella del archivo, o una derivada de ella y del nombre de la hoja"""
+    if hoja is None:
+        return huella
+    return hashlib.sha256(f'{huella}\x1f{hoja}'.encode('utf-8')).hexdigest()
+
+
+def _codificar(valores):
+    """Arreglos de una columna de un lote: {'tipo': int8, 'entero': int64, ..., 'texto': bytes}"""
+    try:
+        tipos = np.fromiter((CODIGOS[type(valor)] for valor in valores), dtype=np.int8, count=len(valores))
+    except KeyError as e:
+        raise NoCacheable(f"celdas de tipo {e.args[0].__name__}") from None
+
+    arreglos = {'tipo': tipos}
+    try:
+        arreglos['entero'] = np.array([valor for valor, tipo in zip(valores, tipos) if tipo == ENTERO], dtype=np.int64)
+    except OverflowError:
+        raise NoCacheable("enteros de más de 64 bits") from None
+    arreglos['booleano'] = np.array([valor for valor, tipo in zip(valores, tipos) if tipo == BOOLEANO], dtype=bool)
+    arreglos['real'] = np.array([valor for valor, tipo in zip(valores, tipos) if tipo == REAL], dtype=np.float64)
+    arreglos['fecha'] = np.array([valor for valor, tipo in zip(valores, tipos) if tipo == FECHA], dtype='datetime64[us]')
+    textos = [valor for valor, tipo in zip(valores, tipos) if tipo == TEXTO]
+    arreglos['texto'] = np.char.encode(np.array(textos, dtype=str), 'utf-8') if textos else np.array([], dtype='S1')
+    return arreglos
+
+
+def _decodificar(tipos, valores):
+    """Columna object de un lote a partir de sus tipos y {código: valores de ese tipo en el lote}"""
+    columna = np.full(len(tipos), None, dtype=object)
+    for codigo in ARREGLOS:
+        mascara = tipos == codigo
+        if not mascara.any():
+            continue
+        datos = valores[codigo]
+        if codigo == TEXTO:
+            columna[mascara] = np.char.decode(datos, 'utf-8')
+        elif codigo == FECHA:
+            columna[mascara] = datos.astype(object)
+        else:
+            columna[mascara] = datos
+    return columna
+
+
+def _ruta(huella):
+    return os.path.join(directorio_cache(), huella)
+
+
+def _metadatos(ruta):
+    try:
+        with open(os.path.join(ruta, METADATOS), encoding='utf-8') as archivo:
+            metadatos = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    return metadatos if metadatos.get('version') == VERSION else None
+
+
+def leer(huella, batch_size=1000):
+    """Lotes del archivo desde la caché, iguales a los de leer_excel_por_lotes; None si no está"""
+    ruta = _ruta(huella)
+    metadatos = _metadatos(ruta)
+    if metadatos is None:
+        return None
+    os.utime(ruta)
+    return _lotes_cache(ruta, metadatos, batch_size)
+
+
+def _lotes_cache(ruta, metadatos, batch_size):
+    def cargar(nombre):
+        return np.load(os.path.join(ruta, nombre), mmap_mode='r')
+
+    encabezados = metadatos['columnas']
+    indices = cargar('indices.npy')
+    columnas = []
+    for posicion in range(len(encabezados)):
+        tipos = cargar(f'c{posicion}_tipo.npy')
+        arreglos = {codigo: cargar(f'c{posicion}_{nombre}.npy') for codigo, nombre in ARREGLOS.items()}
+        # Valores de cada tipo que ya se entregaron (los arreglos por tipo van en orden de fila)
+        columnas.append((tipos, arreglos, dict.fromkeys(ARREGLOS, 0)))
+
+    for inicio in range(0, len(indices), batch_size):
+        datos = []
+        for tipos, arreglos, entregados in columnas:
+            tipos_lote = np.asarray(tipos[inicio:inicio + batch_size])
+            valores = {}
+            for codigo, arreglo in arreglos.items():
+                cantidad = int((tipos_lote == codigo).sum())
+                valores[codigo] = arreglo[entregados[codigo]:entregados[codigo] + cantidad]
+                entregados[codigo] += cantidad
+            datos.append(_decodificar(tipos_lote, valores))
+        yield pd.DataFrame(
+            dict(enumerate(datos)), index=np.asarray(indices[inicio:inicio + batch_size]).tolist(), dtype=object,
+        ).set_axis(encabezados, axis=1)
+
+
+class Escritura:
+    """Acumula los lotes codificados de un archivo y los guarda en la caché al terminar"""
+
+    def __init__(self, huella):
+        self.huella = huella
+        self.columnas = None
+        self.indices = []
+        self.partes = []
+
+    def agregar(self, batch_df):
+        if self.columnas is None:
+            self.columnas = [str(columna) for columna in batch_df.columns]
+        self.indices.append(np.asarray(batch_df.index, dtype=np.int64))
+        self.partes.append([_codificar(batch_df.iloc[:, posicion].tolist()) for posicion in range(batch_df.shape[1])])
+
+    def guardar(self):
+        """Escribe la entrada en un directorio temporal y la renombra (otra lectura puede estar guardando la misma)"""
+        if self.columnas is None:
+            return
+        directorio = directorio_cache()
+        os.makedirs(directorio, exist_ok=True)
+        temporal = os.path.join(directorio, f'.{self.huella}.{uuid.uuid4().hex}')
+        os.makedirs(temporal)
+        try:
+            np.save(os.path.join(temporal, 'indices.npy'), np.concatenate(self.indices))
+            for posicion in range(len(self.columnas)):
+                partes = [lote[posicion] for lote in self.partes]
+                for nombre in ('tipo', *ARREGLOS.values()):
+                    np.save(os.path.join(temporal, f'c{posicion}_{nombre}.npy'),
+                            np.concatenate([parte[nombre] for parte in partes]))
+            with open(os.path.join(temporal, METADATOS), 'w', encoding='utf-8') as archivo:
+                json.dump({'version': VERSION, 'columnas': self.columnas}, archivo)
+            os.replace(temporal, _ruta(self.huella))
+        except OSError:
+            # Ya existe (la guardó otra lectura) o no hay espacio: la caché es opcional
+            shutil.rmtree(temporal, ignore_errors=True)
+            return
+        logger.info(f"Archivo guardado en la caché ({_tamano(_ruta(self.huella)) / 1024 ** 2:.1f} MB)")
+        desalojar(conservar=self.huella)
+
+
+def leer_guardando(huella, lotes):
+    """Entrega los lotes leídos del Excel y, si se leyeron todos, los guarda en la caché"""
+    escritura = Escritura(huella)
+    for batch_df in lotes:
+        if escritura is not None:
+            try:
+                escritura.agregar(batch_df)
+            except NoCacheable as e:
+                logger.info(f"El archivo no se guarda en la caché: {e}")
+                escritura = None
+        yield batch_df
+    if escritura is not None:
+        escritura.guardar()
+
+
+def _tamano(ruta):
+    return sum(entrada.stat().st_size for entrada in os.scandir(ruta) if entrada.is_file())
+
+
+def desalojar(conservar=None):
+    """Elimina las entradas usadas hace más tiempo hasta que la caché quepa en maximo_bytes()"""
+    directorio = directorio_cache()
+    try:
+        entradas = [entrada for entrada in os.scandir(directorio) if entrada.is_dir() and not entrada.name.startswith('.')]
+    except FileNotFoundError:
+        return 0
+    entradas = sorted(((entrada.stat().st_mtime, entrada.path, _tamano(entrada.path)) for entrada in entradas))
+    total = sum(tamano for _, _, tamano in entradas)
+    eliminadas = 0
+    for _, ruta, tamano in entradas:
+        if total <= maximo_bytes():
+            break
+        if os.path.basename(ruta) == conservar:
+            continue
+        shutil.rmtree(ruta, ignore_errors=True)
+        total -= tamano
+        eliminadas += 1
+    return eliminadas
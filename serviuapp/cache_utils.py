@@ -0,0 +1,77 @@
+"""
+Caché versionada para las respuestas del dashboard, filtros y gráficos.
+
+Las claves se arman con el conjunto de filtros normalizado y ordenado más una
+marca de versión de los datos. Cada importación o edición de beneficiario
+incrementa la marca, por lo que las entradas anteriores dejan de usarse en
+el acto sin depender de un TTL; el backend LRU las descarta por tamaño.
+
+La marca vive en un archivo (settings.SERVIU_VERSION_DATOS_PATH) y no en la
+caché: así la ven todos los workers de gunicorn y también el importador de
+línea de comandos, aunque cada proceso tenga su propia caché en memoria.
+"""
+import hashlib
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _ruta_version():
+    return getattr(settings, 'SERVIU_VERSION_DATOS_PATH',
+                   os.path.join(settings.BASE_DIR, 'tmp', 'data_version'))
+
+
+def version_datos():
+    """Marca de versión actual de los datos ('0' si nunca se ha invalidado)"""
+    try:
+        with open(_ruta_version(), 'r') as archivo:
+            return archivo.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def invalidar_cache():
+    """Incrementa la marca de versión; las respuestas cacheadas quedan obsoletas"""
+    ruta = _ruta_version()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    # Escritura atómica para que ningún worker lea un archivo a medio escribir
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'w') as archivo:
+        archivo.write(str(time.time_ns()))
+    os.replace(temporal, ruta)
+
+
+def normalizar_filtros(**filtros):
+    """Filtros sin vacíos ni duplicados, con sus valores ordenados"""
+    normalizados = {}
+    for nombre, valores in filtros.items():
+        if not valores:
+            continue
+        if isinstance(valores, (list, tuple, set)):
+            limpios = sorted({str(v).strip() for v in valores if str(v).strip()})
+        else:
+            limpios = str(valores).strip()
+        if limpios:
+            normalizados[nombre] = limpios
+    return normalizados
+
+
+def clave_cache(prefijo, **filtros):
+    """Clave de caché para un conjunto de filtros en la versión actual de los datos"""
+    filtros_json = json.dumps(normalizar_filtros(**filtros), sort_keys=True, ensure_ascii=False)
+    resumen = hashlib.sha1(filtros_json.encode('utf-8')).hexdigest()
+    return f'serviu:{prefijo}:{version_datos()}:{resumen}'
+
+
+def obtener_o_calcular(prefijo, calcular, **filtros):
+    """Devuelve el valor cacheado para los filtros o lo calcula y guarda"""
+    clave = clave_cache(prefijo, **filtros)
+    valor = cache.get(clave)
+    if valor is None:
+        valor = calcular()
+        cache.set(clave, valor)
+    return valor
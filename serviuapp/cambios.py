@@ -0,0 +1,91 @@
+"""
+Consultas sobre los cambios de beneficiario (reemplazos, sustituciones,
+eliminaciones y renuncias) que trae el Excel.
+
+cambios_beneficiario guarda el RUT normalizado del beneficiario anterior y el
+del nuevo, cada uno con su índice, así que saber quién reemplazó a un RUT (o a
+quién reemplazó) es una consulta por igualdad sobre esos índices. Los conteos
+por tipo del dashboard son un GROUP BY tipo sobre el índice (tipo,
+cambio_id_beneficiario); solo se une con beneficiarios o resoluciones cuando
+hay filtros de comuna/provincia o de año.
+"""
+from django.db import connection
+
+from .aggregations import construir_filtros
+from .cache_utils import obtener_o_calcular
+from .models import CambioBeneficiario
+from .rut import normalizar_rut
+
+# Columnas de cada cambio que devuelve buscar_cambios, con el nombre y apellido del beneficiario anterior
+COLUMNAS_CAMBIO = (
+    ('id_cambio', 'c.id_cambio'), ('tipo', 'c.tipo'), ('id_beneficiario', 'c.cambio_id_beneficiario'),
+    ('rut_anterior', 'c.rut_anterior'), ('nombres_anterior', 'b.nombres'),
+    ('primer_apellido_anterior', 'b.primer_apellido'), ('rut_nuevo', 'c.rut_nuevo_normalizado'),
+    ('nombres_nuevo', 'c.nombres_nuevo'), ('primer_apellido_nuevo', 'c.primer_apellido_nuevo'),
+    ('segundo_apellido_nuevo', 'c.segundo_apellido_nuevo'), ('resolucion', 'c.resolucion'),
+    ('fecha_resolucion', 'c.fecha_resolucion'),
+)
+
+_SELECT_CAMBIOS = (
+    "SELECT " + ', '.join(columna for _, columna in COLUMNAS_CAMBIO)
+    + " FROM cambios_beneficiario c JOIN beneficiarios b ON b.id_beneficiario = c.cambio_id_beneficiario"
+)
+
+# Cambios de un RUT normalizado (dos veces el mismo parámetro): como anterior y como nuevo
+CAMBIOS_POR_RUT = (
+    f"{_SELECT_CAMBIOS} WHERE c.rut_anterior = %s"
+    f" UNION ALL {_SELECT_CAMBIOS} WHERE c.rut_nuevo_normalizado = %s ORDER BY 1"
+)
+
+ETIQUETAS_TIPO = dict(CambioBeneficiario.TIPOS)
+
+
+def buscar_cambios(rut):
+    """Cambios en que el RUT es el beneficiario anterior o el nuevo, en una consulta.
+
+    Cada mitad del UNION ALL usa el índice de su columna. Devuelve dicts con
+    las claves de COLUMNAS_CAMBIO más 'etiqueta' (el tipo para mostrar).
+    """
+    normalizado = normalizar_rut(rut)
+    if normalizado is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(CAMBIOS_POR_RUT, [normalizado, normalizado])
+        filas = cursor.fetchall()
+
+    cambios = []
+    for fila in filas:
+        cambio = dict(zip((nombre for nombre, _ in COLUMNAS_CAMBIO), fila))
+        cambio['etiqueta'] = ETIQUETAS_TIPO.get(cambio['tipo'], cambio['tipo'])
+        cambios.append(cambio)
+    return cambios
+
+
+def construir_consulta(comunas=None, provincias=None, anos=None):
+    """GROUP BY tipo sobre los cambios, uniendo solo las tablas que piden los filtros"""
+    filter_sql, params = construir_filtros(comunas, provincias, anos)
+    joins = ""
+    if comunas or provincias:
+        joins += " JOIN beneficiarios b ON b.id_beneficiario = c.cambio_id_beneficiario"
+    if anos:
+        joins += " JOIN resoluciones r ON r.resolucion_id_beneficiario = c.cambio_id_beneficiario"
+    query = f"SELECT c.tipo, COUNT(*) FROM cambios_beneficiario c{joins}{filter_sql} GROUP BY c.tipo"
+    return query, params
+
+
+def contar_cambios(comunas=None, provincias=None, anos=None):
+    """Cambios por tipo con los filtros del dashboard: [{'tipo', 'etiqueta', 'total'}] en el orden de TIPOS.
+
+    El resultado se cachea por conjunto de filtros y versión de los datos.
+    """
+    def calcular():
+        query, params = construir_consulta(comunas, provincias, anos)
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return {tipo: int(total) for tipo, total in cursor.fetchall()}
+
+    totales = obtener_o_calcular('cambios', calcular, comunas=comunas, provincias=provincias, anos=anos)
+    return [
+        {'tipo': tipo, 'etiqueta': etiqueta, 'total': totales.get(tipo, 0)}
+        for tipo, etiqueta in CambioBeneficiario.TIPOS
+    ]
@@ -0,0 +1,136 @@
+"""
+Catálogo declarativo de decretos y tipologías.
+
+Única fuente de verdad para los pares decreto/tipología que muestran el
+dashboard, filtros y los gráficos. Se carga una vez al importar el módulo y
+se indexa por claves normalizadas, de modo que 'avc', 'AVC' o 'TERMICO' y
+'TÉRMICO' resuelven al mismo bucket. Agregar una tipología consiste en añadir
+una línea aquí: la consulta agregada y los contextos de las plantillas se
+generan a partir de este catálogo.
+"""
+import unicodedata
+
+
+def normalizar_clave(valor):
+    """Normaliza decreto/tipología: mayúsculas, sin espacios extremos ni tildes.
+
+    Equivale a la comparación case/accent-insensitive de la collation de MySQL.
+    NULL y '' normalizan a '' (bucket "blanco").
+    """
+    if valor is None:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(valor).strip().upper())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+class Tipologia:
+    """Bucket de conteo: una tipología dentro de un decreto"""
+
+    def __init__(self, nombre, etiqueta=None, **variables):
+        self.nombre = nombre
+        self.clave = normalizar_clave(nombre)
+        self.etiqueta = etiqueta or nombre
+        # Nombre de la variable de plantilla por vista, ej. dashboard='avc_ds1'
+        self.variables = variables
+
+
+class Decreto:
+    """Decreto con sus tipologías y las variables de plantilla de sus totales"""
+
+    def __init__(self, codigo, tipologias, total=None, blanco=None):
+        self.codigo = codigo
+        self.clave = normalizar_clave(codigo)
+        self.tipologias = tipologias
+        self.variables_total = total or {}
+        self.variables_blanco = blanco or {}
+
+
+# En el dashboard los totales incluyen los registros sin tipología; en filtros no
+TOTAL_INCLUYE_BLANCO = {
+    'dashboard': True,
+    'filtros': False,
+}
+
+DECRETOS = [
+    Decreto('DS-1', [
+        Tipologia('ARRIENDO GLOSA 03', 'Arriendo glosa 03', dashboard='ag_ds1', filtros='ds1_arriendog3_total_count'),
+        Tipologia('AVC', dashboard='avc_ds1', filtros='ds1_avc_total_count'),
+        Tipologia('CSP', dashboard='csp_ds1', filtros='ds1_csp_total_count'),
+    ], total={'dashboard': 'total_count_ds1', 'filtros': 'ds1_total'}, blanco={'dashboard': 'blanco_ds1'}),
+
+    Decreto('DS-10', [
+        Tipologia('CCH', dashboard='cch_ds10', filtros='ds10_cch_total_count'),
+        Tipologia('CSR', dashboard='csr_ds10', filtros='ds10_csr_total_count'),
+        Tipologia('MAVE', dashboard='mave_ds10', filtros='ds10_mave_total_count'),
+    ], total={'dashboard': 'total_count_ds10', 'filtros': 'ds10_total'}, blanco={'dashboard': 'blanco_ds10'}),
+
+    Decreto('DS-19', [
+        Tipologia('PIST', dashboard='pist_ds19', filtros='ds19_pist_total_count'),
+    ], total={'dashboard': 'total_count_ds19'}, blanco={'dashboard': 'blanco_ds19'}),
+
+    Decreto('DS-27', [
+        Tipologia('CAP I', dashboard='cap1_ds27', filtros='ds27_cap1_total_count'),
+        Tipologia('CAP II', dashboard='cap2_ds27', filtros='ds27_cap2_total_count'),
+        Tipologia('CAP III', dashboard='cap3_ds27', filtros='ds27_cap3_total_count'),
+    ], total={'dashboard': 'total_count_ds27', 'filtros': 'ds27_total'}, blanco={'dashboard': 'blanco_ds27'}),
+
+    Decreto('DS-49', [
+        Tipologia('AVC', dashboard='avc_ds49', filtros='ds49_avc_total_count'),
+        Tipologia('CNT', dashboard='cnt_ds49', filtros='ds49_cnt_total_count'),
+        Tipologia('CNT INDUST', dashboard='cnti_ds49', filtros='ds49_cnti_total_count'),
+        Tipologia('CSP', dashboard='csp_ds49', filtros='ds49_csp_total_count'),
+    ], total={'dashboard': 'total_count_ds49', 'filtros': 'ds49_total'}, blanco={'dashboard': 'blanco_ds49'}),
+
+    Decreto('DS-52', [
+        Tipologia('ARRIENDO', dashboard='arriendo_ds52', filtros='ds52_arriendo_total_count'),
+    ], total={'dashboard': 'total_count_ds52'}, blanco={'dashboard': 'blanco_ds52'}),
+
+    Decreto('DS-255', [
+        Tipologia('CALEFACTOR', dashboard='calefactor_ds255', filtros='ds255_calefactor_total_count'),
+        Tipologia('CC.SS', dashboard='ccss_ds255', filtros='ds255_ccss_total_count'),
+        Tipologia('COLECTOR', dashboard='colector_ds255', filtros='ds255_colector_total_count'),
+        Tipologia('FOTOVOLTAICO', dashboard='fotov_ds255', filtros='ds255_fotov_total_count'),
+        Tipologia('MEJORAMIENTO', dashboard='mejoramiento_ds255', filtros='ds255_mejoramiento_total_count'),
+        Tipologia('PDA', dashboard='pda_ds255', filtros='ds255_pda_total_count'),
+        Tipologia('TBM', dashboard='tbm_ds255', filtros='ds255_tbm_total_count'),
+        Tipologia('TÉRMICO', dashboard='termico_ds255', filtros='ds255_termico_total_count'),
+        Tipologia('TÉRMICO PDA', dashboard='termicopda_ds255', filtros='ds255_termicopda_total_count'),
+    ], total={'dashboard': 'total_count_ds255', 'filtros': 'ds255_total'}, blanco={'dashboard': 'blanco_ds255'}),
+
+    # Leasing
+    Decreto('DS-120', [
+        Tipologia('AVC', dashboard='avc_leasing', filtros='ls_avc_total_count'),
+    ]),
+]
+
+
+class Catalogo:
+    """Índice en memoria del catálogo por claves normalizadas"""
+
+    def __init__(self, decretos):
+        self.decretos = {decreto.clave: decreto for decreto in decretos}
+        self.codigos = [decreto.codigo for decreto in decretos]
+
+    def __iter__(self):
+        return iter(self.decretos.values())
+
+    def __contains__(self, codigo):
+        return normalizar_clave(codigo) in self.decretos
+
+    def decreto(self, codigo):
+        """Definición de un decreto, o None si no está en el catálogo"""
+        return self.decretos.get(normalizar_clave(codigo))
+
+    def tipologia(self, codigo, tipologia):
+        """Definición de un bucket decreto/tipología, o None si no existe"""
+        decreto = self.decreto(codigo)
+        if decreto is None:
+            return None
+        clave = normalizar_clave(tipologia)
+        for definicion in decreto.tipologias:
+            if definicion.clave == clave:
+                return definicion
+        return None
+
+
+catalogo = Catalogo(DECRETOS)
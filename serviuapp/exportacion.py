@@ -0,0 +1,181 @@
+"""
+Exportación del JOIN beneficiarios/resoluciones/decretos con los filtros de
+la página de filtros (comuna, provincia, año de imputación y decreto).
+
+Las filas se leen con un cursor del lado del servidor (ver cursor_servidor)
+en lotes de TAMANO_LOTE_EXPORTACION, así que la memoria no depende del
+tamaño de la exportación:
+
+- CSV: cada lote se envía apenas se lee (StreamingHttpResponse), la descarga
+  empieza con la primera fila.
+- XLSX: libro write-only de openpyxl, que va escribiendo las filas a disco;
+  el .xlsx es un zip que solo se puede cerrar al final, así que se arma en un
+  archivo temporal y se envía al terminar.
+- Parquet: un row group por lote con pyarrow, también en un archivo temporal.
+  pyarrow es opcional; sin él el formato no está disponible.
+"""
+import csv
+import importlib
+import importlib.util
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .aggregations import construir_filtros
+from .paginacion import FROM_DETALLE
+
+# Columnas del JOIN que se exportan (nombre, columna SQL, tipo en Parquet), sin las FK repetidas
+COLUMNAS_EXPORTACION = (
+    ('id_beneficiario', 'b.id_beneficiario', 'entero'),
+    ('rut', 'b.rut', 'texto'),
+    ('dv', 'b.dv', 'texto'),
+    ('nombres', 'b.nombres', 'texto'),
+    ('primer_apellido', 'b.primer_apellido', 'texto'),
+    ('segundo_apellido', 'b.segundo_apellido', 'texto'),
+    ('comuna', 'b.comuna', 'texto'),
+    ('provincia', 'b.provincia', 'texto'),
+    ('codigo_proyecto', 'b.codigo_proyecto', 'texto'),
+    ('nombre_grupo', 'b.nombre_grupo', 'texto'),
+    ('sexo', 'b.sexo', 'texto'),
+    ('id_resolucion', 'r.id_resolucion', 'entero'),
+    ('resolucion', 'r.resolucion', 'entero'),
+    ('fecha_resolucion', 'r.fecha_resolucion', 'fecha'),
+    ('seleccion', 'r.seleccion', 'texto'),
+    ('ano_imputacion', 'r.ano_imputacion_res_of', 'entero'),
+    ('id_decreto', 'd.id_decreto', 'entero'),
+    ('decreto', 'd.decreto', 'texto'),
+    ('tipologia', 'd.tipologia', 'texto'),
+    ('tramo', 'd.tramo', 'entero'),
+)
+
+ENCABEZADOS_EXPORTACION = [nombre for nombre, _, _ in COLUMNAS_EXPORTACION]
+
+# Solo por la clave primaria de beneficiarios: MySQL puede recorrerla en orden
+# y entregar la primera fila sin ordenar antes el JOIN completo
+ORDEN_EXPORTACION = " ORDER BY b.id_beneficiario"
+
+# Filas por fetchmany (y por row group en Parquet)
+TAMANO_LOTE_EXPORTACION = 5000
+
+# Filas de datos por hoja XLSX (el máximo de Excel es 1.048.576 con el encabezado)
+FILAS_POR_HOJA = 1048575
+
+# formato -> (content type, extensión)
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_disponible():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def construir_consulta(comunas=None, provincias=None, anos=None, decretos=None):
+    """SELECT de las columnas exportadas con los filtros, en orden de beneficiario"""
+    filter_sql, params = construir_filtros(comunas, provincias, anos, decretos=decretos)
+    columnas = ', '.join(columna for _, columna, _ in COLUMNAS_EXPORTACION)
+    return f"SELECT {columnas}{FROM_DETALLE}{filter_sql}{ORDEN_EXPORTACION}", params
+
+
+@contextmanager
+def cursor_servidor():
+    """Cursor que trae las filas desde el servidor a medida que se leen.
+
+    El cursor de Django sobre MySQL guarda el resultado completo en el cliente
+    al ejecutar la consulta, así que se abre un SSCursor del driver (PyMySQL o
+    mysqlclient) sobre la misma conexión; mientras se lee no se pueden hacer
+    otras consultas en ella. En PostgreSQL chunked_cursor ya es un cursor con
+    nombre, y en SQLite el cursor normal avanza paso a paso.
+    """
+    if connection.vendor == 'mysql':
+        connection.ensure_connection()
+        crudo = connection.connection
+        driver = importlib.import_module(type(crudo).__module__.rsplit('.', 1)[0] + '.cursors')
+        cursor = crudo.cursor(driver.SSCursor)
+    else:
+        cursor = connection.chunked_cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def iterar_filas(comunas=None, provincias=None, anos=None, decretos=None, tamano_lote=TAMANO_LOTE_EXPORTACION):
+    """Filas exportadas (en el orden de COLUMNAS_EXPORTACION) en lotes de `tamano_lote`"""
+    query, params = construir_consulta(comunas, provincias, anos, decretos)
+    with cursor_servidor() as cursor:
+        cursor.execute(query, params)
+        while True:
+            filas = cursor.fetchmany(tamano_lote)
+            if not filas:
+                return
+            yield filas
+
+
+class _Eco:
+    """Archivo para csv.writer que devuelve cada línea en vez de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(comunas=None, provincias=None, anos=None, decretos=None):
+    """Texto CSV por lotes, con BOM para que Excel lo abra como UTF-8"""
+    escritor = csv.writer(_Eco())
+    yield '\ufeff' + escritor.writerow(ENCABEZADOS_EXPORTACION)
+    for filas in iterar_filas(comunas, provincias, anos, decretos):
+        yield ''.join(escritor.writerow(fila) for fila in filas)
+
+
+def _temporal(escribir):
+    """Archivo temporal (se borra al cerrarlo) con lo que escribe `escribir`, listo para leer"""
+    archivo = tempfile.TemporaryFile()
+    try:
+        escribir(archivo)
+        archivo.seek(0)
+    except BaseException:
+        archivo.close()
+        raise
+    return archivo
+
+
+def exportar_xlsx(comunas=None, provincias=None, anos=None, decretos=None):
+    """Archivo temporal con la planilla XLSX, escrita en modo write-only"""
+    from openpyxl import Workbook
+
+    def escribir(archivo):
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet('Beneficiarios')
+        hoja.append(ENCABEZADOS_EXPORTACION)
+        filas_hoja = 0
+        for filas in iterar_filas(comunas, provincias, anos, decretos):
+            for fila in filas:
+                if filas_hoja == FILAS_POR_HOJA:
+                    hoja = libro.create_sheet(f'Beneficiarios {len(libro.worksheets) + 1}')
+                    hoja.append(ENCABEZADOS_EXPORTACION)
+                    filas_hoja = 0
+                hoja.append(fila)
+                filas_hoja += 1
+        libro.save(archivo)
+
+    return _temporal(escribir)
+
+
+def exportar_parquet(comunas=None, provincias=None, anos=None, decretos=None):
+    """Archivo temporal con el Parquet, un row group por lote (requiere pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = {'entero': pa.int64(), 'texto': pa.string(), 'fecha': pa.date32()}
+    esquema = pa.schema([(nombre, tipos[tipo]) for nombre, _, tipo in COLUMNAS_EXPORTACION])
+
+    def escribir(archivo):
+        with pq.ParquetWriter(archivo, esquema) as escritor:
+            for filas in iterar_filas(comunas, provincias, anos, decretos):
+                columnas = [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*filas), esquema)]
+                escritor.write_table(pa.Table.from_arrays(columnas, schema=esquema))
+
+    return _temporal(escribir)
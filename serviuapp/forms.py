@@ -2,6 +2,7 @@ from django import forms
 from serviuapp.models import Beneficiarios
 from serviuapp.models import Resoluciones
 from serviuapp.models import Decretos
+from serviuapp.resumen import registrar_cambios
 from datetime import datetime
 
 class FormBeneficiarios(forms.ModelForm):
@@ -130,7 +131,8 @@ class FormBeneficiarios(forms.ModelForm):
             instance.nombre_grupo = original_instance.nombre_grupo
         
         if commit:
-            instance.save()
+            with registrar_cambios(instance):
+                instance.save()
         return instance
         
         
@@ -227,7 +229,8 @@ class FormResoluciones(forms.ModelForm):
             instance.ano_imputacion_res_of = original_instance.ano_imputacion_res_of
         
         if commit:
-            instance.save()
+            with registrar_cambios(instance):
+                instance.save()
         return instance
 
         
@@ -311,5 +314,6 @@ class FormDecretos(forms.ModelForm):
             instance.tramo = original_instance.tramo
         
         if commit:
-            instance.save()
+            with registrar_cambios(instance):
+                instance.save()
         return instance
\ No newline at end of file
@@ -0,0 +1,1441 @@
+"""
+Importación de beneficiarios desde Excel.
+
+Núcleo compartido por excel_importer.py y el comando import_data. El archivo
+se procesa en un pipeline de tres etapas unidas por colas acotadas: lectura por
+lotes en streaming, limpieza vectorizada (en un pool de procesos) y escritura
+con la conexión propia del hilo escritor. La escritura usa bulk_create del ORM
+o, con carga='nativa', LOAD DATA LOCAL INFILE desde archivos TSV temporales
+(INSERT de varias filas si la base no es MySQL).
+
+En modo incremental no se borra nada: cada fila lleva una huella (MD5 de sus
+valores limpios) guardada en beneficiarios.huella, y solo las filas nuevas o
+con otra huella se escriben con upsert. Los beneficiarios que ya no vienen en
+el archivo se eliminan dejando una lápida en bajas_beneficiarios.
+"""
+import collections
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from openpyxl import load_workbook
+from tqdm import tqdm
+
+from . import cache_excel, puntos_control, tablas_sombra, validacion
+from .catalog import normalizar_clave
+from .models import BajaBeneficiario, Beneficiarios, CambioBeneficiario, Decretos, Resoluciones
+from .opciones_importacion import CARGAS, MODOS
+from .resumen import reconstruir_resumen
+
+logger = logging.getLogger(__name__)
+
+# Columnas de texto y su largo máximo en los modelos
+COLUMNAS_TEXTO = {
+    'rut': 50,
+    'dv': 10,
+    'nombres': 255,
+    'primer_apellido': 100,
+    'segundo_apellido': 100,
+    'comuna': 100,
+    'provincia': 100,
+    'codigo_proyecto': 100,
+    'nombre_grupo': 255,
+    'sexo': 10,
+    'decreto': 10,
+    'tipologia': 50,
+    'seleccion': 50,
+    'tipo_cambio': 20,
+    'rut_nuevo': 50,
+    'dv_nuevo': 10,
+    'nombres_nuevo': 255,
+    'primer_apellido_nuevo': 100,
+    'segundo_apellido_nuevo': 100,
+}
+COLUMNAS_ENTERAS = ['id_beneficiario', 'resolucion', 'tramo', 'ano_imputacion_res_of', 'resolucion_cambio']
+COLUMNAS_FECHA = ['fecha_resolucion', 'fecha_resolucion_cambio']
+
+# Encabezados del Excel con el cambio de beneficiario (en minúsculas, se comparan
+# sin distinguir mayúsculas) y la columna del lote limpio que les corresponde
+COLUMNAS_CAMBIO = {
+    'reemplazo/sustitucion/eliminacion/renuncia': 'tipo_cambio',
+    'rut_nuevo_beneficiario': 'rut_nuevo',
+    'dv2': 'dv_nuevo',
+    'nombre': 'nombres_nuevo',
+    'apellido1': 'primer_apellido_nuevo',
+    'apellido2': 'segundo_apellido_nuevo',
+    'res. n°': 'resolucion_cambio',
+    'fecha_res': 'fecha_resolucion_cambio',
+}
+
+# Tipos de cambio por su clave normalizada (ver catalog.normalizar_clave)
+TIPOS_CAMBIO = {normalizar_clave(tipo): tipo for tipo, _ in CambioBeneficiario.TIPOS}
+
+# Columnas que forman la huella de una fila; si cualquiera cambia, la fila se reescribe
+COLUMNAS_HUELLA = list(COLUMNAS_TEXTO) + COLUMNAS_ENTERAS + COLUMNAS_FECHA
+SEPARADOR_HUELLA = '\x1f'
+
+# Formatos de fecha en texto, en orden de prioridad
+FORMATOS_FECHA = ['%d-%m-%Y', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y']
+
+# Excel cuenta los días desde 1900-01-01 con el 29-02-1900 inexistente: hasta el
+# día 59 el origen efectivo es 1899-12-31 y desde el 60 es 1899-12-30
+ORIGEN_EXCEL = '1899-12-30'
+ULTIMO_DIA_ANTES_BUG_1900 = 59
+
+# Filas de muestra por columna en el reporte de celdas rechazadas
+MUESTRA_RECHAZOS = 5
+
+# Lotes en espera entre una etapa del pipeline y la siguiente; si una etapa es
+# más lenta, las anteriores se detienen al llenarse la cola (backpressure)
+LOTES_EN_COLA = 4
+
+# Tope de procesos de limpieza cuando no se indica --procesos
+MAXIMO_PROCESOS_LIMPIEZA = 4
+
+# Segundos entre revisiones de la señal de detención mientras se espera una cola
+ESPERA_COLA = 0.2
+
+# Columnas de cada tabla y la columna del lote limpio de donde salen, en orden
+# de inserción (carga nativa); decreto, resolución y cambio usan el id del beneficiario
+TABLAS_CARGA = (
+    ('beneficiarios', (
+        ('id_beneficiario', 'id_beneficiario'), ('rut', 'rut'), ('dv', 'dv'), ('nombres', 'nombres'),
+        ('primer_apellido', 'primer_apellido'), ('segundo_apellido', 'segundo_apellido'),
+        ('comuna', 'comuna'), ('provincia', 'provincia'), ('codigo_proyecto', 'codigo_proyecto'),
+        ('nombre_grupo', 'nombre_grupo'), ('sexo', 'sexo'), ('rut_normalizado', 'rut_normalizado'),
+        ('huella', 'huella'),
+    )),
+    ('decretos', (
+        ('id_decreto', 'id_beneficiario'), ('decreto', 'decreto'), ('tipologia', 'tipologia'),
+        ('tramo', 'tramo'), ('decreto_id_beneficiario', 'id_beneficiario'),
+    )),
+    ('resoluciones', (
+        ('id_resolucion', 'id_beneficiario'), ('resolucion', 'resolucion'),
+        ('fecha_resolucion', 'fecha_resolucion'), ('seleccion', 'seleccion'),
+        ('ano_imputacion_res_of', 'ano_imputacion_res_of'), ('resolucion_id_beneficiario', 'id_beneficiario'),
+    )),
+    ('cambios_beneficiario', (
+        ('id_cambio', 'id_beneficiario'), ('tipo', 'tipo_cambio'), ('rut_anterior', 'rut_normalizado'),
+        ('rut_nuevo', 'rut_nuevo'), ('dv_nuevo', 'dv_nuevo'), ('rut_nuevo_normalizado', 'rut_nuevo_normalizado'),
+        ('nombres_nuevo', 'nombres_nuevo'), ('primer_apellido_nuevo', 'primer_apellido_nuevo'),
+        ('segundo_apellido_nuevo', 'segundo_apellido_nuevo'), ('resolucion', 'resolucion_cambio'),
+        ('fecha_resolucion', 'fecha_resolucion_cambio'), ('cambio_id_beneficiario', 'id_beneficiario'),
+    )),
+)
+
+# Tablas de TABLAS_CARGA que solo reciben las filas con cambio de beneficiario
+TABLAS_SOLO_CAMBIOS = {'cambios_beneficiario'}
+
+# Filas acumuladas en los TSV antes de cada LOAD DATA
+FILAS_POR_CARGA = 50000
+
+# Filas por sentencia INSERT cuando la base no informa un máximo de parámetros
+FILAS_POR_INSERT = 1000
+
+# Campos que reescribe el upsert de la importación incremental
+CAMPOS_BENEFICIARIO = [
+    'rut', 'dv', 'nombres', 'primer_apellido', 'segundo_apellido', 'comuna', 'provincia',
+    'codigo_proyecto', 'nombre_grupo', 'sexo', 'rut_normalizado', 'huella',
+]
+CAMPOS_DECRETO = ['decreto', 'tipologia', 'tramo', 'decreto_id_beneficiario']
+CAMPOS_RESOLUCION = ['resolucion', 'fecha_resolucion', 'seleccion', 'ano_imputacion_res_of', 'resolucion_id_beneficiario']
+
+# Modelos que escribe cada lote, en orden de inserción (ver instancias_lote)
+MODELOS_LOTE = (Beneficiarios, Decretos, Resoluciones, CambioBeneficiario)
+
+# Sobre esta proporción de beneficiarios faltantes el archivo se considera
+# incompleto y la importación incremental no da de baja a nadie
+MAXIMA_PROPORCION_BAJAS = 0.5
+TAMANO_LOTE_BAJAS = 1000
+
+# Valor de `hojas` (--hojas) que lee todas las hojas con datos de cada libro
+TODAS_LAS_HOJAS = 'todas'
+
+def _columna(df, nombre):
+    """Columna del DataFrame, o una columna vacía si el Excel no la trae"""
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(None, index=df.index, dtype=object)
+
+def _vacios(serie):
+    """Celdas nulas, vacías o con '-' (se importan como NULL, no son un error)"""
+    return serie.isna() | serie.astype(str).str.strip().isin(['', '-'])
+
+def limpiar_texto(serie, max_length=None):
+    """Texto sin espacios extremos y truncado a max_length; nulos y vacíos como ''"""
+    resultado = serie.astype(str).str.strip()
+    if max_length:
+        resultado = resultado.str.slice(0, max_length)
+    return resultado.where(~(serie.isna() | (serie.astype(str) == '')), '')
+
+def limpiar_entero(serie):
+    """Columna entera (Int64) y máscara de celdas no vacías que no son números"""
+    vacios = _vacios(serie)
+    numeros = pd.to_numeric(serie.where(~vacios), errors='coerce')
+    numeros = numeros.where(numeros.abs() < 2 ** 63)
+    rechazos = ~vacios & numeros.isna()
+    return np.trunc(numeros).astype('Int64'), rechazos
+
+def limpiar_fecha(serie):
+    """Columna de fechas (date o None) y máscara de celdas que no se pudieron interpretar.
+
+    Acepta fechas ya interpretadas por pandas, números de serie de Excel y
+    texto en los formatos de FORMATOS_FECHA.
+    """
+    vacios = _vacios(serie)
+    fechas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        fechas = serie.astype('datetime64[ns]')
+    else:
+        tipos = serie.map(type)
+        es_fecha = ~vacios & serie.map(lambda valor: isinstance(valor, (datetime, date)))
+        es_numero = ~vacios & ~es_fecha & tipos.isin([int, float, np.int64, np.float64])
+        es_texto = ~vacios & (tipos == str)
+
+        if es_fecha.any():
+            fechas[es_fecha] = pd.to_datetime(serie[es_fecha], errors='coerce')
+
+        if es_numero.any():
+            dias = serie[es_numero].astype(float)
+            seriales = pd.to_datetime(dias, unit='D', origin=ORIGEN_EXCEL, errors='coerce')
+            seriales[dias <= ULTIMO_DIA_ANTES_BUG_1900] += pd.Timedelta(days=1)
+            fechas[es_numero] = seriales
+
+        if es_texto.any():
+            textos = serie[es_texto].str.strip()
+            for formato in FORMATOS_FECHA:
+                pendientes = fechas[es_texto].isna()
+                if not pendientes.any():
+                    break
+                indices = pendientes[pendientes].index
+                fechas[indices] = pd.to_datetime(textos[indices], format=formato, errors='coerce')
+
+    validas = fechas.notna()
+    resultado = pd.Series(np.where(validas, fechas.dt.date, None), index=serie.index, dtype=object)
+    return resultado, ~vacios & ~validas
+
+def limpiar_tipo_cambio(serie):
+    """Tipo de CambioBeneficiario.TIPOS ('' si no hay cambio) y máscara de celdas no vacías que no son ninguno"""
+    vacios = _vacios(serie)
+    textos = limpiar_texto(serie)
+    # Se normalizan solo los valores distintos, que en un lote son unos pocos
+    tipos = textos.map({texto: TIPOS_CAMBIO.get(normalizar_clave(texto), '') for texto in textos.unique()})
+    tipos = tipos.where(~vacios, '')
+    return tipos, ~vacios & (tipos == '')
+
+def limpiar_lote(batch_df):
+    """Limpia un lote columna por columna.
+
+    Devuelve (limpio, rechazos): un DataFrame con una columna por campo, con
+    tipos listos para los modelos (texto, entero o None, date o None), y un
+    dict {columna: Serie} con el valor original de las celdas que no se
+    pudieron convertir, indexadas por fila.
+
+    Las columnas del cambio de beneficiario se reconocen por COLUMNAS_CAMBIO;
+    una fila tiene cambio si su tipo_cambio no queda vacío.
+    """
+    limpio = pd.DataFrame(index=batch_df.index)
+    rechazos = {}
+    batch_df = batch_df.rename(columns=lambda columna: COLUMNAS_CAMBIO.get(str(columna).strip().lower(), columna))
+
+    for columna, max_length in COLUMNAS_TEXTO.items():
+        limpio[columna] = limpiar_texto(_columna(batch_df, columna), max_length)
+
+    limpio['tipo_cambio'], mascara = limpiar_tipo_cambio(_columna(batch_df, 'tipo_cambio'))
+    rechazos['tipo_cambio'] = _columna(batch_df, 'tipo_cambio')[mascara]
+
+    for columna in COLUMNAS_ENTERAS:
+        valores, mascara = limpiar_entero(_columna(batch_df, columna))
+        rechazos[columna] = _columna(batch_df, columna)[mascara]
+        # Enteros de Python y None, que es lo que esperan los modelos
+        limpio[columna] = valores.astype(object).where(valores.notna(), None)
+
+    for columna in COLUMNAS_FECHA:
+        limpio[columna], mascara = limpiar_fecha(_columna(batch_df, columna))
+        rechazos[columna] = _columna(batch_df, columna)[mascara]
+
+    # bulk_create no pasa por Beneficiarios.save() ni CambioBeneficiario.save(); mismo
+    # criterio que rut.normalizar_rut, sobre la columna completa
+    limpio['rut_normalizado'] = validacion.normalizar_ruts(limpio['rut'], limpio['dv'])
+    limpio['rut_nuevo_normalizado'] = validacion.normalizar_ruts(limpio['rut_nuevo'], limpio['dv_nuevo'])
+    limpio['huella'] = calcular_huellas(limpio)
+
+    return limpio, rechazos
+
+def calcular_huellas(limpio):
+    """MD5 de los valores limpios de cada fila (todas las columnas importadas)"""
+    unidas = None
+    for columna in COLUMNAS_HUELLA:
+        textos = limpio[columna].map(lambda valor: '' if valor is None else str(valor))
+        unidas = textos if unidas is None else unidas + SEPARADOR_HUELLA + textos
+    return unidas.map(lambda texto: hashlib.md5(texto.encode('utf-8')).hexdigest())
+
+def reportar_rechazos(numero_lote, rechazos, totales, origen='Lote'):
+    """Registra las celdas rechazadas del lote (con filas de muestra) y acumula los totales.
+
+    `origen` encabeza el mensaje junto con `numero_lote` (ej. 'Fuente' y el nombre de la hoja).
+    """
+    for columna, valores in rechazos.items():
+        cantidad = len(valores)
+        if not cantidad:
+            continue
+        totales[columna] = totales.get(columna, 0) + cantidad
+        # Fila de Excel = índice + 2 (encabezado y base 1)
+        filas = ', '.join(str(indice + 2) for indice in valores.index[:MUESTRA_RECHAZOS])
+        logger.warning(f"{origen} {numero_lote}: {cantidad} valores inválidos en '{columna}' (filas {filas}...), se importan como NULL")
+
+def _valor_excel(valor):
+    """Mismo criterio que pd.read_excel: los números enteros en celdas float se leen como int"""
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+def leer_excel_por_lotes(excel_file_path, batch_size=1000, hoja=None):
+    """Genera DataFrames de hasta batch_size filas sin cargar el libro completo.
+
+    Los .xlsx se leen en streaming con openpyxl en modo read-only, así la memoria
+    no crece con el tamaño del archivo. Las columnas quedan con dtype object
+    (valores tal cual vienen en las celdas) y el índice es la fila de Excel
+    menos 2, igual que con pd.read_excel. Otros formatos (.xls) se leen completos
+    con pandas y se entregan por lotes. Se lee la hoja `hoja`, o la activa si
+    no se indica.
+    """
+    extension = os.path.splitext(excel_file_path)[1].lower()
+    if extension not in ('.xlsx', '.xlsm'):
+        df = pd.read_excel(excel_file_path, sheet_name=0 if hoja is None else hoja)
+        for start_idx in range(0, len(df), batch_size):
+            yield df.iloc[start_idx:start_idx + batch_size]
+        return
+
+    libro = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        filas = (libro.active if hoja is None else libro[hoja]).iter_rows(values_only=True)
+        encabezados = next(filas, None)
+        if encabezados is None:
+            return
+        encabezados = [
+            f'Unnamed: {posicion}' if nombre is None else str(nombre)
+            for posicion, nombre in enumerate(encabezados)
+        ]
+        ancho = len(encabezados)
+
+        lote = []
+        indices = []
+        for indice, fila in enumerate(filas):
+            if all(valor is None for valor in fila):
+                continue
+            fila = [_valor_excel(valor) for valor in fila[:ancho]]
+            fila.extend([None] * (ancho - len(fila)))
+            lote.append(fila)
+            indices.append(indice)
+            if len(lote) == batch_size:
+                yield pd.DataFrame(lote, columns=encabezados, index=indices, dtype=object)
+                lote = []
+                indices = []
+        if lote:
+            yield pd.DataFrame(lote, columns=encabezados, index=indices, dtype=object)
+    finally:
+        libro.close()
+
+def leer_lotes(excel_file_path, batch_size=1000, huella=None, usar_cache=True, hoja=None):
+    """Lotes del archivo desde la caché columnar si ya se leyó antes; si no, del Excel guardándolo en ella.
+
+    `huella` es el SHA-256 del archivo (ver puntos_control.huella_archivo).
+    """
+    if not usar_cache or huella is None or not cache_excel.cacheable(excel_file_path):
+        return leer_excel_por_lotes(excel_file_path, batch_size, hoja)
+    clave = cache_excel.clave(huella, hoja)
+    lotes = cache_excel.leer(clave, batch_size)
+    if lotes is not None:
+        logger.info("Archivo encontrado en la caché; no se vuelve a leer el Excel")
+        return lotes
+    return cache_excel.leer_guardando(clave, leer_excel_por_lotes(excel_file_path, batch_size, hoja))
+
+def hojas_con_datos(excel_file_path):
+    """Hojas del libro cuya primera fila trae la columna id_beneficiario, en orden"""
+    if os.path.splitext(excel_file_path)[1].lower() not in ('.xlsx', '.xlsm'):
+        libro = pd.ExcelFile(excel_file_path)
+        return [
+            hoja for hoja in libro.sheet_names
+            if 'id_beneficiario' in [str(nombre).strip() for nombre in libro.parse(hoja, nrows=0).columns]
+        ]
+    libro = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        hojas = []
+        for hoja in libro.worksheets:
+            encabezados = next(hoja.iter_rows(max_row=1, values_only=True), ())
+            if 'id_beneficiario' in [str(nombre).strip() for nombre in encabezados if nombre is not None]:
+                hojas.append(hoja.title)
+        return hojas
+    finally:
+        libro.close()
+
+def contar_filas(excel_file_path):
+    """Filas de datos que declara la hoja (para estimar el avance), o None si no se sabe.
+
+    En .xlsx es la dimensión guardada en el archivo, sin recorrer las filas;
+    puede incluir filas vacías al final.
+    """
+    if os.path.splitext(excel_file_path)[1].lower() not in ('.xlsx', '.xlsm'):
+        return None
+    libro = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        filas = libro.active.max_row
+    finally:
+        libro.close()
+    return max(filas - 1, 0) if filas else None
+
+def procesos_por_defecto():
+    """Procesos de limpieza: uno por núcleo, dejando uno para lectura y escritura"""
+    return min(max((os.cpu_count() or 1) - 1, 0), MAXIMO_PROCESOS_LIMPIEZA)
+
+class Etapa:
+    """Contadores de una etapa del pipeline: lotes, filas y tiempo trabajando o esperando"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.lotes = 0
+        self.filas = 0
+        self.trabajando = 0.0
+        self.esperando = 0.0
+
+    def registrar(self, filas, segundos, lotes=1):
+        self.lotes += lotes
+        self.filas += filas
+        self.trabajando += segundos
+
+    def reporte(self):
+        velocidad = self.filas / self.trabajando if self.trabajando else 0
+        return (f"Etapa {self.nombre}: {self.filas} filas en {self.lotes} lotes, "
+                f"{self.trabajando:.1f} s trabajando ({velocidad:.0f} filas/s), "
+                f"{self.esperando:.1f} s esperando otras etapas")
+
+class PipelineDetenido(Exception):
+    """Otra etapa falló; la etapa actual termina sin procesar más lotes"""
+
+# Marca de fin de datos en las colas entre etapas
+_FIN = object()
+
+def _poner(cola, elemento, etapa, detener):
+    """put bloqueante que cuenta la espera y se interrumpe si otra etapa falló"""
+    inicio = time.perf_counter()
+    while True:
+        if detener.is_set():
+            raise PipelineDetenido
+        try:
+            cola.put(elemento, timeout=ESPERA_COLA)
+            break
+        except queue.Full:
+            continue
+    etapa.esperando += time.perf_counter() - inicio
+
+def _tomar(cola, etapa, detener):
+    """get bloqueante que cuenta la espera y se interrumpe si otra etapa falló"""
+    inicio = time.perf_counter()
+    while True:
+        if detener.is_set():
+            raise PipelineDetenido
+        try:
+            elemento = cola.get(timeout=ESPERA_COLA)
+            break
+        except queue.Empty:
+            continue
+    etapa.esperando += time.perf_counter() - inicio
+    return elemento
+
+def _limpiar_medido(batch_df):
+    """limpiar_lote más el tiempo que tomó (se ejecuta en los procesos de limpieza)"""
+    inicio = time.perf_counter()
+    limpio, rechazos = limpiar_lote(batch_df)
+    return limpio, rechazos, time.perf_counter() - inicio
+
+def etapa_lectura(primer_lote, lotes, salida, etapa, detener):
+    """Lee lotes del Excel y los deja en la cola de limpieza.
+
+    `primer_lote` ya fue leído (y contado en `etapa`) antes de iniciar el
+    pipeline; es None si al reanudar ya no quedan lotes.
+    """
+    if primer_lote is not None:
+        _poner(salida, primer_lote, etapa, detener)
+    while True:
+        inicio = time.perf_counter()
+        batch_df = next(lotes, None)
+        if batch_df is None:
+            break
+        etapa.registrar(len(batch_df), time.perf_counter() - inicio)
+        _poner(salida, batch_df, etapa, detener)
+    _poner(salida, _FIN, etapa, detener)
+
+def etapa_limpieza(entrada, salida, etapa, detener, pool=None, procesos=0):
+    """Limpia los lotes (en el pool de procesos si hay) y los entrega en orden de lectura.
+
+    Con pool se mantienen hasta `procesos` lotes en curso; el tiempo de trabajo
+    es la suma del tiempo de limpieza en cada proceso.
+    """
+    en_curso = collections.deque()
+
+    def entregar(limpio, rechazos, segundos):
+        etapa.registrar(len(limpio), segundos)
+        _poner(salida, (limpio, rechazos), etapa, detener)
+
+    while True:
+        batch_df = _tomar(entrada, etapa, detener)
+        if batch_df is _FIN:
+            break
+        if pool is None:
+            entregar(*_limpiar_medido(batch_df))
+            continue
+        en_curso.append(pool.submit(_limpiar_medido, batch_df))
+        if len(en_curso) > procesos:
+            entregar(*en_curso.popleft().result())
+
+    while en_curso:
+        entregar(*en_curso.popleft().result())
+    _poner(salida, _FIN, etapa, detener)
+
+
+def etapa_limpios(primer_lote, lotes, salida, etapa, detener):
+    """Entrega a la escritura lotes que ya vienen limpios (varias fuentes, ver leer_fuentes)"""
+    if primer_lote is not None:
+        _poner(salida, (primer_lote, {}), etapa, detener)
+    for limpio in lotes:
+        _poner(salida, (limpio, {}), etapa, detener)
+    _poner(salida, _FIN, etapa, detener)
+
+
+def filas_rechazadas(rechazos):
+    """[(fila de Excel, columna, valor, motivo)] de las celdas rechazadas de un lote"""
+    return [
+        (indice + 2, columna, str(valor), 'valor inválido, se importó como NULL')
+        for columna, valores in rechazos.items()
+        for indice, valor in valores.items()
+    ]
+
+def filtrar_lote(limpio, numero_lote, ids_vistos, contadores, rechazadas=None):
+    """Quita las filas sin id y las de id repetido (estas se registran como error).
+
+    Si se entrega la lista `rechazadas`, se le agregan las filas quitadas con
+    el formato de filas_rechazadas.
+    """
+    ids = limpio['id_beneficiario']
+    sin_id = ids.isna() | (ids == 0)
+    if rechazadas is not None:
+        rechazadas.extend((indice + 2, 'id_beneficiario', '', 'fila sin id_beneficiario, se omite')
+                          for indice in limpio.index[sin_id])
+    limpio = limpio[~sin_id]
+    repetidos = limpio['id_beneficiario'].isin(ids_vistos) | limpio['id_beneficiario'].duplicated()
+    for idx, id_beneficiario in limpio.loc[repetidos, 'id_beneficiario'].items():
+        logger.error(f"Fila {idx}: id_beneficiario {id_beneficiario} repetido, se omite")
+        if rechazadas is not None:
+            rechazadas.append((idx + 2, 'id_beneficiario', str(id_beneficiario), 'id_beneficiario repetido, se omite'))
+    contadores['errores'] += int(repetidos.sum())
+    limpio = limpio[~repetidos]
+    ids_vistos.update(limpio['id_beneficiario'])
+    return limpio
+
+def _sumar_creados(contadores, filas, cambios=0):
+    contadores['beneficiarios'] += filas
+    contadores['decretos'] += filas
+    contadores['resoluciones'] += filas
+    contadores['cambios'] += cambios
+
+def filas_con_cambio(limpio):
+    """Filas del lote limpio que traen un cambio de beneficiario"""
+    return limpio[limpio['tipo_cambio'] != '']
+
+def instancias_lote(limpio, modelos=MODELOS_LOTE):
+    """Beneficiarios, decretos, resoluciones y cambios de un lote limpio, sin guardar.
+
+    Decreto, resolución y cambio comparten el id del beneficiario; se asigna el
+    FK por id. Solo las filas con tipo_cambio tienen cambio. `modelos` permite
+    construirlos para las tablas sombra (ver tablas_sombra).
+    """
+    Beneficiario, Decreto, Resolucion, Cambio = modelos
+    beneficiarios = [
+        Beneficiario(
+            id_beneficiario=fila.id_beneficiario, rut=fila.rut, dv=fila.dv, nombres=fila.nombres,
+            primer_apellido=fila.primer_apellido, segundo_apellido=fila.segundo_apellido,
+            comuna=fila.comuna, provincia=fila.provincia, codigo_proyecto=fila.codigo_proyecto,
+            nombre_grupo=fila.nombre_grupo, sexo=fila.sexo, rut_normalizado=fila.rut_normalizado,
+            huella=fila.huella,
+        )
+        for fila in limpio.itertuples(index=False)
+    ]
+    decretos = [
+        Decreto(
+            id_decreto=fila.id_beneficiario, decreto=fila.decreto, tipologia=fila.tipologia,
+            tramo=fila.tramo, decreto_id_beneficiario_id=fila.id_beneficiario,
+        )
+        for fila in limpio.itertuples(index=False)
+    ]
+    resoluciones = [
+        Resolucion(
+            id_resolucion=fila.id_beneficiario, resolucion=fila.resolucion,
+            fecha_resolucion=fila.fecha_resolucion, seleccion=fila.seleccion,
+            ano_imputacion_res_of=fila.ano_imputacion_res_of,
+            resolucion_id_beneficiario_id=fila.id_beneficiario,
+        )
+        for fila in limpio.itertuples(index=False)
+    ]
+    cambios = [
+        Cambio(
+            id_cambio=fila.id_beneficiario, tipo=fila.tipo_cambio, rut_anterior=fila.rut_normalizado,
+            rut_nuevo=fila.rut_nuevo, dv_nuevo=fila.dv_nuevo, rut_nuevo_normalizado=fila.rut_nuevo_normalizado,
+            nombres_nuevo=fila.nombres_nuevo, primer_apellido_nuevo=fila.primer_apellido_nuevo,
+            segundo_apellido_nuevo=fila.segundo_apellido_nuevo, resolucion=fila.resolucion_cambio,
+            fecha_resolucion=fila.fecha_resolucion_cambio, cambio_id_beneficiario_id=fila.id_beneficiario,
+        )
+        for fila in filas_con_cambio(limpio).itertuples(index=False)
+    ]
+    return beneficiarios, decretos, resoluciones, cambios
+
+class CargaORM:
+    """Escritura con bulk_create: un INSERT por tabla y una transacción por lote"""
+
+    def __init__(self, batch_size, sufijo=''):
+        self.batch_size = batch_size
+        self.confirmado = 0
+        self.modelos = (
+            tuple(tablas_sombra.modelos_sombra(sufijo)[:len(MODELOS_LOTE)]) if sufijo else MODELOS_LOTE
+        )
+
+    def escribir(self, limpio, numero_lote, contadores):
+        # El lote queda escrito (o descartado) dentro de este llamado
+        self.confirmado = numero_lote
+        instancias = instancias_lote(limpio, self.modelos)
+        beneficiarios_batch, cambios_batch = instancias[0], instancias[-1]
+        
+        if not beneficiarios_batch:
+            return
+        
+        try:
+            with transaction.atomic():
+                for modelo, objetos in zip(self.modelos, instancias):
+                    modelo.objects.bulk_create(objetos, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Error insertando lote {numero_lote}; se descartan sus {len(beneficiarios_batch)} filas: {e}")
+            contadores['errores'] += len(beneficiarios_batch)
+            return
+        
+        _sumar_creados(contadores, len(beneficiarios_batch), len(cambios_batch))
+        logger.info(f"Lote {numero_lote}: {len(beneficiarios_batch)} beneficiarios, decretos y resoluciones "
+                    f"y {len(cambios_batch)} cambios creados")
+
+    def cerrar(self, contadores, cargar=True):
+        pass
+
+class CargaIncremental:
+    """Upsert de las filas nuevas o cuya huella cambió; las demás no se tocan.
+
+    Cada lote consulta las huellas guardadas de sus ids y reescribe solo las
+    filas distintas con bulk_create(update_conflicts=True), que en MySQL es un
+    INSERT ... ON DUPLICATE KEY UPDATE. Las filas que ya no vienen en el
+    archivo se dan de baja al final (ver dar_de_baja).
+    """
+
+    def __init__(self, batch_size, sufijo=''):
+        self.batch_size = batch_size
+        self.confirmado = 0
+        # MySQL no acepta indicar la clave del conflicto; usa la primaria
+        self.con_clave = connection.features.supports_update_conflicts_with_target
+
+    def _upsert(self, modelo, objetos, clave, campos):
+        modelo.objects.bulk_create(
+            objetos, batch_size=self.batch_size, update_conflicts=True,
+            unique_fields=[clave] if self.con_clave else None, update_fields=campos,
+        )
+
+    def escribir(self, limpio, numero_lote, contadores):
+        self.confirmado = numero_lote
+        if limpio.empty:
+            return
+        
+        ids = limpio['id_beneficiario'].tolist()
+        marcadores = ','.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id_beneficiario, huella FROM beneficiarios WHERE id_beneficiario IN ({marcadores})", ids)
+            guardadas = dict(cursor.fetchall())
+        
+        cambiadas = limpio[limpio['huella'] != limpio['id_beneficiario'].map(lambda id_: guardadas.get(id_, ''))]
+        contadores['sin_cambios'] += len(limpio) - len(cambiadas)
+        if cambiadas.empty:
+            return
+        
+        nuevas = int((~cambiadas['id_beneficiario'].isin(guardadas.keys())).sum())
+        beneficiarios_batch, decretos_batch, resoluciones_batch, cambios_batch = instancias_lote(cambiadas)
+        ids_cambiados = cambiadas['id_beneficiario'].tolist()
+        marcadores = ','.join(['%s'] * len(ids_cambiados))
+        try:
+            with transaction.atomic():
+                self._upsert(Beneficiarios, beneficiarios_batch, 'id_beneficiario', CAMPOS_BENEFICIARIO)
+                self._upsert(Decretos, decretos_batch, 'id_decreto', CAMPOS_DECRETO)
+                self._upsert(Resoluciones, resoluciones_batch, 'id_resolucion', CAMPOS_RESOLUCION)
+                # Una fila modificada puede haber perdido su cambio: se reemplazan todos los de esas filas
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DELETE FROM cambios_beneficiario WHERE cambio_id_beneficiario IN ({marcadores})",
+                                   ids_cambiados)
+                CambioBeneficiario.objects.bulk_create(cambios_batch, batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Error actualizando lote {numero_lote}; se descartan sus {len(cambiadas)} filas: {e}")
+            contadores['errores'] += len(cambiadas)
+            return
+        
+        contadores['nuevos'] += nuevas
+        contadores['actualizados'] += len(cambiadas) - nuevas
+        contadores['cambios'] += len(cambios_batch)
+        logger.info(f"Lote {numero_lote}: {nuevas} beneficiarios nuevos y {len(cambiadas) - nuevas} actualizados")
+
+    def cerrar(self, contadores, cargar=True):
+        pass
+
+def dar_de_baja(ids_archivo, contadores):
+    """Elimina los beneficiarios que no vienen en el archivo, dejando una lápida de cada uno.
+
+    Si faltaría más de MAXIMA_PROPORCION_BAJAS de la tabla se asume que el
+    archivo está incompleto y no se elimina nada.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id_beneficiario, rut, rut_normalizado, huella FROM beneficiarios")
+        existentes = cursor.fetchall()
+    faltantes = [fila for fila in existentes if fila[0] not in ids_archivo]
+    if not faltantes:
+        return 0
+    if len(faltantes) > MAXIMA_PROPORCION_BAJAS * len(existentes):
+        logger.error(f"{len(faltantes)} de {len(existentes)} beneficiarios no vienen en el archivo; "
+                     "parece incompleto, no se da de baja ninguno")
+        return 0
+    
+    for inicio in range(0, len(faltantes), TAMANO_LOTE_BAJAS):
+        lote = faltantes[inicio:inicio + TAMANO_LOTE_BAJAS]
+        ids = [fila[0] for fila in lote]
+        marcadores = ','.join(['%s'] * len(ids))
+        with transaction.atomic():
+            BajaBeneficiario.objects.bulk_create([
+                BajaBeneficiario(id_beneficiario=id_, rut=rut, rut_normalizado=rut_normalizado, huella=huella)
+                for id_, rut, rut_normalizado, huella in lote
+            ])
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM cambios_beneficiario WHERE cambio_id_beneficiario IN ({marcadores})", ids)
+                cursor.execute(f"DELETE FROM resoluciones WHERE resolucion_id_beneficiario IN ({marcadores})", ids)
+                cursor.execute(f"DELETE FROM decretos WHERE decreto_id_beneficiario IN ({marcadores})", ids)
+                cursor.execute(f"DELETE FROM beneficiarios WHERE id_beneficiario IN ({marcadores})", ids)
+    
+    contadores['eliminados'] += len(faltantes)
+    logger.info(f"{len(faltantes)} beneficiarios que ya no vienen en el archivo dados de baja")
+    return len(faltantes)
+
+def _valor_tsv(valor):
+    """Valor en el formato por defecto de LOAD DATA: tabulador, \\N para NULL y escapes con \\"""
+    if valor is None:
+        return '\\N'
+    texto = valor.isoformat() if isinstance(valor, date) else str(valor)
+    return (texto.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def load_data_disponible():
+    """True si la conexión es MySQL y tanto el cliente como el servidor permiten LOAD DATA LOCAL"""
+    if connection.vendor != 'mysql':
+        return False
+    if not connection.settings_dict.get('OPTIONS', {}).get('local_infile'):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW VARIABLES LIKE 'local_infile'")
+        fila = cursor.fetchone()
+    return fila is not None and str(fila[1]).upper() in ('ON', '1')
+
+class CargaNativa:
+    """Escritura con el cargador nativo de la base.
+
+    En MySQL las filas limpias se agregan a un TSV temporal por tabla y se
+    cargan con LOAD DATA LOCAL INFILE cada FILAS_POR_CARGA filas (y al
+    cerrar), todas las tablas en una transacción. En otras bases (SQLite en
+    las pruebas) o si el servidor no permite LOCAL INFILE, cada lote se
+    inserta con INSERT de varias filas.
+    """
+
+    def __init__(self, batch_size, sufijo=''):
+        self.batch_size = batch_size
+        self.sufijo = sufijo
+        self.load_data = load_data_disponible()
+        self.directorio = None
+        self.archivos = {}
+        self.pendientes = 0
+        self.cambios_pendientes = 0
+        # Último lote recibido y último cuyas filas ya están en la base (o se descartaron)
+        self.ultimo_lote = 0
+        self.confirmado = 0
+        if self.load_data:
+            self.directorio = tempfile.mkdtemp(prefix='serviu_carga_')
+            self._abrir_archivos()
+        else:
+            logger.warning("LOAD DATA LOCAL INFILE no disponible; se usa INSERT de varias filas")
+
+    def filas_tablas(self, limpio):
+        """[(tabla, columnas, filas)] del lote, en orden de inserción"""
+        cambios = filas_con_cambio(limpio)
+        return [
+            (tabla + self.sufijo, [columna for columna, _ in columnas],
+             list(zip(*((cambios if tabla in TABLAS_SOLO_CAMBIOS else limpio)[origen].tolist()
+                        for _, origen in columnas))))
+            for tabla, columnas in TABLAS_CARGA
+        ]
+
+    def escribir(self, limpio, numero_lote, contadores):
+        self.ultimo_lote = numero_lote
+        if not self.pendientes and (limpio.empty or not self.load_data):
+            self.confirmado = numero_lote
+        if limpio.empty:
+            return
+        tablas = self.filas_tablas(limpio)
+        cambios = len(filas_con_cambio(limpio))
+        
+        if self.load_data:
+            for (tabla, _), (_, _, filas) in zip(TABLAS_CARGA, tablas):
+                self.archivos[tabla].writelines(
+                    '\t'.join(_valor_tsv(valor) for valor in fila) + '\n' for fila in filas
+                )
+            self.pendientes += len(limpio)
+            self.cambios_pendientes += cambios
+            if self.pendientes >= FILAS_POR_CARGA:
+                self._cargar(contadores)
+            return
+        
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for tabla, columnas, filas in tablas:
+                        _insertar_filas(cursor, tabla, columnas, filas)
+        except Exception as e:
+            logger.error(f"Error insertando lote {numero_lote}; se descartan sus {len(limpio)} filas: {e}")
+            contadores['errores'] += len(limpio)
+            return
+        
+        _sumar_creados(contadores, len(limpio), cambios)
+        logger.info(f"Lote {numero_lote}: {len(limpio)} beneficiarios, decretos y resoluciones "
+                    f"y {cambios} cambios creados")
+
+    def cerrar(self, contadores, cargar=True):
+        try:
+            if cargar and self.pendientes:
+                self._cargar(contadores)
+        finally:
+            for archivo in self.archivos.values():
+                archivo.close()
+            if self.directorio:
+                shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _abrir_archivos(self):
+        for archivo in self.archivos.values():
+            archivo.close()
+        self.archivos = {
+            tabla: open(os.path.join(self.directorio, f'{tabla}.tsv'), 'w', encoding='utf-8', newline='\n')
+            for tabla, _ in TABLAS_CARGA
+        }
+
+    def _cargar(self, contadores):
+        filas, self.pendientes = self.pendientes, 0
+        cambios, self.cambios_pendientes = self.cambios_pendientes, 0
+        for archivo in self.archivos.values():
+            archivo.flush()
+        
+        inicio = time.perf_counter()
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for tabla, columnas in TABLAS_CARGA:
+                        cursor.execute(
+                            f"LOAD DATA LOCAL INFILE %s INTO TABLE {connection.ops.quote_name(tabla + self.sufijo)}"
+                            f" CHARACTER SET utf8mb4 ({', '.join(columna for columna, _ in columnas)})",
+                            [self.archivos[tabla].name],
+                        )
+        except Exception as e:
+            logger.error(f"Error en LOAD DATA; se descartan {filas} filas: {e}")
+            contadores['errores'] += filas
+        else:
+            _sumar_creados(contadores, filas, cambios)
+            logger.info(f"LOAD DATA: {filas} beneficiarios, decretos y resoluciones y {cambios} cambios cargados "
+                        f"en {time.perf_counter() - inicio:.1f} s")
+        finally:
+            # Los archivos se vacían para la siguiente carga
+            self.confirmado = self.ultimo_lote
+            self._abrir_archivos()
+
+def _insertar_filas(cursor, tabla, columnas, filas):
+    """INSERT de varias filas, respetando el máximo de parámetros por consulta de la base"""
+    maximo = connection.features.max_query_params
+    por_sentencia = max(maximo // len(columnas), 1) if maximo else FILAS_POR_INSERT
+    marcador = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+    prefijo = (f"INSERT INTO {connection.ops.quote_name(tabla)} "
+               f"({', '.join(connection.ops.quote_name(columna) for columna in columnas)}) VALUES ")
+    for inicio in range(0, len(filas), por_sentencia):
+        bloque = filas[inicio:inicio + por_sentencia]
+        cursor.execute(prefijo + ', '.join([marcador] * len(bloque)),
+                       [valor for fila in bloque for valor in fila])
+
+class Validacion:
+    """Escritor del modo de prueba (--dry-run): no toca la base.
+
+    Evalúa las reglas de serviuapp.validacion sobre cada lote limpio y acumula
+    sus fallas en contadores['validacion'].
+    """
+
+    def __init__(self, batch_size, sufijo=''):
+        self.confirmado = 0
+
+    def escribir(self, limpio, numero_lote, contadores):
+        self.confirmado = numero_lote
+        if not limpio.empty:
+            validacion.acumular(limpio, contadores.setdefault('validacion', {}))
+
+    def cerrar(self, contadores, cargar=True):
+        pass
+
+# Escritores del pipeline: una clase por carga (ver CARGAS), el upsert del
+# modo incremental y la validación sin escritura. Todos tienen
+# escribir(limpio, numero_lote, contadores), cerrar(contadores, cargar) y
+# confirmado: el último lote cuyas filas ya están en la base o se descartaron.
+# Con cargar=False (un lote falló) cerrar descarta lo que aún no escribió
+ESCRITORES = {
+    'orm': CargaORM, 'nativa': CargaNativa, 'incremental': CargaIncremental, 'validacion': Validacion,
+}
+
+def _confirmar(escritor, punto_control, filas_por_lote, contadores):
+    """Guarda en el punto de control los lotes que el escritor ya confirmó"""
+    if escritor.confirmado > punto_control.lote:
+        puntos_control.guardar(punto_control, escritor.confirmado, filas_por_lote[escritor.confirmado], contadores)
+        for lote in [lote for lote in filas_por_lote if lote < escritor.confirmado]:
+            del filas_por_lote[lote]
+
+def etapa_escritura(entrada, etapa, detener, batch_size, carga, sufijo, contadores, avance=None, punto_control=None):
+    """Inserta los lotes limpios con su propia conexión a la base (la del hilo).
+
+    Con `sufijo` escribe en las tablas sombra (modo reemplazo). Si se entrega
+    `avance`, se llama después de cada lote con (contadores, filas rechazadas
+    del lote); ver ejecutar_pipeline. Con `punto_control` cada lote se escribe
+    en la misma transacción que actualiza el punto de control, y la numeración
+    de lotes sigue desde el último confirmado (ver serviuapp.puntos_control).
+    """
+    ids_vistos = contadores['ids']
+    progreso = tqdm(desc="Procesando lotes", unit="lote")
+    transaccion = transaction.atomic if punto_control else contextlib.nullcontext
+    # Filas de datos del archivo cubiertas hasta cada lote aún no confirmado
+    filas_por_lote = {}
+    try:
+        escritor = ESCRITORES[carga](batch_size, sufijo)
+        numero_lote = punto_control.lote if punto_control else 0
+        terminado = False
+        try:
+            while True:
+                elemento = _tomar(entrada, etapa, detener)
+                if elemento is _FIN:
+                    break
+                numero_lote += 1
+                limpio, rechazos = elemento
+                inicio = time.perf_counter()
+                filas_lote = len(limpio)
+                contadores['filas_leidas'] += filas_lote
+                if filas_lote:
+                    filas_por_lote[numero_lote] = int(limpio.index[-1]) + 1
+                
+                reportar_rechazos(numero_lote, rechazos, contadores['rechazos'])
+                rechazadas = filas_rechazadas(rechazos) if avance else None
+                limpio = filtrar_lote(limpio, numero_lote, ids_vistos, contadores, rechazadas)
+                with transaccion():
+                    escritor.escribir(limpio, numero_lote, contadores)
+                    if punto_control:
+                        _confirmar(escritor, punto_control, filas_por_lote, contadores)
+                
+                etapa.registrar(filas_lote, time.perf_counter() - inicio)
+                progreso.update()
+                if avance:
+                    avance(contadores, rechazadas)
+            terminado = True
+        finally:
+            # La última carga pendiente (LOAD DATA) cuenta como trabajo de la etapa. Si
+            # un lote falló, su transacción ya se revirtió aunque el escritor lo haya
+            # contado: lo pendiente se descarta y el punto de control queda en el
+            # último lote confirmado
+            inicio = time.perf_counter()
+            with transaccion():
+                escritor.cerrar(contadores, cargar=terminado)
+                if punto_control and terminado:
+                    _confirmar(escritor, punto_control, filas_por_lote, contadores)
+            etapa.trabajando += time.perf_counter() - inicio
+    finally:
+        progreso.close()
+        # La conexión es exclusiva de este hilo; Django no la cierra por sí solo
+        connection.close()
+
+def ejecutar_pipeline(primer_lote, lotes, batch_size, procesos, carga, lectura, sufijo='', avance=None,
+                      punto_control=None, ids_confirmados=(), limpieza=None):
+    """Lectura, limpieza y escritura en hilos separados unidos por colas acotadas.
+
+    Devuelve (contadores, etapas). Si una etapa falla, las demás se detienen y
+    el error se propaga. `avance(etapas, contadores, rechazadas)` se llama
+    desde el hilo escritor después de cada lote (ver serviuapp.trabajos). Al
+    reanudar, los contadores parten de los de `punto_control` y los ids de
+    los lotes ya confirmados llegan en `ids_confirmados`. Si se entrega la
+    Etapa `limpieza`, los lotes ya vienen limpios (ver leer_fuentes) y pasan
+    directo a la escritura.
+    """
+    ya_limpios = limpieza is not None
+    if not ya_limpios:
+        limpieza = Etapa('limpieza' + (f' ({procesos} procesos)' if procesos else ''))
+    escritura = Etapa(f'escritura ({carga})')
+    etapas = [lectura, limpieza, escritura]
+    contadores = {
+        'filas_leidas': 0, 'beneficiarios': 0, 'decretos': 0, 'resoluciones': 0, 'cambios': 0,
+        'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'eliminados': 0,
+        'errores': 0, 'rechazos': {},
+        # ids de beneficiario que trae el archivo (incluye los de lotes con error)
+        'ids': set(ids_confirmados),
+    }
+    if punto_control is not None:
+        contadores.update(punto_control.contadores)
+    cola_lectura = queue.Queue(maxsize=LOTES_EN_COLA)
+    cola_escritura = queue.Queue(maxsize=LOTES_EN_COLA)
+    detener = threading.Event()
+    fallas = []
+
+    def hilo(nombre, funcion, *args):
+        def ejecutar():
+            try:
+                funcion(*args)
+            except PipelineDetenido:
+                pass
+            except BaseException as e:
+                fallas.append(e)
+                detener.set()
+        return threading.Thread(target=ejecutar, name=f'importador-{nombre}', daemon=True)
+
+    pool = ProcessPoolExecutor(max_workers=procesos) if procesos and not ya_limpios else None
+    try:
+        if pool is not None:
+            # Crear los procesos antes de iniciar los hilos (fork con hilos activos es inseguro)
+            for futuro in [pool.submit(os.getpid) for _ in range(procesos)]:
+                futuro.result()
+        
+        if ya_limpios:
+            hilos = [hilo('lectura', etapa_limpios, primer_lote, lotes, cola_escritura, lectura, detener)]
+        else:
+            hilos = [
+                hilo('lectura', etapa_lectura, primer_lote, lotes, cola_lectura, lectura, detener),
+                hilo('limpieza', etapa_limpieza, cola_lectura, cola_escritura, limpieza, detener, pool, procesos),
+            ]
+        hilos.append(
+            hilo('escritura', etapa_escritura, cola_escritura, escritura, detener, batch_size, carga, sufijo,
+                 contadores, functools.partial(avance, etapas) if avance else None, punto_control),
+        )
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if fallas:
+        raise fallas[0]
+    return contadores, etapas
+
+def intercambiar_sombras(contadores):
+    """Crea los índices y el resumen de las tablas sombra, valida sus conteos y las pone en uso"""
+    logger.info("Creando índices de las tablas sombra...")
+    tablas_sombra.crear_indices()
+    logger.info(f"Resumen de las tablas sombra: {tablas_sombra.llenar_resumen()} filas")
+    conteos = tablas_sombra.validar(contadores['beneficiarios'])
+    logger.info(f"Tablas sombra validadas: {conteos}")
+    tablas_sombra.intercambiar()
+    logger.info(f"Tablas intercambiadas; las anteriores quedan como *{tablas_sombra.SUFIJO_ANTERIOR} para revertir")
+
+def revertir_reemplazo():
+    """Vuelve a poner en uso los datos anteriores a la última importación en modo reemplazo"""
+    if tablas_sombra.revertir():
+        logger.info("Datos anteriores restaurados; los reemplazados quedan como "
+                    f"*{tablas_sombra.SUFIJO_SOMBRA} hasta la próxima importación")
+        return True
+    logger.error(f"No hay tablas *{tablas_sombra.SUFIJO_ANTERIOR} a las que volver")
+    return False
+
+def limpiar_tablas():
+    """Vacía las tablas con DELETE directos (sin el recorrido de cascada del ORM)"""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM cambios_beneficiario")
+            cursor.execute("DELETE FROM resoluciones")
+            cursor.execute("DELETE FROM decretos")
+            cursor.execute("DELETE FROM beneficiarios")
+
+def saltar_lotes(lotes, punto_control, lectura=None):
+    """Lee sin procesar los lotes que el punto de control ya confirmó y devuelve sus ids.
+
+    Sirve también para los lotes ya limpios de varias fuentes (ver leer_fuentes),
+    cuyo índice es la posición en el conjunto combinado.
+
+    Lanza PuntoControlInvalido si el archivo no termina esos lotes en la
+    misma fila que registró el punto de control.
+    """
+    ids = set()
+    fila = 0
+    for _ in range(punto_control.lote):
+        inicio = time.perf_counter()
+        batch_df = next(lotes, None)
+        if batch_df is None:
+            break
+        if lectura is not None:
+            lectura.registrar(len(batch_df), time.perf_counter() - inicio)
+        valores, _ = limpiar_entero(_columna(batch_df, 'id_beneficiario'))
+        ids.update(int(valor) for valor in valores.dropna() if valor != 0)
+        fila = int(batch_df.index[-1]) + 1
+    if fila != punto_control.fila:
+        raise puntos_control.PuntoControlInvalido(
+            f"los lotes confirmados terminaban en la fila {punto_control.fila} y el archivo en la {fila}"
+        )
+    return ids
+
+def nombre_fuente(excel_file_path, hoja=None):
+    """Nombre de una fuente en el log: archivo o archivo[hoja]"""
+    nombre = os.path.basename(excel_file_path)
+    return nombre if hoja is None else f'{nombre}[{hoja}]'
+
+def expandir_fuentes(rutas, hojas=None):
+    """[(archivo, hoja)] a leer: la hoja activa de cada archivo, las hojas nombradas en
+    `hojas` que tenga cada uno, o todas las que tienen datos si `hojas` incluye TODAS_LAS_HOJAS.
+    """
+    fuentes = []
+    for ruta in rutas:
+        if not hojas:
+            fuentes.append((ruta, None))
+            continue
+        disponibles = hojas_con_datos(ruta)
+        elegidas = disponibles if TODAS_LAS_HOJAS in hojas else [hoja for hoja in hojas if hoja in disponibles]
+        if not elegidas:
+            logger.warning(f"{os.path.basename(ruta)} no tiene hojas con datos que leer; se omite")
+        fuentes.extend((ruta, hoja) for hoja in elegidas)
+    return fuentes
+
+def _leer_limpiar_fuente(excel_file_path, hoja, batch_size, huella):
+    """Lee y limpia una hoja completa (se ejecuta en los procesos de limpieza).
+
+    Devuelve (limpio, rechazos, lotes, segundos leyendo, segundos limpiando);
+    el índice es el de leer_excel_por_lotes (fila de Excel menos 2).
+    """
+    lotes = leer_lotes(excel_file_path, batch_size, huella, huella is not None, hoja)
+    limpios = []
+    rechazos = collections.defaultdict(list)
+    leyendo = limpiando = 0.0
+    while True:
+        inicio = time.perf_counter()
+        batch_df = next(lotes, None)
+        leyendo += time.perf_counter() - inicio
+        if batch_df is None:
+            break
+        limpio, rechazos_lote, segundos = _limpiar_medido(batch_df)
+        limpiando += segundos
+        limpios.append(limpio)
+        for columna, valores in rechazos_lote.items():
+            rechazos[columna].append(valores)
+    if not limpios:
+        return None, {}, 0, leyendo, limpiando
+    return (pd.concat(limpios), {columna: pd.concat(valores) for columna, valores in rechazos.items()},
+            len(limpios), leyendo, limpiando)
+
+def combinar_fuentes(partes):
+    """Une los lotes limpios de varias fuentes en un solo DataFrame ordenado por id_beneficiario.
+
+    `partes` es [(nombre de la fuente, limpio)] en el orden en que se dieron las
+    fuentes. Se omiten las filas sin id y, de cada id repetido, todas menos la
+    primera: si traen el mismo RUT normalizado es el mismo beneficiario
+    informado dos veces (por ejemplo en dos hojas), si no es un conflicto y
+    se registra como error. Devuelve (combinado, conflictos); el índice del
+    combinado es la posición de cada fila y la columna origen dice de qué
+    fila y fuente viene (la usan los reportes; los escritores la ignoran).
+    """
+    marcadas = [
+        limpio.assign(origen_fuente=nombre, origen_fila=limpio.index + 2) for nombre, limpio in partes if limpio is not None
+    ]
+    if not marcadas:
+        return pd.DataFrame(), 0
+    combinado = pd.concat(marcadas, ignore_index=True)
+    
+    ids = combinado['id_beneficiario']
+    sin_id = ids.isna() | (ids == 0)
+    if sin_id.any():
+        logger.warning(f"{int(sin_id.sum())} filas sin id_beneficiario, se omiten")
+        combinado = combinado[~sin_id]
+    
+    conflictos = 0
+    repetidas = combinado['id_beneficiario'].duplicated()
+    if repetidas.any():
+        otras = combinado[repetidas]
+        primeras = combinado[~repetidas].set_index('id_beneficiario').loc[otras['id_beneficiario']]
+        mismo_rut = otras['rut_normalizado'].to_numpy() == primeras['rut_normalizado'].to_numpy()
+        if mismo_rut.any():
+            logger.info(f"{int(mismo_rut.sum())} filas repetidas (mismo id_beneficiario y RUT ya leídos), se omiten")
+        for fila, primera in zip(otras[~mismo_rut].itertuples(index=False), primeras[~mismo_rut].itertuples()):
+            logger.error(f"Fila {fila.origen_fila} de {fila.origen_fuente}: id_beneficiario {fila.id_beneficiario} ya viene "
+                         f"con otro RUT en la fila {primera.origen_fila} de {primera.origen_fuente}, se omite")
+        conflictos = int((~mismo_rut).sum())
+    
+    combinado = combinado[~repetidas].sort_values('id_beneficiario', kind='stable')
+    combinado['origen'] = 'fila ' + combinado['origen_fila'].astype(str) + ' de ' + combinado['origen_fuente']
+    return combinado.drop(columns=['origen_fuente', 'origen_fila']).reset_index(drop=True), conflictos
+
+def leer_fuentes(rutas, hojas, batch_size, procesos, huellas, lectura, limpieza, resultado):
+    """Lotes ya limpios de varios archivos u hojas, combinados con combinar_fuentes.
+
+    Cada fuente se lee y limpia completa en el pool de `procesos` procesos (en
+    este proceso si es 0), todas en paralelo; después se combinan y se
+    entregan en lotes de batch_size en orden de id_beneficiario, para una sola
+    escritura ordenada. `huellas` son las de cada archivo (None sin caché).
+    Los tiempos se suman a las etapas `lectura` y `limpieza`, y los conflictos
+    de id quedan en resultado['conflictos'].
+    """
+    inicio = time.perf_counter()
+    fuentes = expandir_fuentes(rutas, hojas)
+    huella_por_ruta = dict(zip(rutas, huellas))
+    argumentos = [(ruta, hoja, batch_size, huella_por_ruta[ruta]) for ruta, hoja in fuentes]
+    if procesos:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            leidas = list(pool.map(_leer_limpiar_fuente, *zip(*argumentos))) if argumentos else []
+    else:
+        leidas = [_leer_limpiar_fuente(*args) for args in argumentos]
+    
+    partes = []
+    for (ruta, hoja), (limpio, rechazos, lotes, leyendo, limpiando) in zip(fuentes, leidas):
+        nombre = nombre_fuente(ruta, hoja)
+        filas = 0 if limpio is None else len(limpio)
+        lectura.registrar(filas, leyendo, lotes)
+        limpieza.registrar(filas, limpiando, lotes)
+        logger.info(f"Fuente {nombre}: {filas} filas")
+        reportar_rechazos(nombre, rechazos, resultado.setdefault('rechazos', {}), origen='Fuente')
+        partes.append((nombre, limpio))
+    
+    combinado, resultado['conflictos'] = combinar_fuentes(partes)
+    logger.info(f"{len(combinado)} beneficiarios distintos en {len(fuentes)} fuentes, "
+                f"leídas y limpiadas en {time.perf_counter() - inicio:.1f} s")
+    for inicio in range(0, len(combinado), batch_size):
+        yield combinado.iloc[inicio:inicio + batch_size]
+
+def sumar_fuentes(contadores, totales):
+    """Agrega a los contadores del pipeline los rechazos y conflictos que leer_fuentes contó antes de escribir"""
+    for columna, cantidad in totales.get('rechazos', {}).items():
+        contadores['rechazos'][columna] = contadores['rechazos'].get(columna, 0) + cantidad
+    contadores['errores'] += totales.get('conflictos', 0)
+
+def preparar_lectura(excel_file_path, batch_size, procesos, usar_cache, lectura, hojas=None):
+    """(huella, lotes, limpieza, totales) de una importación de uno o varios archivos.
+
+    Con un solo archivo y sin `hojas` los lotes son los de leer_lotes y
+    limpieza es None (se limpian en el pipeline). Con varios archivos u hojas
+    son los ya limpios y combinados de leer_fuentes, limpieza es la Etapa que
+    los midió y la huella combina las de todos los archivos (ver
+    puntos_control.huella_conjunto). `totales` recibe los rechazos y
+    conflictos de leer_fuentes al terminar de leer.
+    """
+    rutas = [excel_file_path] if isinstance(excel_file_path, (str, os.PathLike)) else list(excel_file_path)
+    totales = {}
+    if len(rutas) == 1 and not hojas:
+        huella = puntos_control.huella_archivo(rutas[0])
+        return huella, leer_lotes(rutas[0], batch_size, huella, usar_cache), None, totales
+    
+    huellas = [puntos_control.huella_archivo(ruta) for ruta in rutas]
+    limpieza = Etapa('limpieza' + (f' ({procesos} procesos)' if procesos else ''))
+    lotes = leer_fuentes(rutas, hojas, batch_size, procesos, huellas if usar_cache else [None] * len(rutas),
+                         lectura, limpieza, totales)
+    return puntos_control.huella_conjunto(huellas, hojas), lotes, limpieza, totales
+
+def validar_excel(excel_file_path, batch_size=1000, procesos=None, usar_cache=True, hojas=None):
+    """Modo de prueba: lee y limpia el archivo con el mismo pipeline que importar_excel y evalúa
+    las reglas de serviuapp.validacion, sin tocar la base. Acepta varios
+    archivos u hojas igual que importar_excel.
+
+    Registra un reporte compacto (fallas por regla con filas de muestra, valores
+    que se importarían como NULL e ids repetidos) y devuelve True
+    si el archivo no tiene ningún problema.
+    """
+    logger.info(f"Validando (sin escribir en la base): {excel_file_path}")
+    try:
+        if procesos is None:
+            procesos = procesos_por_defecto()
+        lectura = Etapa('lectura')
+        inicio = time.perf_counter()
+        _, lotes, limpieza, totales = preparar_lectura(excel_file_path, batch_size, procesos, usar_cache, lectura, hojas)
+        primer_lote = next(lotes, None)
+        if primer_lote is None:
+            logger.error("El archivo no tiene filas para validar")
+            return False
+        if limpieza is None:
+            lectura.registrar(len(primer_lote), time.perf_counter() - inicio)
+        
+        contadores, etapas = ejecutar_pipeline(primer_lote, lotes, batch_size, procesos, 'validacion', lectura,
+                                               limpieza=limpieza)
+        sumar_fuentes(contadores, totales)
+        duracion = time.perf_counter() - inicio
+    except Exception as e:
+        logger.error(f"Error crítico durante la validación: {e}")
+        return False
+    
+    fallas = contadores.get('validacion', {})
+    logger.info("=== VALIDACIÓN ===")
+    logger.info(f"Filas leídas: {contadores['filas_leidas']} en {duracion:.1f} s")
+    for linea in validacion.reporte(fallas):
+        logger.info(linea)
+    for columna, cantidad in contadores['rechazos'].items():
+        logger.info(f"Valores inválidos en '{columna}' (se importarían como NULL): {cantidad}")
+    if contadores['errores']:
+        logger.info(f"Filas con id_beneficiario repetido (se omitirían): {contadores['errores']}")
+    for etapa in etapas:
+        logger.info(etapa.reporte())
+    
+    valido = not fallas and not contadores['rechazos'] and not contadores['errores']
+    logger.info("El archivo no tiene problemas" if valido else "El archivo tiene problemas; no se escribió nada en la base")
+    return valido
+
+def importar_excel(excel_file_path, batch_size=1000, procesos=None, carga='orm', modo='completo', avance=None,
+                   reanudar=False, usar_cache=True, hojas=None):
+    """Importa un archivo Excel, o varios archivos y hojas como un solo conjunto.
+
+    En modo 'completo' reemplaza los datos existentes; en modo 'incremental'
+    inserta o actualiza solo las filas nuevas o con otra huella y da de baja
+    las que ya no vienen (la carga es siempre el upsert del ORM); en modo
+    'reemplazo' carga tablas sombra y las intercambia con las actuales al
+    final (ver serviuapp.tablas_sombra), sin dejar la aplicación sin datos. La lectura,
+    la limpieza (en `procesos` procesos; 0 la hace en un hilo) y la escritura
+    (según `carga`, ver CARGAS) corren como etapas en paralelo; ver
+    ejecutar_pipeline, que también explica `avance`. Devuelve True si la
+    importación terminó.
+
+    Cada lote se confirma junto con un punto de control (ver
+    serviuapp.puntos_control); con `reanudar` una importación interrumpida
+    del mismo archivo y con las mismas opciones sigue desde el último lote
+    confirmado, sin vaciar las tablas ni volver a crear las tablas sombra.
+    Con `usar_cache` el archivo se lee de la caché columnar si ya se importó
+    antes (ver serviuapp.cache_excel).
+
+    `excel_file_path` puede ser una lista de archivos; con varios archivos o
+    con `hojas` (nombres de hoja, o TODAS_LAS_HOJAS) cada hoja se lee y limpia
+    completa en el pool de procesos y todas se combinan sin ids repetidos en
+    una sola escritura ordenada (ver leer_fuentes). Sin `hojas` se lee la hoja
+    activa de cada archivo.
+    """
+    logger.info(f"{'Reanudando' if reanudar else 'Iniciando'} importación {modo} desde: {excel_file_path}")
+    
+    punto = None
+    try:
+        if modo == 'incremental':
+            carga = 'incremental'
+        if procesos is None:
+            procesos = procesos_por_defecto()
+        
+        # Leer archivo Excel por lotes; el primero se lee antes de limpiar las
+        # tablas para no borrar nada si el archivo no se puede abrir (con varias
+        # fuentes se leen y limpian todas antes)
+        logger.info("Leyendo archivo Excel...")
+        lectura = Etapa('lectura')
+        huella, lotes, limpieza, totales = preparar_lectura(excel_file_path, batch_size, procesos, usar_cache,
+                                                             lectura, hojas)
+        ids_confirmados = set()
+        if reanudar:
+            punto = puntos_control.retomar(huella, modo, carga, batch_size)
+            if modo == 'reemplazo' and not tablas_sombra.existen():
+                raise puntos_control.PuntoControlInvalido("las tablas sombra de la importación interrumpida ya no existen")
+            logger.info(f"Saltando {punto.lote} lotes ya confirmados ({punto.fila} filas)...")
+            ids_confirmados = saltar_lotes(lotes, punto, lectura if limpieza is None else None)
+        
+        inicio = time.perf_counter()
+        primer_lote = next(lotes, None)
+        if primer_lote is None and punto is None:
+            logger.error("El archivo no tiene filas para importar")
+            return False
+        if primer_lote is not None and limpieza is None:
+            lectura.registrar(len(primer_lote), time.perf_counter() - inicio)
+            logger.info(f"Columnas encontradas: {list(primer_lote.columns)}")
+        
+        sufijo = ''
+        if modo == 'reemplazo':
+            # Las tablas en uso no se tocan hasta el intercambio final
+            sufijo = tablas_sombra.SUFIJO_SOMBRA
+            if punto is None:
+                logger.info("Creando tablas sombra...")
+                tablas_sombra.preparar()
+        elif modo == 'completo' and punto is None:
+            # Limpiar datos antes de la importación
+            logger.info("Limpiando tablas existentes...")
+            limpiar_tablas()
+        if punto is None:
+            punto = puntos_control.iniciar(huella, excel_file_path, modo, carga, batch_size)
+        
+        # Procesar en lotes
+        logger.info(f"Procesando datos en lotes de {batch_size} ({procesos} procesos de limpieza, carga {carga})...")
+        
+        inicio = time.perf_counter()
+        try:
+            contadores, etapas = ejecutar_pipeline(primer_lote, lotes, batch_size, procesos, carga, lectura,
+                                                   sufijo, avance, punto, ids_confirmados, limpieza)
+            sumar_fuentes(contadores, totales)
+            if modo == 'reemplazo':
+                intercambiar_sombras(contadores)
+        except tablas_sombra.ValidacionFallida:
+            # La carga terminó pero no sirve: no hay nada que reanudar
+            tablas_sombra.descartar()
+            puntos_control.terminar(punto)
+            punto = None
+            raise
+        if modo == 'incremental':
+            dar_de_baja(contadores['ids'], contadores)
+        duracion = time.perf_counter() - inicio
+        
+        # Recalcular la tabla resumen usada por el dashboard (en reemplazo ya se llenó la sombra)
+        cambios = contadores['beneficiarios'] + contadores['nuevos'] + contadores['actualizados'] + contadores['eliminados']
+        if modo == 'completo' or (modo == 'incremental' and cambios):
+            logger.info("Reconstruyendo tabla resumen_beneficiarios...")
+            filas_resumen = reconstruir_resumen()
+            logger.info(f"Tabla resumen reconstruida: {filas_resumen} filas")
+        
+        # Resumen final
+        logger.info("=== RESUMEN DE IMPORTACIÓN ===")
+        logger.info(f"Filas leídas: {contadores['filas_leidas']}")
+        if modo == 'incremental':
+            logger.info(f"Beneficiarios nuevos: {contadores['nuevos']}")
+            logger.info(f"Beneficiarios actualizados: {contadores['actualizados']}")
+            logger.info(f"Beneficiarios sin cambios: {contadores['sin_cambios']}")
+            logger.info(f"Beneficiarios dados de baja: {contadores['eliminados']}")
+        else:
+            logger.info(f"Beneficiarios creados: {contadores['beneficiarios']}")
+            logger.info(f"Decretos creados: {contadores['decretos']}")
+            logger.info(f"Resoluciones creadas: {contadores['resoluciones']}")
+        logger.info(f"Cambios de beneficiario (reemplazos, renuncias...): {contadores['cambios']}")
+        logger.info(f"Errores: {contadores['errores']}")
+        for columna, cantidad in contadores['rechazos'].items():
+            logger.info(f"Valores inválidos en '{columna}' (importados como NULL): {cantidad}")
+        
+        # Rendimiento por etapa: la que más tiempo trabaja limita al resto
+        logger.info(f"=== RENDIMIENTO ({duracion:.1f} s, {contadores['filas_leidas'] / duracion if duracion else 0:.0f} filas/s) ===")
+        for etapa in etapas:
+            logger.info(etapa.reporte())
+        logger.info(f"Etapa más lenta: {max(etapas, key=lambda etapa: etapa.trabajando).nombre}")
+        puntos_control.terminar(punto)
+        logger.info("Importación completada exitosamente")
+        
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error crítico durante la importación: {e}")
+        if punto is not None and punto.lote:
+            logger.info(f"Quedaron confirmados {punto.lote} lotes ({punto.fila} filas); "
+                        "ejecute de nuevo con --reanudar para continuar desde ahí")
+        return False
@@ -0,0 +1,145 @@
+# management/commands/explicar_consultas.py
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from serviuapp import cambios
+from serviuapp.aggregations import construir_consulta, construir_filtros
+from serviuapp.models import Beneficiarios, CambioBeneficiario, Decretos, Resoluciones
+from serviuapp.paginacion import COLUMNAS_TABLA, FROM_DETALLE, ORDEN_DETALLE, SELECT_DETALLE
+from serviuapp.resumen import GROUP_BY_CLAVES, SELECT_CLAVES
+
+# Modelos cuyos Meta.indexes se quitan temporalmente con --comparar
+MODELOS_INDEXADOS = (Beneficiarios, Decretos, Resoluciones, CambioBeneficiario)
+
+
+class Command(BaseCommand):
+    help = 'Muestra el plan (EXPLAIN) y el tiempo de cada familia de consultas de las vistas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5,
+                            help='Ejecuciones por consulta para medir el tiempo (mediana)')
+        parser.add_argument('--comparar', action='store_true',
+                            help='Mide también sin los índices compuestos (los quita y los vuelve a crear)')
+
+    def handle(self, *args, **options):
+        consultas = self.familias()
+        if not consultas:
+            self.stdout.write(self.style.WARNING('No hay beneficiarios: no hay datos con que medir'))
+            return
+
+        if options['comparar']:
+            self.stdout.write(self.style.WARNING('Quitando temporalmente los índices compuestos...'))
+            self.quitar_indices()
+            try:
+                self.stdout.write(self.style.MIGRATE_HEADING('=== SIN ÍNDICES ==='))
+                antes = self.reportar(consultas, options['repeticiones'])
+            finally:
+                self.crear_indices()
+            self.stdout.write(self.style.MIGRATE_HEADING('=== CON ÍNDICES ==='))
+            despues = self.reportar(consultas, options['repeticiones'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING('=== RESUMEN ==='))
+            for nombre, _, _ in consultas:
+                self.stdout.write(f'{nombre:<45} {antes[nombre]:>9.2f} ms -> {despues[nombre]:>9.2f} ms')
+        else:
+            self.reportar(consultas, options['repeticiones'])
+
+    def familias(self):
+        """Consultas representativas de cada vista, con valores de ejemplo tomados de la base"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT b.id_beneficiario, b.rut_normalizado, b.comuna, b.provincia, r.ano_imputacion_res_of, d.decreto, d.tipologia
+                FROM beneficiarios b
+                LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario
+                LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
+                ORDER BY b.id_beneficiario LIMIT 1
+            """)
+            ejemplo = cursor.fetchone()
+        if ejemplo is None:
+            return []
+        id_beneficiario, rut, comuna, provincia, ano, decreto, tipologia = ejemplo
+
+        consultas = []
+
+        query, params = construir_consulta([comuna], None, [ano])
+        consultas.append(('dashboard/filtros: conteos del resumen', query, params))
+
+        filter_sql, params = construir_filtros([comuna], [provincia], None)
+        consultas.append(('reconstruir resumen (JOIN agrupado)', SELECT_CLAVES + filter_sql + GROUP_BY_CLAVES, params))
+
+        consultas.append(('resumen incremental por beneficiario',
+                          SELECT_CLAVES + " WHERE b.id_beneficiario = %s" + GROUP_BY_CLAVES, [id_beneficiario]))
+
+        consultas.append(('conteo directo decreto/tipología', """
+            SELECT COUNT(*) FROM beneficiarios b
+            LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
+            WHERE d.decreto = %s AND d.tipologia = %s
+        """, [decreto, tipologia]))
+
+        consultas.append(('lista: ids de la página (keyset)',
+                          "SELECT id_beneficiario FROM beneficiarios WHERE id_beneficiario > %s "
+                          "ORDER BY id_beneficiario ASC LIMIT %s", [id_beneficiario, 11]))
+
+        consultas.append(('lista: filas de la página',
+                          SELECT_DETALLE + " WHERE b.id_beneficiario IN (%s)" + ORDEN_DETALLE, [id_beneficiario]))
+
+        filter_sql, params = construir_filtros([comuna], None, [ano])
+        consultas.append(('filtros: ids del detalle por comuna y año',
+                          "SELECT DISTINCT b.id_beneficiario FROM beneficiarios b"
+                          " LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario"
+                          + filter_sql + " ORDER BY b.id_beneficiario LIMIT %s", params + [51]))
+
+        filter_sql, params = construir_filtros(None, [provincia], None)
+        columnas = ', '.join(columna for _, columna in COLUMNAS_TABLA)
+        consultas.append(('filtros: filas del detalle por provincia',
+                          f"SELECT {columnas}{FROM_DETALLE}{filter_sql}{ORDEN_DETALLE} LIMIT %s", params + [51]))
+
+        consultas.append(('busqueda: por rut', SELECT_DETALLE + " WHERE b.rut_normalizado = %s" + ORDEN_DETALLE, [rut]))
+
+        consultas.append(('busqueda: reemplazos y renuncias por rut', cambios.CAMBIOS_POR_RUT, [rut, rut]))
+
+        query, params = cambios.construir_consulta([comuna], None, [ano])
+        consultas.append(('dashboard: cambios por tipo', query, params))
+
+        return consultas
+
+    def reportar(self, consultas, repeticiones):
+        """Imprime el plan y la mediana de tiempo de cada consulta; devuelve {nombre: ms}"""
+        prefijo = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        tiempos = {}
+
+        for nombre, query, params in consultas:
+            with connection.cursor() as cursor:
+                cursor.execute(prefijo + query, params)
+                columnas = [col[0] for col in cursor.description]
+                plan = cursor.fetchall()
+
+                muestras = []
+                for _ in range(max(repeticiones, 1)):
+                    inicio = time.perf_counter()
+                    cursor.execute(query, params)
+                    cursor.fetchall()
+                    muestras.append((time.perf_counter() - inicio) * 1000)
+
+            tiempos[nombre] = statistics.median(muestras)
+            self.stdout.write(self.style.SUCCESS(f'\n{nombre}: {tiempos[nombre]:.2f} ms'))
+            self.stdout.write('  ' + ' | '.join(columnas))
+            for fila in plan:
+                self.stdout.write('  ' + ' | '.join('' if valor is None else str(valor) for valor in fila))
+
+        return tiempos
+
+    def quitar_indices(self):
+        with connection.schema_editor() as schema_editor:
+            for modelo in MODELOS_INDEXADOS:
+                for indice in modelo._meta.indexes:
+                    schema_editor.remove_index(modelo, indice)
+
+    def crear_indices(self):
+        with connection.schema_editor() as schema_editor:
+            for modelo in MODELOS_INDEXADOS:
+                for indice in modelo._meta.indexes:
+                    schema_editor.add_index(modelo, indice)
@@ -1,51 +1,87 @@
 # management/commands/import_data.py
-import pandas as pd
-from django.core.management.base import BaseCommand
-from serviuapp.resources import BeneficiariosResource, DecretosResource
-from serviuapp.models import Beneficiarios, Decretos
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from serviuapp.importador import (
+    CARGAS, MODOS, TODAS_LAS_HOJAS, importar_excel, procesos_por_defecto, revertir_reemplazo, validar_excel,
+)
+
 
 class Command(BaseCommand):
-    help = 'Importa datos desde un archivo Excel y distribuye en Beneficiarios y Decretos'
+    help = ('Importa beneficiarios, decretos y resoluciones desde un archivo Excel, '
+            'reemplazando los datos existentes o solo aplicando las diferencias (--modo incremental)')
 
     def add_arguments(self, parser):
-        parser.add_argument('archivo', type=str)
-
-    def handle(self, *args, **kwargs):
-        archivo = kwargs['archivo']
-        
-        # Lee el archivo Excel
-        df = pd.read_excel(archivo)
-
-        # Separa los datos para Beneficiarios y Decretos
-        beneficiarios_data = df[['id_beneficiario', 'rut', 'dv', 'primer_y_segundo_nombre', 'primer_apellido', 'segundo_apellido', 'comuna', 'provincia', 'codigo_proyecto', 'nombre_grupo', 'sexo']]
-        decretos_data = df[['id_decreto', 'programa', 'tipologian', 'tramo', 'decreto_id_beneficiario']]
-
-        # Importar Beneficiarios
-        beneficiarios_resource = BeneficiariosResource()
-        beneficiarios_resource.import_data(beneficiarios_data, dry_run=False)
-
-        # Asegúrate de que Beneficiarios están guardados antes de importar Decretos
-        # Esto es crucial para las relaciones de clave foránea
-        for index, row in decretos_data.iterrows():
-            beneficiario_id = row['id_beneficiario']
-            try:
-                beneficiario = Beneficiarios.objects.get(id_beneficiario=beneficiario_id)
-            except Beneficiarios.DoesNotExist:
-                self.stdout.write(self.style.ERROR(f'Beneficiario con id_beneficiario {beneficiario_id} no encontrado'))
-                continue
-
-            # Crear o actualizar el decreto
-            Decretos.objects.update_or_create(
-                id_decreto=row['id_decreto'],
-                defaults={
-                    'programa': row['programa'],
-                    'tipologia': row['tipologia'],
-                    'tramo': row['tramo'],
-                    'decreto_id_beneficiario': beneficiario
-                }
-            )
+        parser.add_argument('archivos', type=str, nargs='*',
+                            help='Uno o varios archivos Excel; varios se importan como un solo conjunto')
+        parser.add_argument('--hojas', nargs='+', default=None,
+                            help=f"Hojas a leer de cada archivo ('{TODAS_LAS_HOJAS}': todas las que tienen la "
+                                 "columna id_beneficiario). Por defecto la hoja activa")
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por lote')
+        parser.add_argument('--procesos', type=int, default=None,
+                            help=f'Procesos de limpieza; 0 limpia sin pool (por defecto {procesos_por_defecto()})')
+        parser.add_argument('--carga', choices=sorted(CARGAS), default='orm',
+                            help='orm: bulk_create; nativa: LOAD DATA LOCAL INFILE en MySQL '
+                                 '(INSERT de varias filas en otras bases)')
+        parser.add_argument('--modo', choices=MODOS, default='completo',
+                            help='completo: borra y recarga todo; incremental: solo inserta o actualiza '
+                                 'las filas que cambiaron y da de baja las que ya no vienen; reemplazo: '
+                                 'recarga todo en tablas sombra y las intercambia al final sin cortar el servicio')
+        parser.add_argument('--revertir', action='store_true',
+                            help='Vuelve a los datos anteriores a la última importación en modo reemplazo')
+        parser.add_argument('--reanudar', '--resume', action='store_true', dest='reanudar',
+                            help='Continúa una importación interrumpida del mismo archivo desde el último '
+                                 'lote confirmado (con las mismas opciones de --modo, --carga y --lote)')
+        parser.add_argument('--sin-cache', action='store_false', dest='usar_cache',
+                            help='Lee el Excel aunque esté en la caché de archivos ya importados (y no lo guarda)')
+        parser.add_argument('--dry-run', '--validar', action='store_true', dest='validar',
+                            help='Solo lee, limpia y valida el archivo e informa sus problemas, sin tocar la base')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='No pedir confirmación antes de borrar los datos existentes')
+
+    def handle(self, *args, **options):
+        if options['revertir']:
+            if not revertir_reemplazo():
+                raise CommandError('No hay datos anteriores a los que volver')
+            self.stdout.write(self.style.SUCCESS('Datos anteriores restaurados'))
+            return
+
+        archivos = options['archivos']
+        if not archivos:
+            raise CommandError('Indique el archivo Excel a importar')
+        for archivo in archivos:
+            if not os.path.exists(archivo):
+                raise CommandError(f'El archivo {archivo} no existe')
+        archivo = archivos[0] if len(archivos) == 1 else archivos
+
+        if options['validar']:
+            if not validar_excel(archivo, batch_size=options['lote'], procesos=options['procesos'],
+                                 usar_cache=options['usar_cache'], hojas=options['hojas']):
+                raise CommandError('El archivo tiene problemas; revise el reporte en el log')
+            self.stdout.write(self.style.SUCCESS('El archivo no tiene problemas'))
+            return
+
+        if options['interactive'] and not options['reanudar']:
+            if options['modo'] == 'incremental':
+                aviso = 'Se darán de baja los beneficiarios que no vengan en el archivo.'
+            elif options['modo'] == 'reemplazo':
+                aviso = 'Los datos existentes se reemplazarán al terminar la carga.'
+            else:
+                aviso = 'Esto eliminará todos los datos existentes.'
+            confirmacion = input(f'{aviso} ¿Desea continuar? (s/N): ')
+            if confirmacion.lower() not in ('s', 'si', 'sí', 'y', 'yes'):
+                self.stdout.write('Importación cancelada')
+                return
+
+        # El avance y el resumen se registran en el log (logger serviuapp.importador)
+        exito = importar_excel(archivo, batch_size=options['lote'], procesos=options['procesos'],
+                               carga=options['carga'], modo=options['modo'], reanudar=options['reanudar'],
+                               usar_cache=options['usar_cache'], hojas=options['hojas'])
+        if not exito:
+            raise CommandError('Error durante la importación; revise el log')
 
         self.stdout.write(self.style.SUCCESS('Importación completada con éxito'))
 
 
-#python manage.py import_data ruta/al/archivo.xlsx
+#python manage.py import_data ruta/al/archivo.xlsx --carga nativa
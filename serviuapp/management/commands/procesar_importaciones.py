@@ -0,0 +1,41 @@
+# management/commands/procesar_importaciones.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from serviuapp import trabajos
+
+
+class Command(BaseCommand):
+    help = ('Proceso trabajador: ejecuta de a una las importaciones encoladas desde la web '
+            '(tabla trabajos_importacion)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', dest='una_vez',
+                            help='Procesa los trabajos pendientes y termina en vez de seguir esperando')
+        parser.add_argument('--espera', type=float, default=trabajos.ESPERA_COLA,
+                            help='Segundos entre consultas de la cola cuando está vacía')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            perdidos = trabajos.marcar_perdidos()
+            if perdidos:
+                self.stderr.write(f'{perdidos} importaciones sin avance marcadas como fallidas')
+
+            trabajo = trabajos.tomar_siguiente()
+            if trabajo is None:
+                if options['una_vez']:
+                    return
+                time.sleep(options['espera'])
+                continue
+
+            self.stdout.write(f'Importación {trabajo.pk}: {trabajo.nombre_archivo} (modo {trabajo.modo})')
+            if trabajos.ejecutar(trabajo):
+                self.stdout.write(self.style.SUCCESS(f'Importación {trabajo.pk} completada'))
+            else:
+                self.stderr.write(self.style.ERROR(f'Importación {trabajo.pk} fallida; revise su registro'))
+
+
+#python manage.py procesar_importaciones
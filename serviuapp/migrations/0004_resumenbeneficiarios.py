@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0003_chatinteraction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenBeneficiarios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('decreto', models.CharField(blank=True, max_length=10, null=True)),
+                ('tipologia', models.CharField(blank=True, max_length=50, null=True)),
+                ('comuna', models.CharField(blank=True, max_length=100, null=True)),
+                ('provincia', models.CharField(blank=True, max_length=100, null=True)),
+                ('ano_imputacion_res_of', models.IntegerField(blank=True, null=True)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'resumen_beneficiarios',
+                'managed': True,
+            },
+        ),
+        # Carga inicial del resumen con los datos ya existentes
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO resumen_beneficiarios
+                    (decreto, tipologia, comuna, provincia, ano_imputacion_res_of, total)
+                SELECT d.decreto, d.tipologia, b.comuna, b.provincia, r.ano_imputacion_res_of, COUNT(*)
+                FROM beneficiarios b
+                LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario
+                LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
+                GROUP BY d.decreto, d.tipologia, b.comuna, b.provincia, r.ano_imputacion_res_of
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
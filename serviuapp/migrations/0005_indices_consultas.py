@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0004_resumenbeneficiarios'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='beneficiarios',
+            index=models.Index(fields=['comuna', 'provincia'], name='benef_comuna_prov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='beneficiarios',
+            index=models.Index(fields=['provincia'], name='benef_provincia_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='beneficiarios',
+            index=models.Index(fields=['rut'], name='benef_rut_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='decretos',
+            index=models.Index(fields=['decreto', 'tipologia', 'decreto_id_beneficiario'], name='decretos_dec_tip_benef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resoluciones',
+            index=models.Index(fields=['ano_imputacion_res_of', 'resolucion_id_beneficiario'], name='resol_ano_benef_idx'),
+        ),
+    ]
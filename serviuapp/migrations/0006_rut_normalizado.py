@@ -0,0 +1,66 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+# Copia de serviuapp.rut al momento de esta migración, para que un cambio
+# posterior de ese módulo no cambie lo que hace
+def calcular_dv(cuerpo):
+    suma = 0
+    factor = 2
+    for digito in reversed(cuerpo):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def normalizar_rut(rut):
+    texto = ''.join(str(rut or '').split()).replace('.', '').upper().lstrip('0')
+    if '-' in texto:
+        cuerpo, dv = texto.rsplit('-', 1)
+        dv = dv or None
+    elif texto.endswith('K') or len(texto) > 8:
+        cuerpo, dv = texto[:-1], texto[-1:]
+    else:
+        cuerpo, dv = texto, None
+    cuerpo = cuerpo.lstrip('0')
+    if not cuerpo.isdigit() or len(cuerpo) > 8:
+        return None
+    verificador = calcular_dv(cuerpo)
+    if dv is not None and dv != verificador:
+        return None
+    return f'{cuerpo}-{verificador}'
+
+
+def poblar_rut_normalizado(apps, schema_editor):
+    Beneficiarios = apps.get_model('serviuapp', 'Beneficiarios')
+    lote = []
+    for beneficiario in Beneficiarios.objects.only('id_beneficiario', 'rut').iterator(chunk_size=2000):
+        beneficiario.rut_normalizado = normalizar_rut(beneficiario.rut)
+        lote.append(beneficiario)
+        if len(lote) >= 2000:
+            Beneficiarios.objects.bulk_update(lote, ['rut_normalizado'])
+            lote = []
+    if lote:
+        Beneficiarios.objects.bulk_update(lote, ['rut_normalizado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0005_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='beneficiarios',
+            name='benef_rut_idx',
+        ),
+        migrations.AddField(
+            model_name='beneficiarios',
+            name='rut_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(poblar_rut_normalizado, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0006_rut_normalizado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BajaBeneficiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_beneficiario', models.IntegerField(db_index=True)),
+                ('rut', models.CharField(blank=True, max_length=50)),
+                ('rut_normalizado', models.CharField(blank=True, max_length=12, null=True)),
+                ('huella', models.CharField(blank=True, max_length=32, null=True)),
+                ('fecha_baja', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'bajas_beneficiarios',
+                'managed': True,
+            },
+        ),
+        migrations.AddField(
+            model_name='beneficiarios',
+            name='huella',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0007_importacion_incremental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(help_text='Ruta del archivo subido', max_length=500)),
+                ('nombre_archivo', models.CharField(max_length=255)),
+                ('modo', models.CharField(default='completo', max_length=20)),
+                ('carga', models.CharField(default='orm', max_length=20)),
+                ('usuario', models.CharField(blank=True, max_length=150)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('terminado', 'Terminado'), ('fallido', 'Fallido')], db_index=True, default='pendiente', max_length=20)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('filas_totales', models.IntegerField(blank=True, null=True)),
+                ('filas_leidas', models.IntegerField(default=0)),
+                ('filas_limpias', models.IntegerField(default=0)),
+                ('filas_escritas', models.IntegerField(default=0)),
+                ('errores', models.IntegerField(default=0)),
+                ('filas_rechazadas', models.IntegerField(default=0)),
+                ('resultado', models.JSONField(blank=True, default=dict)),
+                ('registro', models.TextField(blank=True, help_text='Mensajes del importador durante el trabajo')),
+            ],
+            options={
+                'db_table': 'trabajos_importacion',
+                'ordering': ['-creado'],
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='FilaRechazada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fila', models.IntegerField(help_text='Fila de Excel')),
+                ('columna', models.CharField(max_length=100)),
+                ('valor', models.CharField(blank=True, max_length=255)),
+                ('motivo', models.CharField(max_length=255)),
+                ('trabajo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rechazadas', to='serviuapp.trabajoimportacion')),
+            ],
+            options={
+                'db_table': 'filas_rechazadas_importacion',
+                'ordering': ['trabajo', 'fila'],
+                'managed': True,
+            },
+        ),
+    ]
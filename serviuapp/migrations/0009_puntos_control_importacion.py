@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0008_trabajos_importacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PuntoControlImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('huella_archivo', models.CharField(help_text='SHA-256 del archivo', max_length=64, unique=True)),
+                ('archivo', models.CharField(max_length=500)),
+                ('modo', models.CharField(max_length=20)),
+                ('carga', models.CharField(max_length=20)),
+                ('tamano_lote', models.IntegerField()),
+                ('lote', models.IntegerField(default=0, help_text='Último lote confirmado')),
+                ('fila', models.IntegerField(default=0, help_text='Filas de datos del archivo cubiertas por esos lotes')),
+                ('contadores', models.JSONField(blank=True, default=dict)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'puntos_control_importacion',
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.16 on 2026-10-18 19:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serviuapp', '0009_puntos_control_importacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CambioBeneficiario',
+            fields=[
+                ('id_cambio', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('REEMPLAZO', 'Reemplazo'), ('SUSTITUCION', 'Sustitución'), ('ELIMINACION', 'Eliminación'), ('RENUNCIA', 'Renuncia')], max_length=20)),
+                ('rut_anterior', models.CharField(blank=True, max_length=12, null=True)),
+                ('rut_nuevo', models.CharField(blank=True, max_length=50)),
+                ('dv_nuevo', models.CharField(blank=True, max_length=10)),
+                ('rut_nuevo_normalizado', models.CharField(blank=True, editable=False, max_length=12, null=True)),
+                ('nombres_nuevo', models.CharField(blank=True, max_length=255)),
+                ('primer_apellido_nuevo', models.CharField(blank=True, max_length=100)),
+                ('segundo_apellido_nuevo', models.CharField(blank=True, max_length=100)),
+                ('resolucion', models.IntegerField(blank=True, null=True)),
+                ('fecha_resolucion', models.DateField(blank=True, null=True)),
+                ('cambio_id_beneficiario', models.ForeignKey(db_column='cambio_id_beneficiario', on_delete=django.db.models.deletion.CASCADE, to='serviuapp.beneficiarios')),
+            ],
+            options={
+                'db_table': 'cambios_beneficiario',
+                'managed': True,
+                'indexes': [models.Index(fields=['rut_anterior'], name='cambios_rut_anterior_idx'), models.Index(fields=['rut_nuevo_normalizado'], name='cambios_rut_nuevo_idx'), models.Index(fields=['tipo', 'cambio_id_beneficiario'], name='cambios_tipo_benef_idx')],
+            },
+        ),
+    ]
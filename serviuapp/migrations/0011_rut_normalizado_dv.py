@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+# Copia de serviuapp.rut al momento de esta migración, para que un cambio
+# posterior de ese módulo no cambie lo que hace
+def calcular_dv(cuerpo):
+    suma = 0
+    factor = 2
+    for digito in reversed(cuerpo):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def normalizar_rut(rut, dv=None):
+    texto = ''.join(str(rut or '').split()).replace('.', '').upper().lstrip('0')
+    if '-' in texto:
+        cuerpo, dv_rut = texto.rsplit('-', 1)
+        dv_rut = dv_rut or None
+    elif texto.endswith('K') or len(texto) > 8:
+        cuerpo, dv_rut = texto[:-1], texto[-1:]
+    else:
+        cuerpo, dv_rut = texto, None
+    cuerpo = cuerpo.lstrip('0')
+    if not cuerpo.isdigit() or len(cuerpo) > 8:
+        return None
+    verificador = calcular_dv(cuerpo)
+    dv = str(dv).strip().upper() or None if dv is not None else None
+    if any(escrito is not None and escrito != verificador for escrito in (dv_rut, dv)):
+        return None
+    return f'{cuerpo}-{verificador}'
+
+
+def recalcular_rut_normalizado(apps, schema_editor):
+    Beneficiarios = apps.get_model('serviuapp', 'Beneficiarios')
+    lote = []
+    for beneficiario in Beneficiarios.objects.only('id_beneficiario', 'rut', 'dv').iterator(chunk_size=2000):
+        beneficiario.rut_normalizado = normalizar_rut(beneficiario.rut, beneficiario.dv or None)
+        lote.append(beneficiario)
+        if len(lote) >= 2000:
+            Beneficiarios.objects.bulk_update(lote, ['rut_normalizado'])
+            lote = []
+    if lote:
+        Beneficiarios.objects.bulk_update(lote, ['rut_normalizado'])
+
+
+class Migration(migrations.Migration):
+    """rut_normalizado considerando también la columna dv (0006 solo miraba rut)"""
+
+    dependencies = [
+        ('serviuapp', '0010_cambios_beneficiario'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalcular_rut_normalizado, migrations.RunPython.noop),
+    ]
@@ -7,6 +7,7 @@
 # Feel free to rename the models, but don't rename db_table values or field names.
 from django.db import models
 
+from .rut import normalizar_rut
 
 
 class Beneficiarios(models.Model):
@@ -21,10 +22,24 @@ class Beneficiarios(models.Model):
     codigo_proyecto = models.CharField(max_length=100,blank=True)
     nombre_grupo = models.CharField(max_length=255, blank=True)
     sexo = models.CharField(max_length=10, blank=True)
+    # Forma canónica 'cuerpo-DV' del rut (ver serviuapp.rut); se calcula al guardar
+    rut_normalizado = models.CharField(max_length=12, blank=True, null=True, editable=False, db_index=True)
+    # MD5 de la fila del Excel de la que se importó (ver serviuapp.importador);
+    # la importación incremental solo reescribe las filas cuya huella cambió
+    huella = models.CharField(max_length=32, blank=True, null=True, editable=False)
 
     class Meta:
         managed = True
         db_table = 'beneficiarios'
+        indexes = [
+            # Filtros de comuna/provincia del dashboard y filtros
+            models.Index(fields=['comuna', 'provincia'], name='benef_comuna_prov_idx'),
+            models.Index(fields=['provincia'], name='benef_provincia_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.rut_normalizado = normalizar_rut(self.rut, self.dv or None)
+        super().save(*args, **kwargs)
 
 
 class Decretos(models.Model):
@@ -41,6 +56,10 @@ class Decretos(models.Model):
     class Meta:
         managed = True
         db_table = 'decretos'
+        indexes = [
+            # Conteos por decreto/tipología; incluye el FK para resolver el JOIN desde el índice
+            models.Index(fields=['decreto', 'tipologia', 'decreto_id_beneficiario'], name='decretos_dec_tip_benef_idx'),
+        ]
 
 class Resoluciones(models.Model):
     id_resolucion = models.AutoField(primary_key=True)
@@ -56,6 +75,160 @@ class Resoluciones(models.Model):
     class Meta:
         managed = True
         db_table = 'resoluciones'
+        indexes = [
+            # Filtro por año de imputación; incluye el FK para resolver el JOIN desde el índice
+            models.Index(fields=['ano_imputacion_res_of', 'resolucion_id_beneficiario'], name='resol_ano_benef_idx'),
+        ]
+
+class CambioBeneficiario(models.Model):
+    # Reemplazo, sustitución, eliminación o renuncia que el Excel informa para un
+    # beneficiario (columnas REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA a APELLIDO2,
+    # res. n° y fecha_res). Guarda el RUT anterior y el nuevo normalizados, cada
+    # uno con índice, para responder quién reemplazó a quién (ver serviuapp.cambios)
+    REEMPLAZO = 'REEMPLAZO'
+    SUSTITUCION = 'SUSTITUCION'
+    ELIMINACION = 'ELIMINACION'
+    RENUNCIA = 'RENUNCIA'
+    TIPOS = [
+        (REEMPLAZO, 'Reemplazo'),
+        (SUSTITUCION, 'Sustitución'),
+        (ELIMINACION, 'Eliminación'),
+        (RENUNCIA, 'Renuncia'),
+    ]
+
+    id_cambio = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    # rut_normalizado del beneficiario al importar el cambio
+    rut_anterior = models.CharField(max_length=12, blank=True, null=True)
+    rut_nuevo = models.CharField(max_length=50, blank=True)
+    dv_nuevo = models.CharField(max_length=10, blank=True)
+    rut_nuevo_normalizado = models.CharField(max_length=12, blank=True, null=True, editable=False)
+    nombres_nuevo = models.CharField(max_length=255, blank=True)
+    primer_apellido_nuevo = models.CharField(max_length=100, blank=True)
+    segundo_apellido_nuevo = models.CharField(max_length=100, blank=True)
+    resolucion = models.IntegerField(blank=True, null=True)
+    fecha_resolucion = models.DateField(blank=True, null=True)
+    cambio_id_beneficiario = models.ForeignKey(Beneficiarios, on_delete=models.CASCADE, db_column='cambio_id_beneficiario')
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.rut_anterior} -> {self.rut_nuevo_normalizado or '-'}"
+
+    class Meta:
+        managed = True
+        db_table = 'cambios_beneficiario'
+        indexes = [
+            # Quién reemplazó a quién, en ambos sentidos
+            models.Index(fields=['rut_anterior'], name='cambios_rut_anterior_idx'),
+            models.Index(fields=['rut_nuevo_normalizado'], name='cambios_rut_nuevo_idx'),
+            # Conteos por tipo del dashboard; incluye el FK para resolver el JOIN de los filtros
+            models.Index(fields=['tipo', 'cambio_id_beneficiario'], name='cambios_tipo_benef_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.rut_nuevo_normalizado = normalizar_rut(self.rut_nuevo, self.dv_nuevo or None) if self.rut_nuevo else None
+        if self.rut_anterior is None:
+            self.rut_anterior = self.cambio_id_beneficiario.rut_normalizado
+        super().save(*args, **kwargs)
+
+class BajaBeneficiario(models.Model):
+    # Lápida de un beneficiario eliminado por una importación incremental porque
+    # ya no venía en el archivo; guarda con qué datos estaba para poder auditarlo
+    id_beneficiario = models.IntegerField(db_index=True)
+    rut = models.CharField(max_length=50, blank=True)
+    rut_normalizado = models.CharField(max_length=12, blank=True, null=True)
+    huella = models.CharField(max_length=32, blank=True, null=True)
+    fecha_baja = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = 'bajas_beneficiarios'
+
+    def __str__(self):
+        return f"Baja {self.id_beneficiario} ({self.rut_normalizado}) - {self.fecha_baja:%Y-%m-%d %H:%M}"
+
+
+class PuntoControlImportacion(models.Model):
+    # Último lote confirmado de una importación en curso o interrumpida (ver
+    # serviuapp.puntos_control); se elimina cuando la importación termina
+    huella_archivo = models.CharField(max_length=64, unique=True, help_text="SHA-256 del archivo")
+    archivo = models.CharField(max_length=500)
+    modo = models.CharField(max_length=20)
+    carga = models.CharField(max_length=20)
+    tamano_lote = models.IntegerField()
+    lote = models.IntegerField(default=0, help_text="Último lote confirmado")
+    fila = models.IntegerField(default=0, help_text="Filas de datos del archivo cubiertas por esos lotes")
+    # Contadores acumulados de la importación hasta ese lote
+    contadores = models.JSONField(default=dict, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'puntos_control_importacion'
+
+    def __str__(self):
+        return f"{self.archivo} ({self.modo}): lote {self.lote}, fila {self.fila}"
+
+
+class TrabajoImportacion(models.Model):
+    # Importación encolada desde la web; la ejecuta el comando procesar_importaciones
+    # (ver serviuapp.trabajos), que va guardando aquí el avance de cada etapa
+    PENDIENTE = 'pendiente'
+    EN_CURSO = 'en_curso'
+    TERMINADO = 'terminado'
+    FALLIDO = 'fallido'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'), (EN_CURSO, 'En curso'),
+        (TERMINADO, 'Terminado'), (FALLIDO, 'Fallido'),
+    ]
+
+    archivo = models.CharField(max_length=500, help_text="Ruta del archivo subido")
+    nombre_archivo = models.CharField(max_length=255)
+    modo = models.CharField(max_length=20, default='completo')
+    carga = models.CharField(max_length=20, default='orm')
+    usuario = models.CharField(max_length=150, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE, db_index=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(blank=True, null=True)
+    terminado = models.DateTimeField(blank=True, null=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    # Avance: filas del archivo (estimadas) y filas que pasó cada etapa del pipeline
+    filas_totales = models.IntegerField(blank=True, null=True)
+    filas_leidas = models.IntegerField(default=0)
+    filas_limpias = models.IntegerField(default=0)
+    filas_escritas = models.IntegerField(default=0)
+    errores = models.IntegerField(default=0)
+    filas_rechazadas = models.IntegerField(default=0)
+    # Contadores finales de la importación (creados, nuevos, actualizados, etc.)
+    resultado = models.JSONField(default=dict, blank=True)
+    registro = models.TextField(blank=True, help_text="Mensajes del importador durante el trabajo")
+
+    class Meta:
+        managed = True
+        db_table = 'trabajos_importacion'
+        ordering = ['-creado']
+
+    def __str__(self):
+        return f"Importación {self.id} ({self.nombre_archivo}) - {self.get_estado_display()}"
+
+
+class FilaRechazada(models.Model):
+    # Celda o fila del archivo que no se importó tal cual venía
+    trabajo = models.ForeignKey(TrabajoImportacion, on_delete=models.CASCADE, related_name='rechazadas')
+    fila = models.IntegerField(help_text="Fila de Excel")
+    columna = models.CharField(max_length=100)
+    valor = models.CharField(max_length=255, blank=True)
+    motivo = models.CharField(max_length=255)
+
+    class Meta:
+        managed = True
+        db_table = 'filas_rechazadas_importacion'
+        ordering = ['trabajo', 'fila']
+
+    def __str__(self):
+        return f"Fila {self.fila} ({self.columna}): {self.motivo}"
+
 
 class ChatInteraction(models.Model):
     # Información básica de la conversación
@@ -95,3 +268,20 @@ class ChatInteraction(models.Model):
     def __str__(self):
         return f"Chat {self.id} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
+
+class ResumenBeneficiarios(models.Model):
+    # Conteos pre-agregados del JOIN beneficiarios/resoluciones/decretos por
+    # decreto, tipología, comuna, provincia y año de imputación
+    decreto = models.CharField(max_length=10, blank=True, null=True)
+    tipologia = models.CharField(max_length=50, blank=True, null=True)
+    comuna = models.CharField(max_length=100, blank=True, null=True)
+    provincia = models.CharField(max_length=100, blank=True, null=True)
+    ano_imputacion_res_of = models.IntegerField(blank=True, null=True)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = 'resumen_beneficiarios'
+
+    def __str__(self):
+        return f"{self.decreto} {self.tipologia} - {self.comuna} {self.ano_imputacion_res_of}: {self.total}"
@@ -0,0 +1,13 @@
+"""
+Opciones de la importación (modo y carga) sin dependencias pesadas.
+
+Las vistas y la cola de trabajos validan y muestran estas opciones sin
+cargar el importador, que importa pandas, numpy, openpyxl y tqdm.
+"""
+
+# Modos de importación: completo borra y recarga; incremental solo aplica
+# diferencias; reemplazo recarga en tablas sombra y las intercambia al final
+MODOS = ('completo', 'incremental', 'reemplazo')
+
+# Formas de escribir en la base (opción carga / --carga); ver importador.ESCRITORES
+CARGAS = ('orm', 'nativa')
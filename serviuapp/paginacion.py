@@ -0,0 +1,230 @@
+"""
+Paginación por keyset (seek) de la lista de beneficiarios.
+
+En vez de traer el JOIN completo con fetchall() y paginarlo en Python, cada
+página busca primero los id_beneficiario siguientes (o anteriores) a un cursor
+usando la clave primaria y luego trae solo las filas del JOIN de esos ids.
+El costo de una página no depende de cuántas páginas haya antes ni del tamaño
+de la tabla, y la memoria por request se mantiene constante. La tabla de
+detalle de filtros usa el mismo esquema con los filtros aplicados y solo las
+columnas que muestra (ver pagina_tabla).
+
+Las columnas del JOIN se listan explícitamente en el mismo orden que el antiguo
+SELECT *, porque las plantillas acceden a las filas por posición (dato.0,
+dato.18, ...).
+"""
+from django.db import connection
+
+from .aggregations import construir_filtros
+from .cache_utils import obtener_o_calcular
+
+# Mismo orden que SELECT * sobre beneficiarios b, resoluciones r, decretos d
+COLUMNAS_DETALLE = (
+    'b.id_beneficiario', 'b.rut', 'b.dv', 'b.nombres', 'b.primer_apellido', 'b.segundo_apellido',
+    'b.comuna', 'b.provincia', 'b.codigo_proyecto', 'b.nombre_grupo', 'b.sexo',
+    'r.id_resolucion', 'r.resolucion', 'r.fecha_resolucion', 'r.seleccion',
+    'r.ano_imputacion_res_of', 'r.resolucion_id_beneficiario',
+    'd.id_decreto', 'd.decreto', 'd.tipologia', 'd.tramo', 'd.decreto_id_beneficiario',
+)
+
+FROM_DETALLE = """
+    FROM beneficiarios b
+    LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario
+    LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
+"""
+
+SELECT_DETALLE = "SELECT {}".format(', '.join(COLUMNAS_DETALLE)) + FROM_DETALLE
+
+ORDEN_DETALLE = " ORDER BY b.id_beneficiario, r.id_resolucion, d.id_decreto"
+
+# Columnas que muestra la tabla de detalle de filtros (nombre JSON, columna SQL)
+COLUMNAS_TABLA = (
+    ('id', 'b.id_beneficiario'),
+    ('decreto', 'd.decreto'),
+    ('tipologia', 'd.tipologia'),
+    ('rut', 'b.rut'),
+    ('dv', 'b.dv'),
+    ('nombres', 'b.nombres'),
+    ('primer_apellido', 'b.primer_apellido'),
+    ('segundo_apellido', 'b.segundo_apellido'),
+    ('comuna', 'b.comuna'),
+    ('provincia', 'b.provincia'),
+    ('ano_imputacion', 'r.ano_imputacion_res_of'),
+)
+
+POR_PAGINA_TABLA = 50
+
+POR_PAGINA_OPCIONES = (5, 10, 20, 50)
+POR_PAGINA_DEFECTO = 10
+
+# Beneficiarios por lote al recorrer la tabla completa (modo "mostrar todos")
+TAMANO_LOTE = 500
+
+
+def leer_por_pagina(valor):
+    """Cantidad de beneficiarios por página desde la query string, acotada a las opciones"""
+    try:
+        por_pagina = int(valor)
+    except (TypeError, ValueError):
+        return POR_PAGINA_DEFECTO
+    return por_pagina if por_pagina in POR_PAGINA_OPCIONES else POR_PAGINA_DEFECTO
+
+
+def leer_cursor(valor):
+    """id_beneficiario usado como cursor, o None si no viene o no es un entero"""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def contar_filas(comunas=None, provincias=None, anos=None):
+    """Total de filas del JOIN (lo que muestra la lista), cacheado por filtros y versión de datos.
+
+    Se obtiene de resumen_beneficiarios, que guarda exactamente esos conteos.
+    """
+    def calcular():
+        filter_sql, params = construir_filtros(comunas, provincias, anos, beneficiario='s', resolucion='s')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(SUM(s.total), 0) FROM resumen_beneficiarios s" + filter_sql, params)
+            return int(cursor.fetchone()[0])
+
+    return obtener_o_calcular('total_beneficiarios', calcular, comunas=comunas, provincias=provincias, anos=anos)
+
+
+def _ids(condicion, params, descendente, limite):
+    orden = 'DESC' if descendente else 'ASC'
+    query = f"SELECT id_beneficiario FROM beneficiarios {condicion} ORDER BY id_beneficiario {orden} LIMIT %s"
+    with connection.cursor() as cursor:
+        cursor.execute(query, params + [limite])
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def _existe(condicion, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT 1 FROM beneficiarios {condicion} LIMIT 1", params)
+        return cursor.fetchone() is not None
+
+
+def filas_de(ids):
+    """Filas del JOIN (en el orden de COLUMNAS_DETALLE) para una lista de ids"""
+    if not ids:
+        return []
+    marcadores = ','.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(SELECT_DETALLE + f" WHERE b.id_beneficiario IN ({marcadores})" + ORDEN_DETALLE, list(ids))
+        return cursor.fetchall()
+
+
+class PaginaKeyset:
+    """Página de la lista: filas del JOIN más los cursores para moverse.
+
+    Se itera como la página de Paginator; `has_previous`/`has_next` se
+    mantienen para las plantillas.
+    """
+
+    def __init__(self, filas, ids, has_previous, has_next, por_pagina):
+        self.filas = filas
+        self.ids = ids
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.por_pagina = por_pagina
+
+    def __iter__(self):
+        return iter(self.filas)
+
+    def __len__(self):
+        return len(self.filas)
+
+    def __bool__(self):
+        return bool(self.filas)
+
+    @property
+    def primer_id(self):
+        return self.ids[0] if self.ids else None
+
+    @property
+    def ultimo_id(self):
+        return self.ids[-1] if self.ids else None
+
+
+def obtener_pagina(por_pagina=POR_PAGINA_DEFECTO, despues=None, antes=None, ultima=False):
+    """Página de beneficiarios posterior a `despues` o anterior a `antes`.
+
+    Sin cursores devuelve la primera página; con `ultima` la última.
+    """
+    if antes is not None or ultima:
+        condicion, params = ("WHERE id_beneficiario < %s", [antes]) if antes is not None else ("", [])
+        ids = _ids(condicion, params, True, por_pagina + 1)
+        has_previous = len(ids) > por_pagina
+        ids = sorted(ids[:por_pagina])
+        has_next = bool(ids) and _existe("WHERE id_beneficiario > %s", [ids[-1]])
+    else:
+        condicion, params = ("WHERE id_beneficiario > %s", [despues]) if despues is not None else ("", [])
+        ids = _ids(condicion, params, False, por_pagina + 1)
+        has_next = len(ids) > por_pagina
+        ids = ids[:por_pagina]
+        has_previous = bool(ids) and _existe("WHERE id_beneficiario < %s", [ids[0]])
+
+    return PaginaKeyset(filas_de(ids), ids, has_previous, has_next, por_pagina)
+
+
+def iterar_lotes(tamano_lote=TAMANO_LOTE):
+    """Recorre todas las filas del JOIN en lotes de `tamano_lote` beneficiarios.
+
+    Cada lote es una consulta keyset independiente, así que nunca hay más de un
+    lote en memoria.
+    """
+    despues = None
+    while True:
+        condicion, params = ("WHERE id_beneficiario > %s", [despues]) if despues is not None else ("", [])
+        ids = _ids(condicion, params, False, tamano_lote)
+        if not ids:
+            return
+        yield filas_de(ids)
+        if len(ids) < tamano_lote:
+            return
+        despues = ids[-1]
+
+
+def _agregar_condicion(filter_sql, condicion):
+    return f"{filter_sql} AND {condicion}" if filter_sql else f" WHERE {condicion}"
+
+
+def pagina_tabla(comunas=None, provincias=None, anos=None, despues=None, por_pagina=POR_PAGINA_TABLA):
+    """Página de la tabla de detalle de filtros con solo las columnas que se muestran.
+
+    Devuelve (filas, siguiente), donde `siguiente` es el cursor de la próxima
+    página o None si no hay más.
+    """
+    filter_sql, params = construir_filtros(comunas, provincias, anos)
+
+    # Ids de la página: solo se une resoluciones, que es la única tabla filtrada
+    ids_sql, ids_params = filter_sql, list(params)
+    if despues is not None:
+        ids_sql = _agregar_condicion(ids_sql, "b.id_beneficiario > %s")
+        ids_params.append(despues)
+    join_resoluciones = (
+        " LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario" if anos else ""
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT b.id_beneficiario FROM beneficiarios b{join_resoluciones}{ids_sql}"
+            " ORDER BY b.id_beneficiario LIMIT %s",
+            ids_params + [por_pagina + 1],
+        )
+        ids = [fila[0] for fila in cursor.fetchall()]
+
+    siguiente = ids[por_pagina - 1] if len(ids) > por_pagina else None
+    ids = ids[:por_pagina]
+    if not ids:
+        return [], None
+
+    # Filas de esos ids, con los mismos filtros para no mostrar resoluciones de otros años
+    filas_sql = _agregar_condicion(filter_sql, "b.id_beneficiario IN ({})".format(','.join(['%s'] * len(ids))))
+    columnas = ', '.join(columna for _, columna in COLUMNAS_TABLA)
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {columnas}{FROM_DETALLE}{filas_sql}{ORDEN_DETALLE}", params + ids)
+        filas = cursor.fetchall()
+
+    return filas, siguiente
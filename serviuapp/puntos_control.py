@@ -0,0 +1,89 @@
+"""
+Puntos de control para reanudar importaciones interrumpidas.
+
+Cada lote que el importador escribe se confirma en la misma transacción que
+actualiza la fila del archivo en puntos_control_importacion: huella SHA-256
+del archivo, último lote confirmado, filas de datos que cubren esos lotes y
+contadores acumulados. Si la importación se cae, los lotes confirmados quedan
+en la base junto con un punto de control que los describe exactamente, y
+importar_excel(..., reanudar=True) vuelve a leer el archivo hasta ese lote
+(sin limpiarlo ni escribirlo) y sigue desde el siguiente, sin vaciar las
+tablas. El punto de control se elimina cuando la importación termina.
+"""
+import hashlib
+import os
+
+from django.utils import timezone
+
+from .models import PuntoControlImportacion
+
+# Bytes leídos por vez al calcular la huella del archivo
+TAMANO_BLOQUE_HUELLA = 1 << 20
+
+
+class PuntoControlInvalido(Exception):
+    """No hay un punto de control que permita reanudar esta importación"""
+
+
+def huella_archivo(ruta):
+    """SHA-256 del contenido del archivo"""
+    huella = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE_HUELLA), b''):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+
+def huella_conjunto(huellas, hojas=None):
+    """Huella de una importación de varias fuentes: SHA-256 de las huellas de sus archivos, en orden, y de las hojas elegidas"""
+    conjunto = hashlib.sha256()
+    for huella in huellas:
+        conjunto.update(huella.encode('ascii'))
+    conjunto.update('\x1f'.join(hojas or ()).encode('utf-8'))
+    return conjunto.hexdigest()
+
+
+def iniciar(huella, ruta, modo, carga, tamano_lote):
+    """Punto de control nuevo (lote 0) para el archivo (o la lista de archivos); descarta uno anterior del mismo"""
+    archivo = str(ruta) if isinstance(ruta, (str, os.PathLike)) else ', '.join(str(parte) for parte in ruta)
+    PuntoControlImportacion.objects.filter(huella_archivo=huella).delete()
+    return PuntoControlImportacion.objects.create(
+        huella_archivo=huella, archivo=archivo[:500], modo=modo, carga=carga, tamano_lote=tamano_lote,
+    )
+
+
+def retomar(huella, modo, carga, tamano_lote):
+    """Punto de control de una importación interrumpida del mismo archivo con las mismas opciones.
+
+    Lanza PuntoControlInvalido si no existe o si las opciones no coinciden
+    (con otro tamaño de lote los lotes confirmados no serían los mismos).
+    """
+    try:
+        punto = PuntoControlImportacion.objects.get(huella_archivo=huella)
+    except PuntoControlImportacion.DoesNotExist:
+        raise PuntoControlInvalido("no hay una importación interrumpida de este archivo") from None
+    distintas = [
+        f"{nombre} {anterior} (ahora {actual})"
+        for nombre, anterior, actual in (
+            ('modo', punto.modo, modo), ('carga', punto.carga, carga), ('lote', punto.tamano_lote, tamano_lote),
+        )
+        if anterior != actual
+    ]
+    if distintas:
+        raise PuntoControlInvalido("la importación interrumpida usó " + ', '.join(distintas))
+    return punto
+
+
+def guardar(punto, lote, fila, contadores):
+    """Registra `lote` como el último confirmado; se llama dentro de la transacción del lote"""
+    punto.lote = lote
+    punto.fila = fila
+    punto.contadores = {clave: valor for clave, valor in contadores.items() if clave != 'ids'}
+    PuntoControlImportacion.objects.filter(pk=punto.pk).update(
+        lote=punto.lote, fila=punto.fila, contadores=punto.contadores, actualizado=timezone.now(),
+    )
+
+
+def terminar(punto):
+    """Elimina el punto de control de una importación que terminó"""
+    PuntoControlImportacion.objects.filter(pk=punto.pk).delete()
@@ -2,8 +2,11 @@ import os
 import logging
 from import_export import resources, fields
 from import_export.widgets import ForeignKeyWidget, DateWidget
+from import_export.results import RowResult
 from datetime import datetime, date, timedelta
-from .models import Beneficiarios, Decretos, Resoluciones
+from .models import Beneficiarios, CambioBeneficiario, Decretos, Resoluciones
+from .resumen import reconstruir_resumen
+from .rut import normalizar_rut
 
 def configure_logger():
     log_dir = 'logs'
@@ -78,6 +81,16 @@ class CustomDateWidget(DateWidget):
         raise ValueError(f"Formato de fecha inválido en la fila {row}: {value}")
 
 class BeneficiariosResource(resources.ModelResource):
+    """Importación desde el admin.
+
+    Los beneficiarios se guardan con bulk_create cada batch_size filas sin
+    buscar antes si existen (las tablas se vacían al empezar). Las columnas de
+    decreto, resolución y cambio de beneficiario de cada fila aceptada se
+    juntan en after_import_row y se limpian e insertan por lotes en
+    after_import, con las mismas funciones que el importador (ver
+    serviuapp.importador). El log registra un resumen por lote en vez de una
+    línea por fila.
+    """
     fecha_resolucion = fields.Field(
         column_name='fecha_resolucion',
         attribute='fecha_resolucion',
@@ -86,80 +99,99 @@ class BeneficiariosResource(resources.ModelResource):
 
     class Meta:
         model = Beneficiarios
-        exclude = ('id',)
+        exclude = ('id', 'rut_normalizado', 'huella')
         import_id_fields = ['id_beneficiario']
-        skip_unchanged = True
+        use_bulk = True
+        batch_size = 1000
+        # Las tablas se vacían en before_import: no hay instancias que buscar ni comparar
+        force_init_instance = True
+        skip_diff = True
         report_skipped = True
 
     def before_import(self, dataset, **kwargs):
         self.logger = configure_logger()
         self.logger.info("Iniciando sesión de importación")
+        self.filas_pendientes = []
+        self.ids_vistos = set()
 
         # Limpiar tablas antes de la importación
-        Beneficiarios.objects.all().delete()
-        Decretos.objects.all().delete()
-        Resoluciones.objects.all().delete()
-        self.logger.info("Tablas de Beneficiarios, Decretos y Resoluciones han sido limpiadas.")
+        from .importador import limpiar_tablas
+
+        limpiar_tablas()
+        self.logger.info("Tablas de Beneficiarios, Decretos, Resoluciones y Cambios han sido limpiadas.")
 
         dataset.headers = [header.lower() for header in dataset.headers]
 
+    def skip_row(self, instance, original, row, import_validation_errors=None):
+        # Sin búsqueda previa, un id repetido en el archivo haría fallar el lote completo
+        if import_validation_errors or instance.id_beneficiario is None:
+            return False
+        if instance.id_beneficiario in self.ids_vistos:
+            return True
+        self.ids_vistos.add(instance.id_beneficiario)
+        return False
+
+    def before_save_instance(self, instance, row, **kwargs):
+        # bulk_create no pasa por Beneficiarios.save()
+        instance.rut_normalizado = normalizar_rut(instance.rut, instance.dv or None)
+
     def after_import_row(self, row, row_result, row_number=None, **kwargs):
-        try:
-            beneficiario = Beneficiarios.objects.get(id_beneficiario=row['id_beneficiario'])
-
-            # Datos para la tabla Decretos
-            decreto_id = row.get('id_beneficiario')
-            decreto = row.get('decreto')
-            tipologia = row.get('tipologia')
-            tramo = row.get('tramo')
-
-            # Datos para la tabla Resoluciones
-            resolucion_id = row.get('id_beneficiario')
-            resolucion = row.get('resolucion')
-            fecha_resolucion = row.get('fecha_resolucion')
-            seleccion = row.get('seleccion')
-            ano_imputacion_res_of = row.get('ano_imputacion_res_of')
-
-            # Convertir fecha_resolucion a formato 'YYYY-MM-DD' si es datetime
-            if fecha_resolucion is not None and isinstance(fecha_resolucion, datetime):
-                fecha_resolucion = fecha_resolucion.strftime('%Y-%m-%d')
-
-            # Crear o actualizar el decreto
-            if decreto_id:
-                try:
-                    _decreto, created = Decretos.objects.update_or_create(
-                        id_decreto=decreto_id,
-                        defaults={
-                            'decreto': decreto,
-                            'tipologia': tipologia,
-                            'tramo': tramo,
-                            'decreto_id_beneficiario': beneficiario
-                        }
-                    )
-                    self.logger.info(f"Decreto {'creado' if created else 'actualizado'}: {_decreto}")
-                except Exception as e:
-                    self.logger.error(f"Error al crear o actualizar el decreto: {e}")
-
-            # Crear o actualizar la resolución
-            if resolucion_id:
-                try:
-                    _resolucion, created = Resoluciones.objects.update_or_create(
-                        id_resolucion=resolucion_id,
-                        defaults={
-                            'resolucion': resolucion,
-                            'fecha_resolucion': fecha_resolucion,
-                            'seleccion': seleccion,
-                            'ano_imputacion_res_of': ano_imputacion_res_of,
-                            'resolucion_id_beneficiario': beneficiario
-                        }
-                    )
-                    self.logger.info(f"Resolución {'creada' if created else 'actualizada'}: {_resolucion}")
-                except Exception as e:
-                    self.logger.error(f"Error al crear o actualizar la resolución: {e}")
-
-        except Exception as e:
-            self.logger.error(f"Error al procesar la fila {row_number}: {e}")
+        if row_result.import_type in (RowResult.IMPORT_TYPE_NEW, RowResult.IMPORT_TYPE_UPDATE):
+            self.filas_pendientes.append(dict(row))
+
+    def guardar_decretos_resoluciones(self, batch_size):
+        """Inserta por lotes los decretos, resoluciones y cambios de las filas aceptadas.
+
+        Devuelve (filas con decreto y resolución, cambios creados).
+        """
+        # pandas y el importador solo se cargan al importar, no con el admin
+        import pandas as pd
+
+        from .importador import instancias_lote, limpiar_lote, reportar_rechazos
+
+        filas, self.filas_pendientes = self.filas_pendientes, []
+        totales_rechazos = {}
+        creados = 0
+        cambios_creados = 0
+        for numero_lote, inicio in enumerate(range(0, len(filas), batch_size), start=1):
+            lote = pd.DataFrame(filas[inicio:inicio + batch_size])
+            lote.index = range(inicio, inicio + len(lote))
+            limpio, rechazos = limpiar_lote(lote)
+            reportar_rechazos(numero_lote, rechazos, totales_rechazos)
+
+            # Solo los beneficiarios que llegaron a la base (un lote de bulk_create puede fallar)
+            ids = [int(id_beneficiario) for id_beneficiario in limpio['id_beneficiario'] if id_beneficiario is not None]
+            existentes = set(
+                Beneficiarios.objects.filter(id_beneficiario__in=ids).values_list('id_beneficiario', flat=True)
+            )
+            limpio = limpio[limpio['id_beneficiario'].isin(existentes)]
+
+            _, decretos, resoluciones, cambios = instancias_lote(limpio)
+            Decretos.objects.bulk_create(decretos, batch_size=batch_size)
+            Resoluciones.objects.bulk_create(resoluciones, batch_size=batch_size)
+            CambioBeneficiario.objects.bulk_create(cambios, batch_size=batch_size)
+            creados += len(limpio)
+            cambios_creados += len(cambios)
+            self.logger.info(
+                f"Lote {numero_lote}: {len(lote)} filas, {len(limpio)} decretos y resoluciones "
+                f"y {len(cambios)} cambios creados"
+            )
+        if totales_rechazos:
+            self.logger.warning(f"Valores inválidos importados como NULL: {totales_rechazos}")
+        return creados, cambios_creados
 
     def after_import(self, dataset, result, **kwargs):
+        if not kwargs.get('dry_run'):
+            creados, cambios = self.guardar_decretos_resoluciones(self._meta.batch_size)
+            totales = result.totals
+            self.logger.info(
+                f"Beneficiarios nuevos: {totales[RowResult.IMPORT_TYPE_NEW]}, "
+                f"omitidos: {totales[RowResult.IMPORT_TYPE_SKIP]}, "
+                f"inválidos: {totales[RowResult.IMPORT_TYPE_INVALID]}, "
+                f"con error: {totales[RowResult.IMPORT_TYPE_ERROR]}; "
+                f"decretos y resoluciones: {creados}; cambios de beneficiario: {cambios}"
+            )
+            filas_resumen = reconstruir_resumen()
+            self.logger.info(f"Tabla resumen reconstruida: {filas_resumen} filas")
         self.logger.info("Finalizada sesión de importación.")
         logging.shutdown()  # Asegura que los manejadores del logger se cierren correctamente.
@@ -0,0 +1,147 @@
+"""
+Mantenimiento de la tabla resumen_beneficiarios.
+
+La tabla guarda los conteos del JOIN beneficiarios/resoluciones/decretos
+agrupados por (decreto, tipologia, comuna, provincia, ano_imputacion_res_of).
+Se reconstruye completa al final de cada importación y se actualiza de forma
+incremental cuando se edita un beneficiario, decreto o resolución. Ambos
+caminos invalidan la caché de conteos (ver serviuapp.cache_utils).
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from .cache_utils import invalidar_cache
+from .models import Beneficiarios, Decretos, Resoluciones, ResumenBeneficiarios
+
+COLUMNAS_CLAVE = ('decreto', 'tipologia', 'comuna', 'provincia', 'ano_imputacion_res_of')
+
+# {sufijo} permite armar la misma consulta sobre las tablas sombra (ver serviuapp.tablas_sombra)
+_SELECT_CLAVES = """
+    SELECT d.decreto, d.tipologia, b.comuna, b.provincia, r.ano_imputacion_res_of, COUNT(*)
+    FROM beneficiarios{sufijo} b
+    LEFT JOIN resoluciones{sufijo} r ON b.id_beneficiario = r.resolucion_id_beneficiario
+    LEFT JOIN decretos{sufijo} d ON b.id_beneficiario = d.decreto_id_beneficiario
+"""
+
+SELECT_CLAVES = _SELECT_CLAVES.format(sufijo='')
+
+GROUP_BY_CLAVES = " GROUP BY d.decreto, d.tipologia, b.comuna, b.provincia, r.ano_imputacion_res_of"
+
+
+def insert_resumen(sufijo=''):
+    """INSERT ... SELECT que llena la tabla resumen; con sufijo, el de esas tablas"""
+    return (
+        f"INSERT INTO resumen_beneficiarios{sufijo} "
+        "(decreto, tipologia, comuna, provincia, ano_imputacion_res_of, total)"
+        + _SELECT_CLAVES.format(sufijo=sufijo) + GROUP_BY_CLAVES
+    )
+
+
+INSERT_RESUMEN = insert_resumen()
+
+
+def reconstruir_resumen():
+    """Recalcula la tabla resumen completa con un solo INSERT ... SELECT"""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM resumen_beneficiarios")
+            cursor.execute(INSERT_RESUMEN)
+            cursor.execute("SELECT COUNT(*) FROM resumen_beneficiarios")
+            filas = cursor.fetchone()[0]
+
+    invalidar_cache()
+    return filas
+
+
+def claves_beneficiario(id_beneficiario):
+    """Conteo de filas del JOIN de un beneficiario, por clave del resumen"""
+    if id_beneficiario is None:
+        return Counter()
+    with connection.cursor() as cursor:
+        cursor.execute(SELECT_CLAVES + " WHERE b.id_beneficiario = %s" + GROUP_BY_CLAVES, [id_beneficiario])
+        return Counter({tuple(fila[:5]): fila[5] for fila in cursor.fetchall()})
+
+
+def aplicar_diferencia(antes, despues):
+    """Ajusta los totales del resumen según la diferencia entre dos conteos de claves"""
+    diferencia = Counter(despues)
+    diferencia.subtract(antes)
+
+    with transaction.atomic():
+        for clave, delta in diferencia.items():
+            if delta == 0:
+                continue
+
+            filtro = {}
+            for columna, valor in zip(COLUMNAS_CLAVE, clave):
+                if valor is None:
+                    filtro[f'{columna}__isnull'] = True
+                else:
+                    filtro[columna] = valor
+
+            filas = ResumenBeneficiarios.objects.filter(**filtro)
+            actualizadas = filas.update(total=F('total') + delta)
+            if not actualizadas and delta > 0:
+                ResumenBeneficiarios.objects.create(total=delta, **dict(zip(COLUMNAS_CLAVE, clave)))
+            elif actualizadas:
+                filas.filter(total__lte=0).delete()
+
+    if any(diferencia.values()):
+        # Dentro de registrar_cambios, recién cuando se confirma la transacción
+        transaction.on_commit(invalidar_cache)
+
+
+def _id_beneficiario(instancia):
+    if isinstance(instancia, Beneficiarios):
+        return instancia.pk
+    if isinstance(instancia, Decretos):
+        return instancia.decreto_id_beneficiario_id
+    if isinstance(instancia, Resoluciones):
+        return instancia.resolucion_id_beneficiario_id
+    return instancia
+
+
+# Beneficiarios con un registrar_cambios abierto en este hilo
+_registrando = threading.local()
+
+
+def _en_registro():
+    if not hasattr(_registrando, 'ids'):
+        _registrando.ids = set()
+    return _registrando.ids
+
+
+@contextmanager
+def registrar_cambios(instancia):
+    """Actualiza el resumen con los cambios hechos sobre un beneficiario dentro del bloque.
+
+    `instancia` puede ser un Beneficiarios, Decretos, Resoluciones o un id_beneficiario.
+    Para un beneficiario nuevo el id se lee después de guardarlo.
+
+    La foto previa, los cambios del bloque y el ajuste del resumen van en una
+    sola transacción, con la fila del beneficiario bloqueada para que dos
+    ediciones simultáneas no calculen la diferencia sobre la misma foto. Un
+    bloque anidado sobre el mismo beneficiario (p. ej. el save() de los
+    formularios dentro de una vista que ya registra) no hace nada: la
+    diferencia la aplica el bloque externo.
+    """
+    id_beneficiario = _id_beneficiario(instancia)
+    en_registro = _en_registro()
+    if id_beneficiario is not None and id_beneficiario in en_registro:
+        yield
+        return
+
+    with transaction.atomic():
+        if id_beneficiario is not None:
+            list(Beneficiarios.objects.select_for_update().filter(pk=id_beneficiario).values_list('pk', flat=True))
+            en_registro.add(id_beneficiario)
+        try:
+            antes = claves_beneficiario(id_beneficiario)
+            yield
+            aplicar_diferencia(antes, claves_beneficiario(_id_beneficiario(instancia)))
+        finally:
+            en_registro.discard(id_beneficiario)
@@ -0,0 +1,108 @@
+"""
+Normalización y búsqueda de RUT.
+
+La columna beneficiarios.rut es texto libre (con o sin puntos, guion o dígito
+verificador). Al guardar un beneficiario se calcula rut_normalizado con la
+forma canónica 'cuerpo-DV' (sin puntos ni ceros a la izquierda y con el DV
+calculado por módulo 11), que tiene índice propio. Todas las búsquedas por
+RUT (Busqueda, el asistente de chat) pasan por las funciones de este módulo y
+consultan solo esa columna.
+"""
+from django.db import connection
+
+from .paginacion import COLUMNAS_DETALLE, FROM_DETALLE, ORDEN_DETALLE, SELECT_DETALLE
+
+# Cantidad máxima de RUT por consulta IN en las búsquedas en lote
+TAMANO_LOTE_RUT = 1000
+
+# Un cuerpo de RUT tiene a lo más 8 dígitos; 9 caracteres sin guion incluyen el DV
+LARGO_MAXIMO_CUERPO = 8
+
+
+def calcular_dv(cuerpo):
+    """Dígito verificador (módulo 11) de un cuerpo de RUT numérico"""
+    suma = 0
+    factor = 2
+    for digito in reversed(str(cuerpo)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    if resto == 11:
+        return '0'
+    if resto == 10:
+        return 'K'
+    return str(resto)
+
+
+def separar_rut(rut):
+    """Separa un RUT escrito libremente en (cuerpo, dv); dv es None si no viene en el texto.
+
+    Acepta '12.345.678-5', '12345678-5', '123456785' y '12345678'.
+    """
+    texto = ''.join(str(rut or '').split()).replace('.', '').upper().lstrip('0')
+    if '-' in texto:
+        cuerpo, dv = texto.rsplit('-', 1)
+        return cuerpo, dv or None
+    if texto.endswith('K') or len(texto) > LARGO_MAXIMO_CUERPO:
+        return texto[:-1], texto[-1:]
+    return texto, None
+
+
+def normalizar_rut(rut, dv=None):
+    """Forma canónica 'cuerpo-DV' de un RUT, o None si no es válido.
+
+    `dv` es el de una columna aparte (beneficiarios.dv, DV2). Todo dígito
+    verificador que venga (en el texto, en `dv` o en ambos) debe coincidir con
+    el calculado; si no viene ninguno, se completa con el calculado.
+    """
+    cuerpo, dv_rut = separar_rut(rut)
+    cuerpo = cuerpo.lstrip('0')
+    if not cuerpo.isdigit() or len(cuerpo) > LARGO_MAXIMO_CUERPO:
+        return None
+    verificador = calcular_dv(cuerpo)
+    dv = str(dv).strip().upper() or None if dv is not None else None
+    if any(escrito is not None and escrito != verificador for escrito in (dv_rut, dv)):
+        return None
+    return f'{cuerpo}-{verificador}'
+
+
+def buscar_rut(rut):
+    """Filas del JOIN (orden de COLUMNAS_DETALLE) de los beneficiarios con ese RUT"""
+    normalizado = normalizar_rut(rut)
+    if normalizado is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(SELECT_DETALLE + " WHERE b.rut_normalizado = %s" + ORDEN_DETALLE, [normalizado])
+        return cursor.fetchall()
+
+
+def iterar_ruts(normalizados, tamano_lote=TAMANO_LOTE_RUT):
+    """Resuelve RUT ya normalizados por lotes: genera (lote, {rut: [filas del JOIN]}).
+
+    Cada lote es una sola consulta IN sobre el índice de rut_normalizado.
+    """
+    for inicio in range(0, len(normalizados), tamano_lote):
+        lote = normalizados[inicio:inicio + tamano_lote]
+        marcadores = ','.join(['%s'] * len(lote))
+        encontrados = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT b.rut_normalizado, " + ', '.join(COLUMNAS_DETALLE) + FROM_DETALLE
+                + f" WHERE b.rut_normalizado IN ({marcadores})" + ORDEN_DETALLE,
+                lote,
+            )
+            for fila in cursor.fetchall():
+                encontrados.setdefault(fila[0], []).append(fila[1:])
+        yield lote, encontrados
+
+
+def buscar_ruts(ruts):
+    """Búsqueda en lote: {rut normalizado: [filas del JOIN]} con una consulta IN por lote.
+
+    Los RUT inválidos o sin registros no aparecen en el resultado.
+    """
+    normalizados = sorted({n for n in (normalizar_rut(rut) for rut in ruts) if n})
+    resultado = {}
+    for _, encontrados in iterar_ruts(normalizados):
+        resultado.update(encontrados)
+    return resultado
@@ -6,6 +6,7 @@ from django.utils import timezone
 from django.conf import settings
 from .models import ChatInteraction
 from .nlp_utils import nlp_analyzer
+from .rut import buscar_rut
 
 # Configuración de Ollama
 OLLAMA_URL = getattr(settings, 'OLLAMA_URL', 'http://localhost:11434')
@@ -149,13 +150,15 @@ def generate_serviu_response(user_query, rut=None, session_id=None, user_ip=None
         print(f"Error guardando interacción: {e}")
         return response, session_id, None
 
-def generate_ollama_response(user_query, rut=None):
+def generate_ollama_response(user_query, rut=None, datos_beneficiario=None):
     """Genera respuesta usando Ollama con Mistral"""
     
     # Contexto adicional si hay RUT
     context_addition = ""
     if rut:
         context_addition = f"\n\nEl usuario ha proporcionado su RUT: {rut}. Puedes hacer referencia a consultas personalizadas."
+    if datos_beneficiario:
+        context_addition += f"\n\nRegistros asociados a ese RUT:\n{datos_beneficiario}"
     
     # Construir el prompt completo
     full_prompt = f"{SERVIU_SYSTEM_PROMPT}{context_addition}\n\nUsuario: {user_query}\n\nAsistente:"
@@ -182,20 +185,29 @@ def generate_ollama_response(user_query, rut=None):
             return result.get('response', '').strip()
         else:
             print(f"Error Ollama HTTP {response.status_code}: {response.text}")
-            return generate_fallback_response(user_query, rut)
+            return generate_fallback_response(user_query, rut, datos_beneficiario)
             
     except requests.exceptions.RequestException as e:
         print(f"Error conectando con Ollama: {e}")
-        return generate_fallback_response(user_query, rut)
+        return generate_fallback_response(user_query, rut, datos_beneficiario)
     except Exception as e:
         print(f"Error procesando respuesta Ollama: {e}")
-        return generate_fallback_response(user_query, rut)
+        return generate_fallback_response(user_query, rut, datos_beneficiario)
 
-def generate_fallback_response(user_query, rut=None):
+def generate_fallback_response(user_query, rut=None, datos_beneficiario=None):
     """Respuestas básicas cuando Ollama no está disponible"""
     query_lower = user_query.lower()
     
-    if any(saludo in query_lower for saludo in ["hola", "buenos días", "buenas tardes", "buenas noches"]):
+    if datos_beneficiario:
+        return f"""📋 **Registros asociados al RUT {rut}:**
+
+{datos_beneficiario}
+
+Para más detalles sobre tu postulación acércate a una oficina de SERVIU Ñuble.
+
+Más información: https://www.minvu.gob.cl/"""
+    
+    elif any(saludo in query_lower for saludo in ["hola", "buenos días", "buenas tardes", "buenas noches"]):
         return "¡Hola! 👋 Soy tu asistente de SERVIU. Estoy aquí para ayudarte con información sobre subsidios habitacionales, trámites y beneficios. ¿En qué puedo ayudarte?"
     
     elif "ds1" in query_lower or "sectores medios" in query_lower:
@@ -282,13 +294,15 @@ def test_ollama_connection():
         return False, f"Error de conexión: {e}"
 
 # Agregar al final del archivo
-def generate_huggingface_response(user_query, rut=None):
+def generate_huggingface_response(user_query, rut=None, datos_beneficiario=None):
     import requests
     from django.conf import settings
     
     context_addition = ""
     if rut:
         context_addition = f"\n\nEl usuario ha proporcionado su RUT: {rut}."
+    if datos_beneficiario:
+        context_addition += f"\n\nRegistros asociados a ese RUT:\n{datos_beneficiario}"
     
     full_prompt = f"{SERVIU_SYSTEM_PROMPT}{context_addition}\n\nUsuario: {user_query}\n\nAsistente:"
     
@@ -314,11 +328,32 @@ def generate_huggingface_response(user_query, rut=None):
                     return generated_text.split('Asistente:')[-1].strip()
                 return generated_text.strip()
         
-        return generate_fallback_response(user_query, rut)
+        return generate_fallback_response(user_query, rut, datos_beneficiario)
         
     except Exception as e:
         print(f"Error con Hugging Face: {e}")
-        return generate_fallback_response(user_query, rut)
+        return generate_fallback_response(user_query, rut, datos_beneficiario)
+
+def describir_beneficiario(rut):
+    """Resumen de los subsidios registrados para un RUT (sin datos personales), o None"""
+    filas = buscar_rut(rut) if rut else []
+    if not filas:
+        return None
+    
+    # Posiciones de COLUMNAS_DETALLE: 12 resolucion, 14 seleccion, 15 año, 18 decreto, 19 tipologia
+    lineas = []
+    for fila in filas:
+        partes = [f"Programa {fila[18] or 'sin decreto'}"]
+        if fila[19]:
+            partes.append(f"tipología {fila[19]}")
+        if fila[12]:
+            partes.append(f"resolución {fila[12]}")
+        if fila[14]:
+            partes.append(f"selección {fila[14]}")
+        if fila[15]:
+            partes.append(f"año de imputación {fila[15]}")
+        lineas.append("- " + ", ".join(partes))
+    return "\n".join(lineas)
 
 # Modificar la función principal
 def generate_serviu_response(user_query, rut=None, session_id=None, user_ip=None):
@@ -330,23 +365,26 @@ def generate_serviu_response(user_query, rut=None, session_id=None, user_ip=None
     question_category = nlp_analyzer.categorize_question(user_query)
     sentiment_score = nlp_analyzer.analyze_sentiment(user_query)
     
+    # Registros del RUT desde la búsqueda indexada
+    datos_beneficiario = describir_beneficiario(rut)
+    
     # Intentar servicios en orden
     response = None
     
     # 1. Intentar Ollama local (desarrollo)
     if OLLAMA_URL.startswith('http://localhost'):
         try:
-            response = generate_ollama_response(user_query, rut)
+            response = generate_ollama_response(user_query, rut, datos_beneficiario)
         except:
             pass
     
     # 2. Usar Hugging Face (producción)
     if not response and hasattr(settings, 'HUGGINGFACE_API_KEY') and settings.HUGGINGFACE_API_KEY:
-        response = generate_huggingface_response(user_query, rut)
+        response = generate_huggingface_response(user_query, rut, datos_beneficiario)
     
     # 3. Fallback
     if not response:
-        response = generate_fallback_response(user_query, rut)
+        response = generate_fallback_response(user_query, rut, datos_beneficiario)
     
     response_time = int((time.time() - start_time) * 1000)
     
@@ -0,0 +1,247 @@
+"""
+Recarga completa sin tiempo fuera de servicio mediante tablas sombra.
+
+En vez de vaciar las tablas en uso, la importación en modo 'reemplazo' carga
+beneficiarios_new, decretos_new, resoluciones_new y cambios_beneficiario_new
+(creadas sin índices secundarios), después crea sus índices y llena
+resumen_beneficiarios_new, valida los conteos y finalmente intercambia las cinco
+tablas de una vez. En MySQL el
+intercambio es un solo RENAME TABLE atómico; en SQLite son ALTER TABLE ... RENAME
+dentro de una transacción. Mientras tanto las vistas siguen leyendo las tablas
+anteriores.
+
+Las tablas reemplazadas quedan como *_old hasta la próxima recarga, así que
+revertir() deja los datos anteriores en uso con otro intercambio instantáneo.
+
+Las tablas sombra se crean con el schema_editor de Django a partir de copias de
+los modelos registradas en un registro de apps aparte. Los nombres de índices y
+claves foráneas creados aquí llevan una marca de la recarga cuando el motor
+exige nombres únicos en toda la base (claves foráneas en MySQL, índices en
+SQLite). En SQLite las tablas sombra no tienen claves foráneas.
+"""
+import time
+
+from django.apps.registry import Apps
+from django.db import connection, models, transaction
+
+from .cache_utils import invalidar_cache
+from .models import Beneficiarios, CambioBeneficiario, Decretos, Resoluciones, ResumenBeneficiarios
+from .resumen import insert_resumen
+
+SUFIJO_SOMBRA = '_new'
+SUFIJO_ANTERIOR = '_old'
+
+# Tablas que se reemplazan juntas, en orden de dependencia (la referenciada primero)
+MODELOS_REEMPLAZO = (Beneficiarios, Decretos, Resoluciones, CambioBeneficiario, ResumenBeneficiarios)
+
+# Si la recarga trae menos de esta proporción de los beneficiarios actuales no se intercambia
+MINIMA_PROPORCION_FILAS = 0.5
+
+
+class ValidacionFallida(Exception):
+    """Los conteos de las tablas sombra no permiten hacer el intercambio"""
+
+
+def _tabla(modelo, sufijo=''):
+    return modelo._meta.db_table + sufijo
+
+
+def modelos_sombra(sufijo=SUFIJO_SOMBRA):
+    """Copias de los modelos apuntando a las tablas con `sufijo`, en el orden de MODELOS_REEMPLAZO.
+
+    Los campos no llevan índices (se crean después de cargar, ver crear_indices)
+    y las claves foráneas apuntan a la copia de Beneficiarios, sin restricción.
+    """
+    registro = Apps()
+    copias = {}
+    for modelo in MODELOS_REEMPLAZO:
+        atributos = {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {
+                'apps': registro,
+                'app_label': modelo._meta.app_label,
+                'db_table': _tabla(modelo, sufijo),
+            }),
+        }
+        for campo in modelo._meta.local_fields:
+            if campo.is_relation:
+                copia = models.ForeignKey(
+                    copias[campo.related_model], on_delete=models.DO_NOTHING,
+                    db_column=campo.column, db_constraint=False, db_index=False,
+                )
+            else:
+                copia = campo.clone()
+                copia.db_index = False
+            atributos[campo.name] = copia
+        copias[modelo] = type(f'{modelo.__name__}Sombra', (models.Model,), atributos)
+    return [copias[modelo] for modelo in MODELOS_REEMPLAZO]
+
+
+def _existe(tabla):
+    with connection.cursor() as cursor:
+        return tabla in connection.introspection.table_names(cursor)
+
+
+def _eliminar(sufijo):
+    """Elimina las tablas con `sufijo` que existan (las que referencian primero)"""
+    with connection.cursor() as cursor:
+        for modelo in reversed(MODELOS_REEMPLAZO):
+            tabla = _tabla(modelo, sufijo)
+            if _existe(tabla):
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(tabla)}")
+
+
+def existen(sufijo=SUFIJO_SOMBRA):
+    """True si existen todas las tablas con `sufijo`"""
+    return all(_existe(_tabla(modelo, sufijo)) for modelo in MODELOS_REEMPLAZO)
+
+
+def preparar():
+    """Crea tablas sombra vacías y sin índices secundarios (descarta las de un intento anterior)"""
+    _eliminar(SUFIJO_SOMBRA)
+    with connection.schema_editor() as schema_editor:
+        for modelo in modelos_sombra():
+            schema_editor.create_model(modelo)
+
+
+def descartar():
+    """Elimina las tablas sombra (importación que no pasó la validación)"""
+    _eliminar(SUFIJO_SOMBRA)
+
+
+def _indices(modelo):
+    """Índices del modelo real: los de Meta.indexes más los campos con db_index"""
+    indices = list(modelo._meta.indexes)
+    for campo in modelo._meta.local_fields:
+        if campo.db_index and not campo.primary_key:
+            indices.append(models.Index(fields=[campo.name], name=f'{modelo._meta.db_table[:12]}_{campo.column[:12]}_idx'))
+    return indices
+
+
+def _restricciones(tabla):
+    with connection.cursor() as cursor:
+        return connection.introspection.get_constraints(cursor, tabla).values()
+
+
+def crear_indices():
+    """Crea en las tablas sombra ya cargadas los índices y claves foráneas de los modelos reales.
+
+    Los que ya existen (una importación reanudada después de crearlos) se omiten.
+    """
+    sombras = modelos_sombra()
+    marca = format(int(time.time()), 'x')
+    por_tabla = connection.vendor == 'mysql'
+
+    with connection.schema_editor() as schema_editor:
+        for modelo, sombra in zip(MODELOS_REEMPLAZO, sombras):
+            existentes = {
+                tuple(restriccion['columns']) for restriccion in _restricciones(_tabla(modelo, SUFIJO_SOMBRA))
+                if restriccion['index'] and not restriccion['primary_key']
+            }
+            for indice in _indices(modelo):
+                if tuple(sombra._meta.get_field(campo).column for campo in indice.fields) in existentes:
+                    continue
+                # En MySQL los nombres de índice son por tabla y se conservan los de los modelos
+                nombre = indice.name if por_tabla else f'{indice.name[:20]}_{marca}'
+                schema_editor.add_index(sombra, models.Index(fields=indice.fields, name=nombre))
+
+    if connection.vendor != 'mysql':
+        return
+    with connection.cursor() as cursor:
+        for modelo in MODELOS_REEMPLAZO:
+            claves = {
+                tuple(restriccion['columns']) for restriccion in _restricciones(_tabla(modelo, SUFIJO_SOMBRA))
+                if restriccion['foreign_key']
+            }
+            for campo in modelo._meta.local_fields:
+                if not campo.is_relation or not campo.db_constraint or (campo.column,) in claves:
+                    continue
+                destino = campo.related_model
+                cursor.execute(
+                    f"ALTER TABLE {connection.ops.quote_name(_tabla(modelo, SUFIJO_SOMBRA))}"
+                    f" ADD CONSTRAINT {connection.ops.quote_name(f'{modelo._meta.db_table[:20]}_fk_{marca}')}"
+                    f" FOREIGN KEY ({connection.ops.quote_name(campo.column)})"
+                    f" REFERENCES {connection.ops.quote_name(_tabla(destino, SUFIJO_SOMBRA))}"
+                    f" ({connection.ops.quote_name(destino._meta.pk.column)})"
+                )
+
+
+def llenar_resumen():
+    """Llena resumen_beneficiarios_new a partir de las tablas sombra"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {_tabla(ResumenBeneficiarios, SUFIJO_SOMBRA)}")
+        cursor.execute(insert_resumen(SUFIJO_SOMBRA))
+        cursor.execute(f"SELECT COUNT(*) FROM {_tabla(ResumenBeneficiarios, SUFIJO_SOMBRA)}")
+        return cursor.fetchone()[0]
+
+
+def contar(sufijo=''):
+    """{tabla: filas} de las tablas con `sufijo`"""
+    conteos = {}
+    with connection.cursor() as cursor:
+        for modelo in (Beneficiarios, Decretos, Resoluciones):
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(_tabla(modelo, sufijo))}")
+            conteos[modelo._meta.db_table] = cursor.fetchone()[0]
+    return conteos
+
+
+def validar(esperadas):
+    """Revisa que las tablas sombra tengan las filas cargadas y no muchas menos que las actuales.
+
+    `esperadas` son los beneficiarios que el pipeline informó como cargados;
+    cada uno debe tener exactamente un decreto y una resolución. Devuelve los
+    conteos o lanza ValidacionFallida.
+    """
+    nuevas = contar(SUFIJO_SOMBRA)
+    if not esperadas:
+        raise ValidacionFallida("no se cargó ningún beneficiario")
+    distintas = {tabla: filas for tabla, filas in nuevas.items() if filas != esperadas}
+    if distintas:
+        raise ValidacionFallida(f"se esperaban {esperadas} filas por tabla y hay {distintas}")
+
+    actuales = contar()[Beneficiarios._meta.db_table]
+    if esperadas < MINIMA_PROPORCION_FILAS * actuales:
+        raise ValidacionFallida(
+            f"la recarga trae {esperadas} beneficiarios y hay {actuales} en uso; parece incompleta"
+        )
+    return nuevas
+
+
+def _renombrar(pares):
+    """Renombra todas las tablas de una vez: un RENAME TABLE en MySQL, una transacción en SQLite"""
+    nombre = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute("RENAME TABLE " + ', '.join(f"{nombre(origen)} TO {nombre(destino)}" for origen, destino in pares))
+            return
+        with transaction.atomic():
+            for origen, destino in pares:
+                cursor.execute(f"ALTER TABLE {nombre(origen)} RENAME TO {nombre(destino)}")
+
+
+def intercambiar():
+    """Pone en uso las tablas sombra; las actuales pasan a *_old (las *_old anteriores se eliminan)"""
+    _eliminar(SUFIJO_ANTERIOR)
+    pares = []
+    for modelo in MODELOS_REEMPLAZO:
+        pares.append((_tabla(modelo), _tabla(modelo, SUFIJO_ANTERIOR)))
+        pares.append((_tabla(modelo, SUFIJO_SOMBRA), _tabla(modelo)))
+    _renombrar(pares)
+    invalidar_cache()
+
+
+def revertir():
+    """Vuelve a poner en uso las tablas *_old; las reemplazadas quedan como *_new.
+
+    Devuelve False si no hay tablas anteriores a las que volver.
+    """
+    if not existen(SUFIJO_ANTERIOR):
+        return False
+    _eliminar(SUFIJO_SOMBRA)
+    pares = []
+    for modelo in MODELOS_REEMPLAZO:
+        pares.append((_tabla(modelo), _tabla(modelo, SUFIJO_SOMBRA)))
+        pares.append((_tabla(modelo, SUFIJO_ANTERIOR), _tabla(modelo)))
+    _renombrar(pares)
+    invalidar_cache()
+    return True
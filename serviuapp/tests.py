@@ -1,3 +1,836 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import random
+import shutil
+import tempfile
+from collections import Counter
+from datetime import date, datetime
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from openpyxl import Workbook, load_workbook
+
+from . import puntos_control, tablas_sombra
+from .aggregations import contar_por_decreto
+from .busqueda_masiva import (
+    ENCABEZADOS, ESTADO_ENCONTRADO, ESTADO_INVALIDO, ESTADO_NO_ENCONTRADO, ESTADO_REPETIDO, leer_ruts_texto,
+    lotes_resultado,
+)
+from .cache_utils import invalidar_cache
+from .cambios import buscar_cambios, contar_cambios
+from .catalog import catalogo, normalizar_clave
+from .exportacion import ENCABEZADOS_EXPORTACION, iterar_filas
+from .importador import (
+    CargaIncremental, CargaORM, combinar_fuentes, dar_de_baja, filtrar_lote, importar_excel, leer_excel_por_lotes,
+    leer_lotes, limpiar_lote, revertir_reemplazo,
+)
+from .models import (
+    BajaBeneficiario, Beneficiarios, CambioBeneficiario, Decretos, PuntoControlImportacion, Resoluciones,
+    ResumenBeneficiarios,
+)
+from .paginacion import COLUMNAS_TABLA, POR_PAGINA_TABLA, obtener_pagina
+from .resumen import GROUP_BY_CLAVES, SELECT_CLAVES, reconstruir_resumen, registrar_cambios
+from .rut import calcular_dv, normalizar_rut, separar_rut
+from .validacion import calcular_dvs, normalizar_ruts, partes_rut
+
+
+def crear_beneficiario(rut='12345678', dv='5', comuna='Chillán', provincia='Diguillín',
+                       decreto='DS-49', tipologia='CNT', ano=2023):
+    beneficiario = Beneficiarios.objects.create(
+        rut=rut, dv=dv, nombres='Juan', primer_apellido='Pérez', comuna=comuna, provincia=provincia,
+    )
+    Decretos.objects.create(decreto_id_beneficiario=beneficiario, decreto=decreto, tipologia=tipologia)
+    Resoluciones.objects.create(resolucion_id_beneficiario=beneficiario, ano_imputacion_res_of=ano)
+    return beneficiario
+
+
+class DirectorioVersionMixin:
+    """Marca de versión de la caché en un directorio temporal, no en BASE_DIR/tmp"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajuste = override_settings(SERVIU_VERSION_DATOS_PATH=os.path.join(directorio, 'data_version'))
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+
+class ResumenTests(DirectorioVersionMixin, TestCase):
+    """Los conteos del resumen deben seguir al JOIN después de cada edición"""
+
+    def setUp(self):
+        super().setUp()
+        self.beneficiarios = [
+            crear_beneficiario(decreto='DS-49', tipologia='CNT', ano=2023),
+            crear_beneficiario(decreto='DS-49', tipologia='AVC', ano=2023),
+            crear_beneficiario(decreto='DS-10', tipologia='CCH', ano=2024, comuna='Bulnes'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            reconstruir_resumen()
+
+    def conteos_join(self, anos=None):
+        """Conteos por (decreto, tipología) normalizados, calculados sobre el JOIN"""
+        condicion, params = '', []
+        if anos:
+            condicion = " WHERE r.ano_imputacion_res_of IN ({})".format(','.join(['%s'] * len(anos)))
+            params = list(anos)
+        with connection.cursor() as cursor:
+            cursor.execute(SELECT_CLAVES + condicion + GROUP_BY_CLAVES, params)
+            filas = cursor.fetchall()
+        conteos = Counter()
+        for decreto, tipologia, _, _, _, total in filas:
+            conteos[(normalizar_clave(decreto), normalizar_clave(tipologia))] += total
+        return conteos
+
+    def assertResumenIgualAlJoin(self, anos=None):
+        conteo = contar_por_decreto(anos=anos)
+        esperado = self.conteos_join(anos)
+        for (decreto, tipologia), total in esperado.items():
+            self.assertEqual(conteo.get(decreto, tipologia), total, (decreto, tipologia))
+        self.assertEqual(sum(conteo.conteos.values()), sum(esperado.values()))
+
+    def test_registrar_cambios_de_decreto(self):
+        self.assertResumenIgualAlJoin()
+        self.assertEqual(contar_por_decreto().get('DS-49', 'CNT'), 1)
+
+        decreto = Decretos.objects.get(decreto_id_beneficiario=self.beneficiarios[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            with registrar_cambios(decreto):
+                decreto.tipologia = 'CNT'
+                decreto.save()
+
+        # La caché se invalidó al confirmar: el conteo nuevo se ve de inmediato
+        self.assertEqual(contar_por_decreto().get('DS-49', 'CNT'), 2)
+        self.assertEqual(contar_por_decreto().get('DS-49', 'AVC'), 0)
+        self.assertResumenIgualAlJoin()
+
+    def test_registrar_cambios_anidado_aplica_una_vez(self):
+        beneficiario = self.beneficiarios[2]
+        decreto = Decretos.objects.get(decreto_id_beneficiario=beneficiario)
+        with self.captureOnCommitCallbacks(execute=True):
+            with registrar_cambios(beneficiario):
+                with registrar_cambios(decreto):
+                    decreto.decreto = 'DS-49'
+                    decreto.tipologia = 'CNT'
+                    decreto.save()
+        self.assertEqual(contar_por_decreto().get('DS-49', 'CNT'), 2)
+        self.assertResumenIgualAlJoin()
+
+    def test_registrar_cambios_revierte_si_falla(self):
+        decreto = Decretos.objects.get(decreto_id_beneficiario=self.beneficiarios[0])
+        with self.assertRaises(RuntimeError):
+            with registrar_cambios(decreto):
+                decreto.tipologia = 'AVC'
+                decreto.save()
+                raise RuntimeError
+        self.assertEqual(Decretos.objects.get(pk=decreto.pk).tipologia, 'CNT')
+        self.assertResumenIgualAlJoin()
+
+    def test_vista_de_resolucion_actualiza_el_resumen(self):
+        self.assertEqual(contar_por_decreto(anos=['2024']).get('DS-49', 'CNT'), 0)
+        resolucion = Resoluciones.objects.get(resolucion_id_beneficiario=self.beneficiarios[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(
+                f'/beneficiarios/actualizar_beneficiario/actualizar_resolucion/{resolucion.pk}',
+                {'fecha_resolucion': '01/02/2024', 'seleccion': 'SI', 'ano_imputacion_res_of': '2024'},
+            )
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertEqual(contar_por_decreto(anos=['2024']).get('DS-49', 'CNT'), 1)
+        self.assertResumenIgualAlJoin(anos=['2024'])
+        self.assertResumenIgualAlJoin(anos=['2023'])
+
+
+class GraficosTests(DirectorioVersionMixin, TestCase):
+    """Datos de gráficos de varios decretos en un JSON, con ETag por filtros y versión de los datos"""
+
+    def setUp(self):
+        super().setUp()
+        crear_beneficiario(decreto='DS-49', tipologia='CNT')
+        crear_beneficiario(decreto='DS-49', tipologia='AVC', comuna='Bulnes')
+        crear_beneficiario(decreto='DS-10', tipologia='CCH')
+        with self.captureOnCommitCallbacks(execute=True):
+            reconstruir_resumen()
+
+    def test_varios_decretos_en_una_respuesta(self):
+        respuesta = self.client.get('/chart_data/', {'decretos': ['DS-49', 'DS-10']})
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual(set(datos), {'DS-49', 'DS-10'})
+        series = dict(zip(datos['DS-49']['labels'], datos['DS-49']['data']))
+        self.assertEqual((series['CNT'], series['AVC'], series['Sin tipología']), (1, 1, 0))
+        self.assertEqual(sum(datos['DS-10']['data']), 1)
+
+        # Sin ?decretos= vienen todos los del catálogo
+        self.assertEqual(list(self.client.get('/chart_data/').json()), catalogo.codigos)
+
+    def test_304_si_el_etag_coincide(self):
+        parametros = {'decretos': ['DS-49'], 'comunas': ['Bulnes']}
+        respuesta = self.client.get('/chart_data/', parametros)
+        etag = respuesta['ETag']
+        self.assertEqual(sum(respuesta.json()['DS-49']['data']), 1)
+
+        repetida = self.client.get('/chart_data/', parametros, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida.content, b'')
+
+        # Otros filtros u otro decreto tienen otro ETag
+        otra = self.client.get('/chart_data/', {'decretos': ['DS-49']}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(otra.status_code, 200)
+        self.assertNotEqual(otra['ETag'], etag)
+
+    def test_304_en_el_grafico_de_un_decreto(self):
+        respuesta = self.client.get('/chart_data/DS-49/', {'comunas': ['Bulnes']})
+        self.assertEqual(respuesta.json()['title'], 'Distribución DS-49')
+        repetida = self.client.get('/chart_data/DS-49/', {'comunas': ['Bulnes']}, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(repetida.status_code, 304)
+
+    def test_datos_nuevos_cambian_el_etag(self):
+        etag = self.client.get('/chart_data/', {'decretos': ['DS-49']})['ETag']
+        invalidar_cache()
+        respuesta = self.client.get('/chart_data/', {'decretos': ['DS-49']}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+
+class PaginacionTests(TestCase):
+    """Paginación keyset de la lista de beneficiarios"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = [crear_beneficiario().pk for _ in range(25)]
+
+    def test_primera_pagina(self):
+        pagina = obtener_pagina(10)
+        self.assertEqual(pagina.ids, self.ids[:10])
+        self.assertFalse(pagina.has_previous)
+        self.assertTrue(pagina.has_next)
+        self.assertEqual([fila[0] for fila in pagina], self.ids[:10])
+
+    def test_avanzar_y_retroceder(self):
+        segunda = obtener_pagina(10, despues=obtener_pagina(10).ultimo_id)
+        self.assertEqual(segunda.ids, self.ids[10:20])
+        self.assertTrue(segunda.has_previous)
+        self.assertTrue(segunda.has_next)
+
+        tercera = obtener_pagina(10, despues=segunda.ultimo_id)
+        self.assertEqual(tercera.ids, self.ids[20:])
+        self.assertFalse(tercera.has_next)
+
+        anterior = obtener_pagina(10, antes=tercera.primer_id)
+        self.assertEqual(anterior.ids, segunda.ids)
+        primera = obtener_pagina(10, antes=anterior.primer_id)
+        self.assertEqual(primera.ids, self.ids[:10])
+        self.assertFalse(primera.has_previous)
+
+    def test_ultima_pagina(self):
+        ultima = obtener_pagina(10, ultima=True)
+        self.assertEqual(ultima.ids, self.ids[15:])
+        self.assertTrue(ultima.has_previous)
+        self.assertFalse(ultima.has_next)
+
+    def test_tabla_vacia(self):
+        Beneficiarios.objects.all().delete()
+        pagina = obtener_pagina(10)
+        self.assertFalse(pagina)
+        self.assertFalse(pagina.has_previous)
+        self.assertFalse(pagina.has_next)
+
+
+class FiltrosDetalleTests(TestCase):
+    """Tabla de detalle de filtros en JSON, por páginas con cursor ?despues="""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = [crear_beneficiario(ano=2023 + id_ % 2).pk for id_ in range(POR_PAGINA_TABLA + 10)]
+
+    def test_paginas_con_cursor(self):
+        primera = self.client.get('/filtros/detalle/').json()
+        self.assertEqual(primera['columnas'], [nombre for nombre, _ in COLUMNAS_TABLA])
+        self.assertEqual([fila[0] for fila in primera['filas']], self.ids[:POR_PAGINA_TABLA])
+        self.assertEqual(primera['siguiente'], self.ids[POR_PAGINA_TABLA - 1])
+
+        segunda = self.client.get('/filtros/detalle/', {'despues': primera['siguiente']}).json()
+        self.assertEqual([fila[0] for fila in segunda['filas']], self.ids[POR_PAGINA_TABLA:])
+        self.assertIsNone(segunda['siguiente'])
+
+        # Un cursor que no es un entero se ignora
+        self.assertEqual(self.client.get('/filtros/detalle/', {'despues': 'x'}).json(), primera)
+
+    def test_filtro_de_ano(self):
+        de_2024 = [id_ for posicion, id_ in enumerate(self.ids) if posicion % 2 == 1]
+        datos = self.client.get('/filtros/detalle/', {'ano_imputacion': '2024'}).json()
+        self.assertEqual([fila[0] for fila in datos['filas']], de_2024)
+        self.assertEqual({fila[-1] for fila in datos['filas']}, {2024})
+        self.assertIsNone(datos['siguiente'])
+
+        vacia = self.client.get('/filtros/detalle/', {'ano_imputacion': '2020'}).json()
+        self.assertEqual((vacia['filas'], vacia['siguiente']), ([], None))
+
+
+class RutTests(SimpleTestCase):
+    """normalizar_rut, separar_rut y la versión vectorizada de validacion deben coincidir"""
+
+    def test_calcular_dvs_coincide_con_calcular_dv(self):
+        azar = random.Random(9)
+        cuerpos = ['1', '9', '11', '1000000', '99999999'] + [str(azar.randint(1, 99999999)) for _ in range(2000)]
+        calculados = calcular_dvs(pd.Series(cuerpos, index=range(10, 10 + len(cuerpos))))
+        self.assertEqual(list(calculados.index), list(range(10, 10 + len(cuerpos))))
+        self.assertEqual(calculados.tolist(), [calcular_dv(cuerpo) for cuerpo in cuerpos])
+
+    def test_calcular_dvs_vacio(self):
+        self.assertTrue(calcular_dvs(pd.Series([], dtype=object)).empty)
+
+    def test_separar_rut(self):
+        casos = {
+            '12.345.678-5': ('12345678', '5'),
+            '12345678-5': ('12345678', '5'),
+            '123456785': ('12345678', '5'),
+            '12345678': ('12345678', None),
+            '7.654.333-k': ('7654333', 'K'),
+            '7654333k': ('7654333', 'K'),
+            ' 0012345678- ': ('12345678', None),
+            None: ('', None),
+        }
+        for rut, esperado in casos.items():
+            with self.subTest(rut=rut):
+                self.assertEqual(separar_rut(rut), esperado)
+
+    def test_partes_rut_coincide_con_separar_rut(self):
+        ruts = ['12.345.678-5', '123456785', '12345678', '7654321k', '7654321-K', '00123-4', 'abc', '', '1-']
+        cuerpo, dv = partes_rut(pd.Series(ruts))
+        for posicion, rut in enumerate(ruts):
+            with self.subTest(rut=rut):
+                esperado = separar_rut(rut)
+                self.assertEqual((cuerpo[posicion], dv[posicion] or None), esperado)
+
+    def test_normalizar_rut(self):
+        casos = [
+            (('12.345.678-5',), '12345678-5'),
+            (('12345678',), '12345678-5'),
+            (('123456785',), '12345678-5'),
+            (('12.345.678-4',), None),
+            (('12345678', '5'), '12345678-5'),
+            (('12345678', ' 5 '), '12345678-5'),
+            (('12345678', ''), '12345678-5'),
+            (('12345678', '4'), None),
+            (('12345678-5', '5'), '12345678-5'),
+            (('12345678-5', '4'), None),
+            (('7654333', 'k'), '7654333-K'),
+            (('abc',), None),
+            (('123456789-0',), None),
+            (('',), None),
+        ]
+        for argumentos, esperado in casos:
+            with self.subTest(argumentos=argumentos):
+                self.assertEqual(normalizar_rut(*argumentos), esperado)
+
+    def test_normalizar_ruts_coincide_con_normalizar_rut(self):
+        azar = random.Random(12)
+        ruts, dvs = ['', 'abc', '1-', '-5', '12.345.678-5', '123456789-0'], ['', '', '', '', '4', '']
+        for _ in range(3000):
+            cuerpo = str(azar.randint(1, 99999999))
+            dv = azar.choice([calcular_dv(cuerpo), str(azar.randint(0, 9)), 'K', 'k', ''])
+            con_puntos = f'00{int(cuerpo):,}'.replace(',', '.')
+            ruts.append(azar.choice([cuerpo, f'{cuerpo}-{dv}', f'{cuerpo}{dv}', f'{con_puntos}-{dv}']))
+            dvs.append(azar.choice(['', ' ', dv, calcular_dv(cuerpo).lower()]))
+        normalizados = normalizar_ruts(pd.Series(ruts), pd.Series(dvs))
+        for rut, dv, normalizado in zip(ruts, dvs, normalizados):
+            with self.subTest(rut=rut, dv=dv):
+                self.assertEqual(normalizado, normalizar_rut(rut, dv or None))
+
+    def test_normalizar_rut_usa_el_dv_calculado(self):
+        azar = random.Random(3)
+        for cuerpo in (str(azar.randint(1, 99999999)) for _ in range(500)):
+            dv = calcular_dv(cuerpo)
+            self.assertEqual(normalizar_rut(cuerpo), f'{cuerpo}-{dv}')
+            self.assertEqual(normalizar_rut(cuerpo, dv.lower()), f'{cuerpo}-{dv}')
+
+
+class BusquedaMasivaTests(TestCase):
+    """Clasificación de los RUT de una búsqueda masiva, en el orden de entrada y por lotes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Dos registros con el mismo RUT y uno con otro
+        cls.encontrados = [crear_beneficiario(rut='12345678', dv='5').pk for _ in range(2)]
+        cls.otro = crear_beneficiario(rut='7654333', dv='K').pk
+
+    def test_lotes_resultado(self):
+        entradas = ['12.345.678-5', 'abc', '11111111-1', '12345678', '7654333k', '12345678-4', '7.654.333-K']
+        filas = [fila for lote in lotes_resultado(entradas, tamano_lote=3) for fila in lote]
+
+        self.assertEqual([(fila[0], fila[2], fila[3]) for fila in filas], [
+            ('12.345.678-5', ESTADO_ENCONTRADO, self.encontrados[0]),
+            ('12.345.678-5', ESTADO_ENCONTRADO, self.encontrados[1]),
+            ('abc', ESTADO_INVALIDO, ''),
+            ('11111111-1', ESTADO_NO_ENCONTRADO, ''),
+            # Repetido aunque llegue en otro lote y con otro formato
+            ('12345678', ESTADO_REPETIDO, ''),
+            ('7654333k', ESTADO_ENCONTRADO, self.otro),
+            ('12345678-4', ESTADO_INVALIDO, ''),
+            ('7.654.333-K', ESTADO_REPETIDO, ''),
+        ])
+        self.assertEqual({len(fila) for fila in filas}, {len(ENCABEZADOS)})
+        self.assertEqual(filas[0][1], '12345678-5')
+
+    def test_leer_ruts_texto(self):
+        self.assertEqual(leer_ruts_texto('12.345.678-5, 7654333k;\n 11111111-1 '),
+                         ['12.345.678-5', '7654333k', '11111111-1'])
+
+    def test_descarga_xlsx(self):
+        self.client.force_login(User.objects.create_user('consulta'))
+        respuesta = self.client.post('/beneficiarios/busqueda_masiva/', {
+            'ruts': '12.345.678-5\nabc\n7654333k', 'formato': 'xlsx',
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('busqueda_ruts.xlsx', respuesta['Content-Disposition'])
+        libro = load_workbook(io.BytesIO(b''.join(respuesta.streaming_content)), read_only=True)
+        filas = list(libro.active.iter_rows(values_only=True))
+        self.assertEqual(list(filas[0]), ENCABEZADOS)
+        self.assertEqual([(fila[0], fila[2]) for fila in filas[1:]], [
+            ('12.345.678-5', ESTADO_ENCONTRADO), ('12.345.678-5', ESTADO_ENCONTRADO),
+            ('abc', ESTADO_INVALIDO), ('7654333k', ESTADO_ENCONTRADO),
+        ])
+
+
+def fila_excel(id_beneficiario, rut, comuna='Chillán', tipologia='CNT'):
+    return {
+        'id_beneficiario': id_beneficiario, 'rut': rut, 'dv': '', 'nombres': 'Juan', 'primer_apellido': 'Pérez',
+        'segundo_apellido': 'Soto', 'comuna': comuna, 'provincia': 'Diguillín', 'decreto': 'DS-49',
+        'tipologia': tipologia, 'tramo': 1, 'resolucion': 100, 'ano_imputacion_res_of': 2023,
+    }
+
+
+def nuevos_contadores():
+    """Contadores de una importación, como los arma ejecutar_pipeline"""
+    return {
+        'filas_leidas': 0, 'beneficiarios': 0, 'decretos': 0, 'resoluciones': 0, 'cambios': 0,
+        'nuevos': 0, 'actualizados': 0, 'sin_cambios': 0, 'eliminados': 0,
+        'errores': 0, 'rechazos': {}, 'ids': set(),
+    }
+
+
+class CargaIncrementalTests(TestCase):
+    """Upsert por huella del modo incremental y bajas de las filas que ya no vienen"""
+
+    def importar(self, filas):
+        contadores = nuevos_contadores()
+        limpio, _ = limpiar_lote(pd.DataFrame(filas, dtype=object))
+        limpio = filtrar_lote(limpio, 1, contadores['ids'], contadores)
+        CargaIncremental(1000).escribir(limpio, 1, contadores)
+        dar_de_baja(contadores['ids'], contadores)
+        return contadores
+
+    def setUp(self):
+        self.filas = [fila_excel(id_, str(1000000 + id_)) for id_ in range(1, 6)]
+        contadores = self.importar(self.filas)
+        self.assertEqual((contadores['nuevos'], contadores['actualizados'], contadores['sin_cambios']), (5, 0, 0))
+
+    def test_sin_cambios(self):
+        contadores = self.importar(self.filas)
+        self.assertEqual(contadores['nuevos'], 0)
+        self.assertEqual(contadores['actualizados'], 0)
+        self.assertEqual(contadores['sin_cambios'], 5)
+        self.assertEqual(contadores['eliminados'], 0)
+
+    def test_cambiadas_nuevas_y_eliminadas(self):
+        filas = [dict(fila) for fila in self.filas[:4]]
+        filas[0]['comuna'] = 'Bulnes'
+        filas[1]['tipologia'] = 'AVC'
+        filas.append(fila_excel(6, '1000006'))
+
+        contadores = self.importar(filas)
+        self.assertEqual(contadores['nuevos'], 1)
+        self.assertEqual(contadores['actualizados'], 2)
+        self.assertEqual(contadores['sin_cambios'], 2)
+        self.assertEqual(contadores['eliminados'], 1)
+
+        self.assertEqual(Beneficiarios.objects.get(pk=1).comuna, 'Bulnes')
+        self.assertEqual(Decretos.objects.get(decreto_id_beneficiario=2).tipologia, 'AVC')
+        self.assertEqual(sorted(Beneficiarios.objects.values_list('pk', flat=True)), [1, 2, 3, 4, 6])
+        self.assertFalse(Decretos.objects.filter(decreto_id_beneficiario=5).exists())
+        self.assertFalse(Resoluciones.objects.filter(resolucion_id_beneficiario=5).exists())
+
+        # Lápida del beneficiario dado de baja, con su RUT y huella
+        baja = BajaBeneficiario.objects.get()
+        self.assertEqual(baja.id_beneficiario, 5)
+        self.assertEqual(baja.rut, '1000005')
+        self.assertEqual(baja.rut_normalizado, normalizar_rut('1000005'))
+        self.assertTrue(baja.huella)
+
+    def test_archivo_incompleto_no_da_de_baja(self):
+        contadores = self.importar(self.filas[:2])
+        self.assertEqual(contadores['eliminados'], 0)
+        self.assertEqual(Beneficiarios.objects.count(), 5)
+        self.assertFalse(BajaBeneficiario.objects.exists())
+
+
+def escribir_excel(directorio, nombre, filas):
+    """Guarda las filas (dicts con los encabezados como claves) en un .xlsx y devuelve su ruta"""
+    libro = Workbook()
+    hoja = libro.active
+    hoja.append(list(filas[0]))
+    for fila in filas:
+        hoja.append(list(fila.values()))
+    ruta = os.path.join(directorio, nombre)
+    libro.save(ruta)
+    return ruta
+
+
+class ImportacionMixin(DirectorioVersionMixin):
+    """Archivos de prueba en un directorio temporal; las importaciones no usan la caché columnar"""
+
+    def setUp(self):
+        super().setUp()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+
+    def excel(self, nombre, filas):
+        return escribir_excel(self.directorio, nombre, filas)
+
+    def importar_excel(self, ruta, **opciones):
+        """importar_excel con la limpieza en un hilo; el log queda en self.registro"""
+        with self.assertLogs('serviuapp.importador', 'INFO') as registro:
+            resultado = importar_excel(ruta, procesos=0, usar_cache=False, **opciones)
+        self.registro = registro.output
+        return resultado
+
+    def conteos(self, sufijo=''):
+        return list(tablas_sombra.contar(sufijo).values())
+
+
+class RecargaTests(ImportacionMixin, TransactionTestCase):
+    """Recarga en modo reemplazo: intercambio de tablas sombra y vuelta atrás con revertir_reemplazo"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(tablas_sombra._eliminar, tablas_sombra.SUFIJO_ANTERIOR)
+        self.addCleanup(tablas_sombra._eliminar, tablas_sombra.SUFIJO_SOMBRA)
+        self.anteriores = [fila_excel(id_, str(2000000 + id_), comuna='Bulnes') for id_ in range(1, 7)]
+        self.assertTrue(self.importar_excel(self.excel('anterior.xlsx', self.anteriores)))
+        self.assertEqual(self.conteos(), [6, 6, 6])
+
+    def revertir(self):
+        with self.assertLogs('serviuapp.importador', 'INFO'):
+            return revertir_reemplazo()
+
+    def test_recarga_y_revertir(self):
+        nuevas = [fila_excel(id_, str(3000000 + id_)) for id_ in range(101, 109)]
+        self.assertTrue(self.importar_excel(self.excel('nuevo.xlsx', nuevas), modo='reemplazo'))
+
+        # Las tablas nuevas quedan en uso y las reemplazadas como *_old
+        self.assertEqual(self.conteos(), [8, 8, 8])
+        self.assertEqual(self.conteos(tablas_sombra.SUFIJO_ANTERIOR), [6, 6, 6])
+        self.assertFalse(tablas_sombra.existen(tablas_sombra.SUFIJO_SOMBRA))
+        self.assertEqual(set(Beneficiarios.objects.values_list('comuna', flat=True)), {'Chillán'})
+        self.assertEqual(sum(ResumenBeneficiarios.objects.values_list('total', flat=True)), 8)
+
+        self.assertTrue(self.revertir())
+        self.assertEqual(self.conteos(), [6, 6, 6])
+        self.assertEqual(self.conteos(tablas_sombra.SUFIJO_SOMBRA), [8, 8, 8])
+        self.assertFalse(tablas_sombra.existen(tablas_sombra.SUFIJO_ANTERIOR))
+        self.assertEqual(sorted(Beneficiarios.objects.values_list('pk', flat=True)), list(range(1, 7)))
+        self.assertEqual(set(Beneficiarios.objects.values_list('comuna', flat=True)), {'Bulnes'})
+        self.assertEqual(sum(ResumenBeneficiarios.objects.values_list('total', flat=True)), 6)
+
+        # Sin tablas *_old no hay a qué volver
+        self.assertFalse(self.revertir())
+        self.assertEqual(self.conteos(), [6, 6, 6])
+
+    def test_validacion_fallida_no_toca_las_tablas_en_uso(self):
+        # Dos filas contra seis en uso: menos de MINIMA_PROPORCION_FILAS, no se intercambia
+        incompleto = [fila_excel(id_, str(3000000 + id_)) for id_ in (101, 102)]
+        self.assertFalse(self.importar_excel(self.excel('incompleto.xlsx', incompleto), modo='reemplazo'))
+        self.assertTrue(any('parece incompleta' in linea for linea in self.registro))
+
+        self.assertEqual(self.conteos(), [6, 6, 6])
+        self.assertEqual(sorted(Beneficiarios.objects.values_list('pk', flat=True)), list(range(1, 7)))
+        self.assertFalse(tablas_sombra.existen(tablas_sombra.SUFIJO_SOMBRA))
+        self.assertFalse(tablas_sombra.existen(tablas_sombra.SUFIJO_ANTERIOR))
+        self.assertFalse(self.revertir())
+
+
+class ReanudarTests(ImportacionMixin, TransactionTestCase):
+    """Importación interrumpida a mitad de camino y reanudada desde el último lote confirmado"""
+
+    def setUp(self):
+        super().setUp()
+        comunas = ('Chillán', 'Bulnes', 'Quirihue')
+        tipologias = ('CNT', 'AVC')
+        self.filas = [
+            fila_excel(id_, str(4000000 + id_), comuna=comunas[id_ % 3], tipologia=tipologias[id_ % 2])
+            for id_ in range(1, 24)
+        ]
+        self.ruta = self.excel('reanudar.xlsx', self.filas)
+
+    def fallar_en_lote(self, numero):
+        """Hace fallar el lote `numero` después de escribir parte de sus filas, como una caída a mitad del lote"""
+        original = CargaORM.escribir
+
+        def escribir(escritor, limpio, numero_lote, contadores):
+            if numero_lote == numero:
+                original(escritor, limpio.iloc[:2], numero_lote, contadores)
+                raise RuntimeError('falla simulada')
+            return original(escritor, limpio, numero_lote, contadores)
+
+        return mock.patch.object(CargaORM, 'escribir', escribir)
+
+    def resumen(self):
+        return sorted(ResumenBeneficiarios.objects.values_list(
+            'decreto', 'tipologia', 'comuna', 'provincia', 'ano_imputacion_res_of', 'total',
+        ))
+
+    def test_reanudar_despues_de_una_falla(self):
+        with self.fallar_en_lote(3):
+            self.assertFalse(self.importar_excel(self.ruta, batch_size=5))
+
+        # Quedan confirmados los dos primeros lotes, con su punto de control; lo
+        # escrito del tercero se revirtió con su transacción
+        punto = PuntoControlImportacion.objects.get()
+        self.assertEqual((punto.lote, punto.fila), (2, 10))
+        self.assertEqual(self.conteos(), [10, 10, 10])
+
+        self.assertTrue(self.importar_excel(self.ruta, batch_size=5, reanudar=True))
+        self.assertTrue(any('Saltando 2 lotes' in linea for linea in self.registro))
+        self.assertFalse(PuntoControlImportacion.objects.exists())
+
+        # Sin filas repetidas ni faltantes: un decreto y una resolución por beneficiario
+        ids = list(range(1, 24))
+        self.assertEqual(sorted(Beneficiarios.objects.values_list('pk', flat=True)), ids)
+        self.assertEqual(sorted(Decretos.objects.values_list('decreto_id_beneficiario', flat=True)), ids)
+        self.assertEqual(sorted(Resoluciones.objects.values_list('resolucion_id_beneficiario', flat=True)), ids)
+        self.assertEqual(
+            dict(Beneficiarios.objects.values_list('pk', 'comuna')),
+            {fila['id_beneficiario']: fila['comuna'] for fila in self.filas},
+        )
+
+        # El resumen cubre todos los lotes, igual que si se reconstruye desde cero
+        resumen = self.resumen()
+        self.assertEqual(sum(fila[-1] for fila in resumen), 23)
+        reconstruir_resumen()
+        self.assertEqual(self.resumen(), resumen)
+
+    def test_reanudar_con_otro_tamano_de_lote(self):
+        with self.fallar_en_lote(2):
+            self.assertFalse(self.importar_excel(self.ruta, batch_size=5))
+        self.assertFalse(self.importar_excel(self.ruta, batch_size=10, reanudar=True))
+        self.assertEqual(self.conteos(), [5, 5, 5])
+        self.assertEqual(PuntoControlImportacion.objects.get().lote, 1)
+
+
+class CacheExcelTests(SimpleTestCase):
+    """Caché columnar del Excel: la segunda lectura del mismo archivo no abre el libro"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajuste = override_settings(SERVIU_CACHE_EXCEL_DIR=os.path.join(self.directorio, 'cache'))
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.filas = [dict(fila_excel(id_, str(5000000 + id_)), fecha_resolucion=datetime(2023, 1, id_), tramo=id_ / 2)
+                      for id_ in range(1, 8)]
+        self.filas[2]['nombres'] = None
+
+    def leer(self, ruta, batch_size=3):
+        return list(leer_lotes(ruta, batch_size, puntos_control.huella_archivo(ruta)))
+
+    def assertLotesIguales(self, lotes, esperados):
+        self.assertEqual(len(lotes), len(esperados))
+        for lote, esperado in zip(lotes, esperados):
+            pd.testing.assert_frame_equal(lote, esperado)
+
+    def test_acierto_y_fallo(self):
+        ruta = escribir_excel(self.directorio, 'fuente.xlsx', self.filas)
+        directo = list(leer_excel_por_lotes(ruta, 3))
+
+        with self.assertLogs('serviuapp.cache_excel', 'INFO') as registro:
+            self.assertLotesIguales(self.leer(ruta), directo)
+        self.assertIn('guardado en la caché', registro.output[0])
+
+        # Acierto: los mismos lotes sin volver a leer el Excel, también con otro tamaño de lote
+        with mock.patch('serviuapp.importador.leer_excel_por_lotes', side_effect=AssertionError('se leyó el Excel')):
+            with self.assertLogs('serviuapp.importador', 'INFO') as registro:
+                self.assertLotesIguales(self.leer(ruta), directo)
+                self.assertLotesIguales(self.leer(ruta, batch_size=5), list(leer_excel_por_lotes(ruta, 5)))
+        self.assertEqual(len(registro.output), 2)
+
+        # El archivo cambió: otra huella, se lee el Excel y se guarda otra entrada
+        self.filas[0]['comuna'] = 'Bulnes'
+        escribir_excel(self.directorio, 'fuente.xlsx', self.filas)
+        with mock.patch('serviuapp.importador.leer_excel_por_lotes', wraps=leer_excel_por_lotes) as lectura:
+            with self.assertLogs('serviuapp.cache_excel', 'INFO'):
+                lotes = self.leer(ruta)
+        lectura.assert_called_once()
+        self.assertEqual(lotes[0].loc[0, 'comuna'], 'Bulnes')
+        self.assertEqual(len(os.listdir(os.path.join(self.directorio, 'cache'))), 2)
+
+    def test_sin_cache(self):
+        ruta = escribir_excel(self.directorio, 'fuente.xlsx', self.filas)
+        leer_lotes(ruta, 3, puntos_control.huella_archivo(ruta), usar_cache=False)
+        self.assertFalse(os.path.exists(os.path.join(self.directorio, 'cache')))
+
+
+class CombinarFuentesTests(SimpleTestCase):
+    """Varias hojas o archivos combinados en un solo conjunto, sin ids repetidos"""
+
+    def limpio(self, filas):
+        return limpiar_lote(pd.DataFrame(filas, dtype=object))[0]
+
+    def test_repetidos_por_id_y_rut(self):
+        uno = self.limpio([fila_excel(3, '5000003'), fila_excel(1, '5000001'), fila_excel(2, '5000002'),
+                           fila_excel(None, '5000009')])
+        # id 2 con el mismo RUT es el mismo beneficiario; id 1 con otro RUT es un conflicto
+        dos = self.limpio([fila_excel(2, '5000002', comuna='Bulnes'), fila_excel(1, '6000001'),
+                           fila_excel(4, '5000004')])
+
+        with self.assertLogs('serviuapp.importador', 'INFO') as registro:
+            combinado, conflictos = combinar_fuentes([('a.xlsx[uno]', uno), ('b.xlsx', None), ('b.xlsx[dos]', dos)])
+
+        self.assertEqual(conflictos, 1)
+        self.assertEqual(combinado['id_beneficiario'].tolist(), [1, 2, 3, 4])
+        self.assertEqual(list(combinado.index), [0, 1, 2, 3])
+        # De cada id queda la primera fila leída
+        self.assertEqual(combinado['rut'].tolist(), ['5000001', '5000002', '5000003', '5000004'])
+        self.assertEqual(combinado['comuna'].tolist(), ['Chillán'] * 4)
+        self.assertEqual(combinado['origen'].tolist(), [
+            'fila 3 de a.xlsx[uno]', 'fila 4 de a.xlsx[uno]', 'fila 2 de a.xlsx[uno]', 'fila 4 de b.xlsx[dos]',
+        ])
+
+        mensajes = '\n'.join(registro.output)
+        self.assertIn('1 filas sin id_beneficiario', mensajes)
+        self.assertIn('1 filas repetidas', mensajes)
+        self.assertIn('Fila 3 de b.xlsx[dos]: id_beneficiario 1 ya viene con otro RUT en la fila 3 de a.xlsx[uno]',
+                      mensajes)
+
+    def test_sin_fuentes(self):
+        combinado, conflictos = combinar_fuentes([('a.xlsx', None)])
+        self.assertTrue(combinado.empty)
+        self.assertEqual(conflictos, 0)
+
+
+class CambiosBeneficiarioTests(DirectorioVersionMixin, TestCase):
+    """Columnas de reemplazo, sustitución, eliminación y renuncia importadas a cambios_beneficiario"""
+
+    def escribir(self, escritor, filas):
+        contadores = nuevos_contadores()
+        limpio, rechazos = limpiar_lote(pd.DataFrame(filas, dtype=object))
+        limpio = filtrar_lote(limpio, 1, contadores['ids'], contadores)
+        with self.assertLogs('serviuapp.importador', 'INFO'):
+            escritor.escribir(limpio, 1, contadores)
+        return contadores, rechazos
+
+    def setUp(self):
+        super().setUp()
+        sin_cambio = dict.fromkeys(['REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA', 'RUT_NUEVO_BENEFICIARIO', 'DV2',
+                                    'NOMBRE', 'APELLIDO1', 'APELLIDO2', 'res. n°', 'fecha_res'])
+        self.filas = [dict(fila_excel(id_, str(1000000 + id_)), **sin_cambio) for id_ in range(1, 6)]
+        self.filas[0].update({
+            'REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA': 'REEMPLAZO', 'RUT_NUEVO_BENEFICIARIO': '11.111.111',
+            'DV2': '1', 'NOMBRE': 'Ana', 'APELLIDO1': 'Rojas', 'APELLIDO2': 'Soto', 'res. n°': 55,
+            'fecha_res': '15-03-2024',
+        })
+        self.filas[2].update({'REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA': ' renuncia '})
+        self.filas[3].update({'REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA': 'Sustitución',
+                              'RUT_NUEVO_BENEFICIARIO': '22222222-3'})
+        self.filas[4].update({'REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA': 'traspaso'})
+        self.contadores, self.rechazos = self.escribir(CargaORM(1000), self.filas)
+
+    def test_filas_de_cambios(self):
+        self.assertEqual(self.contadores['cambios'], 3)
+        cambios = {cambio.cambio_id_beneficiario_id: cambio for cambio in CambioBeneficiario.objects.all()}
+        self.assertEqual({id_: cambio.tipo for id_, cambio in cambios.items()}, {
+            1: CambioBeneficiario.REEMPLAZO, 3: CambioBeneficiario.RENUNCIA, 4: CambioBeneficiario.SUSTITUCION,
+        })
+
+        reemplazo = cambios[1]
+        self.assertEqual(reemplazo.rut_anterior, Beneficiarios.objects.get(pk=1).rut_normalizado)
+        self.assertEqual(reemplazo.rut_nuevo_normalizado, '11111111-1')
+        self.assertEqual((reemplazo.nombres_nuevo, reemplazo.primer_apellido_nuevo), ('Ana', 'Rojas'))
+        self.assertEqual((reemplazo.resolucion, reemplazo.fecha_resolucion), (55, date(2024, 3, 15)))
+        # DV del RUT nuevo que no coincide con el calculado
+        self.assertIsNone(cambios[4].rut_nuevo_normalizado)
+        self.assertIsNone(cambios[3].rut_nuevo_normalizado)
+
+        # Tipo desconocido: la fila se importa sin cambio y la celda queda como rechazo
+        self.assertEqual(self.rechazos['tipo_cambio'].tolist(), ['traspaso'])
+        self.assertEqual(Beneficiarios.objects.count(), 5)
+
+    def test_consultas_de_cambios(self):
+        encontrados = buscar_cambios('11111111-1')
+        self.assertEqual([(cambio['tipo'], cambio['id_beneficiario'], cambio['nombres_anterior'])
+                          for cambio in encontrados], [(CambioBeneficiario.REEMPLAZO, 1, 'Juan')])
+        self.assertEqual(buscar_cambios(normalizar_rut('1000001')), encontrados)
+
+        totales = {conteo['tipo']: conteo['total'] for conteo in contar_cambios()}
+        self.assertEqual(totales, {'REEMPLAZO': 1, 'SUSTITUCION': 1, 'ELIMINACION': 0, 'RENUNCIA': 1})
+        self.assertEqual(sum(conteo['total'] for conteo in contar_cambios(comunas=['Bulnes'])), 0)
+
+    def test_incremental_reemplaza_los_cambios_de_la_fila(self):
+        self.filas[0]['REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA'] = None
+        self.filas[2]['REEMPLAZO/SUSTITUCION/ELIMINACION/RENUNCIA'] = 'ELIMINACION'
+        contadores, _ = self.escribir(CargaIncremental(1000), self.filas)
+        self.assertEqual(contadores['actualizados'], 2)
+        self.assertEqual(dict(CambioBeneficiario.objects.values_list('cambio_id_beneficiario', 'tipo')), {
+            3: CambioBeneficiario.ELIMINACION, 4: CambioBeneficiario.SUSTITUCION,
+        })
+
+
+class ExportacionTests(TestCase):
+    """Exportación del detalle de filtros: mismos filtros en CSV y XLSX, por lotes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.incluidos = [
+            crear_beneficiario(rut='11111111', dv='1').pk,
+            crear_beneficiario(rut='22222222', dv='2', comuna='Bulnes', provincia='Diguillín').pk,
+        ]
+        crear_beneficiario(rut='33333333', dv='3', ano=2022)
+        crear_beneficiario(rut='44444444', dv='4', decreto='DS-1')
+        crear_beneficiario(rut='55555555', dv='5', comuna='Yungay')
+        cls.filtros = {'comunas': ['Chillán', 'Bulnes'], 'ano_imputacion': ['2023'], 'decretos': ['DS-49']}
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('consulta'))
+
+    def test_csv_aplica_los_filtros(self):
+        respuesta = self.client.get('/filtros/exportar/', self.filtros)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertRegex(respuesta['Content-Disposition'], r'filename="beneficiarios_\d{8}\.csv"')
+        texto = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertTrue(texto.startswith('\ufeff'))
+        filas = list(csv.reader(io.StringIO(texto[1:])))
+        self.assertEqual(filas[0], ENCABEZADOS_EXPORTACION)
+        columnas = {nombre: indice for indice, nombre in enumerate(filas[0])}
+        self.assertEqual([int(fila[columnas['id_beneficiario']]) for fila in filas[1:]], self.incluidos)
+        self.assertEqual({(fila[columnas['comuna']], fila[columnas['ano_imputacion']], fila[columnas['decreto']])
+                          for fila in filas[1:]}, {('Chillán', '2023', 'DS-49'), ('Bulnes', '2023', 'DS-49')})
+
+        # Sin filtros van todos
+        todos = b''.join(self.client.get('/filtros/exportar/').streaming_content).decode('utf-8')
+        self.assertEqual(len(list(csv.reader(io.StringIO(todos[1:])))), 6)
+
+    def test_xlsx_aplica_los_filtros(self):
+        respuesta = self.client.get('/filtros/exportar/', dict(self.filtros, formato='xlsx', comunas=['Bulnes']))
+        self.assertEqual(respuesta.status_code, 200)
+        libro = load_workbook(io.BytesIO(b''.join(respuesta.streaming_content)), read_only=True)
+        filas = list(libro.active.iter_rows(values_only=True))
+        self.assertEqual(list(filas[0]), ENCABEZADOS_EXPORTACION)
+        self.assertEqual([(fila[0], fila[6]) for fila in filas[1:]], [(self.incluidos[1], 'Bulnes')])
+
+    def test_lotes(self):
+        lotes = list(iterar_filas(comunas=['Chillán', 'Bulnes', 'Yungay'], tamano_lote=2))
+        self.assertEqual([len(lote) for lote in lotes], [2, 2, 1])
+        ids = [fila[0] for lote in lotes for fila in lote]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_errores(self):
+        self.assertEqual(self.client.get('/filtros/exportar/', {'formato': 'ods'}).status_code, 400)
+        with mock.patch('serviuapp.views.parquet_disponible', return_value=False):
+            self.assertEqual(self.client.get('/filtros/exportar/', {'formato': 'parquet'}).status_code, 501)
+        self.client.logout()
+        self.assertEqual(self.client.get('/filtros/exportar/').status_code, 302)
@@ -0,0 +1,250 @@
+"""
+Importaciones en segundo plano.
+
+Una importación subida desde la web no corre dentro de la petición (un
+archivo grande ocupaba un worker de gunicorn hasta el timeout): el archivo se
+guarda en SERVIU_IMPORTACIONES_DIR y se encola como una fila de
+trabajos_importacion. El comando procesar_importaciones, un proceso aparte
+sin broker externo (ver Procfile), toma los trabajos pendientes de a uno y los
+ejecuta con importador.importar_excel. Después de cada lote se guardan las
+filas que pasó cada etapa, los errores, las filas rechazadas y los mensajes
+del importador; las vistas de importación y de logs solo leen ese estado.
+"""
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import FilaRechazada, TrabajoImportacion
+from .opciones_importacion import CARGAS, MODOS
+
+logger = logging.getLogger(__name__)
+
+# Formatos que acepta la importación desde la web
+EXTENSIONES = ('.xlsx', '.xlsm', '.xls')
+
+# Segundos mínimos entre dos guardados del avance de un trabajo
+INTERVALO_AVANCE = 1.0
+
+# Filas rechazadas que se guardan por trabajo; las demás solo se cuentan
+MAXIMO_FILAS_RECHAZADAS = 10000
+
+# Un trabajo en curso sin avance durante este tiempo se da por perdido (su proceso murió)
+MINUTOS_SIN_AVANCE = 30
+
+# Segundos entre consultas de la cola cuando no hay trabajos pendientes
+ESPERA_COLA = 5
+
+# Contadores del importador que se guardan como resultado del trabajo
+CLAVES_RESULTADO = (
+    'filas_leidas', 'beneficiarios', 'decretos', 'resoluciones', 'cambios', 'nuevos',
+    'actualizados', 'sin_cambios', 'eliminados', 'errores', 'rechazos',
+)
+
+
+def directorio_importaciones():
+    return getattr(settings, 'SERVIU_IMPORTACIONES_DIR',
+                   os.path.join(settings.BASE_DIR, 'tmp', 'importaciones'))
+
+
+def encolar(archivo, modo='completo', carga='orm', usuario=''):
+    """Guarda un archivo subido y crea su trabajo pendiente.
+
+    Lanza ValueError si el modo, la carga o el formato no son válidos.
+    """
+    if modo not in MODOS:
+        raise ValueError(f'Modo de importación desconocido: {modo}')
+    if carga not in CARGAS:
+        raise ValueError(f'Carga desconocida: {carga}')
+    extension = os.path.splitext(archivo.name)[1].lower()
+    if extension not in EXTENSIONES:
+        raise ValueError('Formato de archivo no soportado: use .xlsx o .xls')
+
+    directorio = directorio_importaciones()
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f'{uuid.uuid4().hex}{extension}')
+    with open(ruta, 'wb') as destino:
+        for trozo in archivo.chunks():
+            destino.write(trozo)
+
+    return TrabajoImportacion.objects.create(
+        archivo=ruta, nombre_archivo=archivo.name[:255], modo=modo, carga=carga, usuario=usuario,
+    )
+
+
+class RegistroTrabajo(logging.Handler):
+    """Junta los mensajes del importador durante un trabajo"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        self.lineas = []
+
+    def emit(self, record):
+        self.lineas.append(self.format(record))
+
+    def texto(self):
+        return '\n'.join(self.lineas)
+
+
+class AvanceTrabajo:
+    """Función de avance para importar_excel: guarda en el trabajo el estado de cada lote.
+
+    Se llama desde el hilo escritor del pipeline, así que escribe con la
+    conexión de ese hilo. Las filas rechazadas se insertan en cada lote (hasta
+    MAXIMO_FILAS_RECHAZADAS); los contadores, a lo más cada INTERVALO_AVANCE.
+    """
+
+    def __init__(self, trabajo, registro):
+        self.trabajo_id = trabajo.pk
+        self.registro = registro
+        self.etapas = None
+        self.contadores = None
+        self.rechazadas = 0
+        self.guardadas = 0
+        self.ultimo_guardado = 0.0
+
+    def __call__(self, etapas, contadores, rechazadas):
+        self.etapas = etapas
+        self.contadores = contadores
+        if rechazadas:
+            self.rechazadas += len(rechazadas)
+            cupo = MAXIMO_FILAS_RECHAZADAS - self.guardadas
+            if cupo > 0:
+                FilaRechazada.objects.bulk_create([
+                    FilaRechazada(trabajo_id=self.trabajo_id, fila=fila, columna=columna,
+                                  valor=valor[:255], motivo=motivo)
+                    for fila, columna, valor, motivo in rechazadas[:cupo]
+                ])
+                self.guardadas += min(cupo, len(rechazadas))
+
+        ahora = time.monotonic()
+        if ahora - self.ultimo_guardado >= INTERVALO_AVANCE:
+            self.ultimo_guardado = ahora
+            self.guardar()
+
+    def guardar(self, **campos):
+        """Actualiza el avance del trabajo (y los `campos` adicionales) con un UPDATE"""
+        if self.etapas is not None:
+            lectura, limpieza, escritura = self.etapas
+            campos.update(
+                filas_leidas=lectura.filas, filas_limpias=limpieza.filas,
+                filas_escritas=escritura.filas, errores=self.contadores['errores'],
+            )
+        TrabajoImportacion.objects.filter(pk=self.trabajo_id).update(
+            filas_rechazadas=self.rechazadas, registro=self.registro.texto(),
+            actualizado=timezone.now(), **campos,
+        )
+
+
+def tomar_siguiente():
+    """Marca como en curso el trabajo pendiente más antiguo y lo devuelve (None si no hay).
+
+    El UPDATE condicionado al estado hace que, con varios procesos, cada
+    trabajo lo tome uno solo.
+    """
+    pendientes = TrabajoImportacion.objects.filter(estado=TrabajoImportacion.PENDIENTE).order_by('creado')
+    for trabajo in pendientes[:10]:
+        ahora = timezone.now()
+        tomado = TrabajoImportacion.objects.filter(pk=trabajo.pk, estado=TrabajoImportacion.PENDIENTE).update(
+            estado=TrabajoImportacion.EN_CURSO, iniciado=ahora, actualizado=ahora,
+        )
+        if tomado:
+            trabajo.refresh_from_db()
+            return trabajo
+    return None
+
+
+def marcar_perdidos():
+    """Da por fallidos los trabajos en curso que no avanzan hace MINUTOS_SIN_AVANCE"""
+    limite = timezone.now() - timedelta(minutes=MINUTOS_SIN_AVANCE)
+    return TrabajoImportacion.objects.filter(estado=TrabajoImportacion.EN_CURSO, actualizado__lt=limite).update(
+        estado=TrabajoImportacion.FALLIDO, terminado=timezone.now(),
+    )
+
+
+def _resultado(contadores):
+    if contadores is None:
+        return {}
+    return {clave: contadores[clave] for clave in CLAVES_RESULTADO}
+
+
+def ejecutar(trabajo):
+    """Ejecuta un trabajo ya tomado, guarda su resultado y borra el archivo subido"""
+    # El importador (pandas, numpy, openpyxl) solo se carga en el proceso que importa
+    from . import importador
+
+    registro = RegistroTrabajo()
+    avance = AvanceTrabajo(trabajo, registro)
+    importador.logger.addHandler(registro)
+    try:
+        try:
+            filas_totales = importador.contar_filas(trabajo.archivo)
+        except Exception:
+            filas_totales = None
+        TrabajoImportacion.objects.filter(pk=trabajo.pk).update(filas_totales=filas_totales)
+
+        exito = importador.importar_excel(
+            trabajo.archivo, carga=trabajo.carga, modo=trabajo.modo, avance=avance,
+        )
+    except Exception as e:
+        # importar_excel registra sus propios errores; esto cubre fallas fuera de él
+        importador.logger.error(f"Error crítico durante la importación: {e}")
+        exito = False
+    finally:
+        importador.logger.removeHandler(registro)
+
+    avance.guardar(
+        estado=TrabajoImportacion.TERMINADO if exito else TrabajoImportacion.FALLIDO,
+        terminado=timezone.now(), resultado=_resultado(avance.contadores),
+    )
+    try:
+        os.remove(trabajo.archivo)
+    except OSError:
+        pass
+    return exito
+
+
+def estado(trabajo):
+    """Avance de un trabajo para el endpoint JSON, con porcentaje y tiempo restante estimados"""
+    porcentaje = None
+    velocidad = None
+    restante = None
+    if trabajo.estado == TrabajoImportacion.TERMINADO:
+        porcentaje = 100
+    elif trabajo.filas_totales:
+        porcentaje = min(round(100 * trabajo.filas_escritas / trabajo.filas_totales, 1), 100)
+
+    if trabajo.estado == TrabajoImportacion.EN_CURSO and trabajo.iniciado and trabajo.filas_escritas:
+        transcurrido = (timezone.now() - trabajo.iniciado).total_seconds()
+        if transcurrido > 0:
+            velocidad = trabajo.filas_escritas / transcurrido
+            if trabajo.filas_totales:
+                restante = max(trabajo.filas_totales - trabajo.filas_escritas, 0) / velocidad
+
+    return {
+        'id': trabajo.pk,
+        'archivo': trabajo.nombre_archivo,
+        'modo': trabajo.modo,
+        'carga': trabajo.carga,
+        'estado': trabajo.estado,
+        'estado_display': trabajo.get_estado_display(),
+        'terminado': trabajo.estado in (TrabajoImportacion.TERMINADO, TrabajoImportacion.FALLIDO),
+        'creado': trabajo.creado.isoformat() if trabajo.creado else None,
+        'iniciado': trabajo.iniciado.isoformat() if trabajo.iniciado else None,
+        'fin': trabajo.terminado.isoformat() if trabajo.terminado else None,
+        'filas_totales': trabajo.filas_totales,
+        'filas_leidas': trabajo.filas_leidas,
+        'filas_limpias': trabajo.filas_limpias,
+        'filas_escritas': trabajo.filas_escritas,
+        'errores': trabajo.errores,
+        'filas_rechazadas': trabajo.filas_rechazadas,
+        'porcentaje': porcentaje,
+        'filas_por_segundo': round(velocidad) if velocidad else None,
+        'segundos_restantes': round(restante) if restante is not None else None,
+        'resultado': trabajo.resultado,
+    }
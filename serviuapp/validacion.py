@@ -0,0 +1,181 @@
+"""
+Reglas de validación del modo de prueba del importador (--dry-run).
+
+Cada regla es un predicado vectorizado sobre las columnas de un lote ya
+limpio (ver importador.limpiar_lote) que marca las filas que no la cumplen;
+no se recorre el lote fila por fila. Las pertenencias a un conjunto (comunas,
+provincias, catálogo de decretos) se evalúan sobre los valores distintos de
+la columna con pd.factorize, que en un lote son unos pocos, y se reparten a
+las filas por su código. Las claves se comparan con catalog.normalizar_clave,
+igual que el dashboard y los filtros.
+
+El resultado por regla es compacto: cuántas filas no la cumplen y una
+muestra de filas de Excel con sus valores (con varias fuentes, la fila y la
+fuente de la columna origen; ver importador.combinar_fuentes).
+"""
+import numpy as np
+import pandas as pd
+
+from .catalog import catalogo, normalizar_clave
+from .forms import FormBeneficiarios
+from .models import CambioBeneficiario
+from .rut import LARGO_MAXIMO_CUERPO
+
+# Filas de ejemplo por regla en el reporte
+MUESTRA_VALIDACION = 10
+
+COMUNAS = {normalizar_clave(valor) for valor, _ in FormBeneficiarios.COMUNA_CHOICES if valor}
+PROVINCIAS = {normalizar_clave(valor) for valor, _ in FormBeneficiarios.PROVINCIA_CHOICES if valor}
+
+# Separa decreto y tipología en la clave de los pares del catálogo
+SEPARADOR_PAR = '\x1f'
+PARES_CATALOGO = {
+    decreto.clave + SEPARADOR_PAR + tipologia.clave for decreto in catalogo for tipologia in decreto.tipologias
+}
+
+# Reglas: nombre -> (descripción, columnas que se muestran en el reporte)
+REGLAS = {
+    'rut_vacio': ("RUT vacío", ('rut',)),
+    'rut_invalido': (f"RUT sin un cuerpo numérico de 1 a {LARGO_MAXIMO_CUERPO} dígitos", ('rut',)),
+    'dv_faltante': ("RUT sin dígito verificador (ni en el RUT ni en la columna dv)", ('rut', 'dv')),
+    'dv_incorrecto': ("dígito verificador distinto del calculado por módulo 11", ('rut', 'dv')),
+    'comuna_desconocida': ("comuna vacía o fuera de FormBeneficiarios.COMUNA_CHOICES", ('comuna',)),
+    'provincia_desconocida': ("provincia vacía o fuera de FormBeneficiarios.PROVINCIA_CHOICES", ('provincia',)),
+    'decreto_desconocido': ("decreto que no está en el catálogo", ('decreto',)),
+    'tipologia_desconocida': ("tipología que no existe para su decreto en el catálogo", ('decreto', 'tipologia')),
+    'rut_nuevo_invalido': ("reemplazo o sustitución sin un RUT nuevo válido (RUT_NUEVO_BENEFICIARIO y DV2), "
+                           "o RUT nuevo inválido", ('tipo_cambio', 'rut_nuevo', 'dv_nuevo')),
+}
+
+# Tipos de cambio que deben traer el RUT del beneficiario nuevo
+TIPOS_CON_RUT_NUEVO = [CambioBeneficiario.REEMPLAZO, CambioBeneficiario.SUSTITUCION]
+
+# Factor de cada dígito de un cuerpo de 8 dígitos en el módulo 11 (2 a 7 desde la derecha)
+FACTORES_DV = np.array([3, 2, 7, 6, 5, 4, 3, 2])
+
+# Dígito verificador según 11 - suma % 11 (de 1 a 11)
+DV_POR_RESTO = np.array(['', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'K', '0'])
+
+
+def clave_par(par):
+    """Clave normalizada de 'decreto SEPARADOR_PAR tipología'"""
+    return SEPARADOR_PAR.join(normalizar_clave(parte) for parte in par.split(SEPARADOR_PAR))
+
+
+def pertenece(serie, conjunto, clave=normalizar_clave):
+    """Máscara de las filas cuya clave está en `conjunto`, calculando la clave solo de los valores distintos"""
+    codigos, unicos = pd.factorize(serie)
+    if not len(unicos):
+        return pd.Series(False, index=serie.index)
+    validos = np.array([clave(valor) in conjunto for valor in unicos])
+    return pd.Series(np.where(codigos >= 0, validos[codigos], False), index=serie.index)
+
+
+def calcular_dvs(cuerpos):
+    """rut.calcular_dv de una Serie de cuerpos numéricos (texto de 1 a 8 dígitos), sin recorrerla en Python"""
+    if cuerpos.empty:
+        return pd.Series([], index=cuerpos.index, dtype=object)
+    rellenos = ''.join(cuerpos.str.zfill(LARGO_MAXIMO_CUERPO)).encode('ascii')
+    digitos = np.frombuffer(rellenos, dtype=np.uint8).reshape(-1, LARGO_MAXIMO_CUERPO) - ord('0')
+    resto = 11 - (digitos @ FACTORES_DV) % 11
+    return pd.Series(DV_POR_RESTO[resto], index=cuerpos.index, dtype=object)
+
+
+def partes_rut(ruts):
+    """(cuerpo, dv escrito en el RUT) de cada RUT de la Serie, con el mismo criterio que rut.separar_rut"""
+    texto = ruts.str.replace(r'[\s.]', '', regex=True).str.upper().str.lstrip('0')
+    con_guion = texto.str.contains('-', regex=False)
+    separado = texto.str.rpartition('-')
+    # Sin guion, la última letra es el DV si es K o si el texto es más largo que un cuerpo
+    dv_al_final = ~con_guion & (texto.str.endswith('K') | (texto.str.len() > LARGO_MAXIMO_CUERPO))
+    cuerpo = texto.where(~con_guion, separado[0]).where(~dv_al_final, texto.str[:-1]).str.lstrip('0')
+    dv = pd.Series('', index=texto.index).where(~con_guion, separado[2]).where(~dv_al_final, texto.str[-1:])
+    return cuerpo, dv
+
+
+def cuerpo_numerico(cuerpo):
+    """Máscara de los cuerpos de 1 a LARGO_MAXIMO_CUERPO dígitos"""
+    return cuerpo.str.fullmatch(rf'[0-9]{{1,{LARGO_MAXIMO_CUERPO}}}').fillna(False).astype(bool)
+
+
+def normalizar_ruts(ruts, dvs):
+    """rut.normalizar_rut de cada par (RUT, columna dv) de las Series: 'cuerpo-DV' o None.
+
+    Como en normalizar_rut, el RUT es inválido si el cuerpo no es numérico o si
+    el DV escrito en el RUT o en la columna dv no coincide con el calculado.
+    """
+    cuerpo, dv_rut = partes_rut(ruts)
+    numerico = cuerpo_numerico(cuerpo)
+    calculado = calcular_dvs(cuerpo[numerico]).reindex(ruts.index, fill_value='')
+    dv_columna = dvs.str.strip().str.upper()
+    valido = numerico & ((dv_rut == '') | (dv_rut == calculado)) & ((dv_columna == '') | (dv_columna == calculado))
+    return pd.Series(np.where(valido, cuerpo + '-' + calculado, None), index=ruts.index, dtype=object)
+
+
+def evaluar(limpio):
+    """{regla: máscara de las filas del lote que no la cumplen}"""
+    fallas = {}
+
+    vacio = limpio['rut'].str.strip() == ''
+    cuerpo, dv_rut = partes_rut(limpio['rut'])
+    numerico = cuerpo_numerico(cuerpo)
+    fallas['rut_vacio'] = vacio
+    fallas['rut_invalido'] = ~vacio & ~numerico
+
+    calculado = calcular_dvs(cuerpo[numerico]).reindex(limpio.index, fill_value='')
+    dv_columna = limpio['dv'].str.strip().str.upper()
+    fallas['dv_faltante'] = numerico & (dv_rut == '') & (dv_columna == '')
+    fallas['dv_incorrecto'] = numerico & (
+        ((dv_rut != '') & (dv_rut != calculado)) | ((dv_columna != '') & (dv_columna != calculado))
+    )
+
+    fallas['comuna_desconocida'] = ~pertenece(limpio['comuna'], COMUNAS)
+    fallas['provincia_desconocida'] = ~pertenece(limpio['provincia'], PROVINCIAS)
+
+    con_decreto = limpio['decreto'] != ''
+    decreto_conocido = pertenece(limpio['decreto'], catalogo.decretos)
+    fallas['decreto_desconocido'] = con_decreto & ~decreto_conocido
+    pares = limpio['decreto'] + SEPARADOR_PAR + limpio['tipologia']
+    fallas['tipologia_desconocida'] = (
+        decreto_conocido & (limpio['tipologia'] != '') & ~pertenece(pares, PARES_CATALOGO, clave_par)
+    )
+
+    con_rut_nuevo = limpio['tipo_cambio'].isin(TIPOS_CON_RUT_NUEVO) | (limpio['rut_nuevo'] != '')
+    fallas['rut_nuevo_invalido'] = con_rut_nuevo & limpio['rut_nuevo_normalizado'].isna()
+    return fallas
+
+
+def acumular(limpio, resultado):
+    """Evalúa las reglas sobre un lote y suma sus fallas a `resultado` ({regla: {'filas', 'muestra'}})"""
+    for regla, mascara in evaluar(limpio).items():
+        cantidad = int(mascara.sum())
+        if not cantidad:
+            continue
+        entrada = resultado.setdefault(regla, {'filas': 0, 'muestra': []})
+        entrada['filas'] += cantidad
+        faltan = MUESTRA_VALIDACION - len(entrada['muestra'])
+        if faltan > 0:
+            columnas = list(REGLAS[regla][1])
+            muestra = limpio.loc[mascara, columnas].head(faltan)
+            if 'origen' in limpio.columns:
+                etiquetas = limpio.loc[muestra.index, 'origen']
+            else:
+                # Fila de Excel = índice + 2 (encabezado y base 1)
+                etiquetas = [f'fila {indice + 2}' for indice in muestra.index]
+            entrada['muestra'].extend(
+                (etiqueta, ' / '.join(f'{columna}={valor!r}' for columna, valor in zip(columnas, valores)))
+                for etiqueta, valores in zip(etiquetas, muestra.itertuples(index=False))
+            )
+    return resultado
+
+
+def reporte(resultado):
+    """Líneas del reporte compacto: una por regla con fallas y su muestra"""
+    lineas = []
+    for regla, (descripcion, _) in REGLAS.items():
+        if regla not in resultado:
+            continue
+        entrada = resultado[regla]
+        lineas.append(f"{regla}: {entrada['filas']} filas ({descripcion})")
+        lineas.extend(f"    {etiqueta}: {valores}" for etiqueta, valores in entrada['muestra'])
+    return lineas
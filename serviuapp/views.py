@@ -1,349 +1,121 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from tablib import Dataset
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from import_export import resources
-from django.db import connection
-from django.core.paginator import Paginator
+from django.template.loader import render_to_string
 from serviuapp.forms import FormBeneficiarios, FormDecretos, FormResoluciones
-from serviuapp.models import Beneficiarios, Resoluciones, Decretos, ChatInteraction
+from serviuapp.models import Beneficiarios, Resoluciones, Decretos, ChatInteraction, TrabajoImportacion
 from django.urls import reverse
-from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, etag
+from django.views.decorators.cache import cache_control
 from django.views import View
 from django.utils import timezone
 from .nlp_utils import nlp_analyzer
+from .aggregations import contar_por_decreto, obtener_decretos, obtener_filtros
+from .cache_utils import clave_cache
+from .cambios import buscar_cambios, contar_cambios
+from .catalog import catalogo
+from .exportacion import FORMATOS, exportar_csv, exportar_parquet, exportar_xlsx, parquet_disponible
+from .paginacion import (
+    COLUMNAS_DETALLE, COLUMNAS_TABLA, contar_filas, iterar_lotes, leer_cursor, leer_por_pagina,
+    obtener_pagina, pagina_tabla,
+)
+from .resumen import registrar_cambios
+from .opciones_importacion import CARGAS, MODOS
+from .rut import buscar_rut, normalizar_rut
+from .trabajos import encolar, estado as estado_trabajo
+from .busqueda_masiva import (
+    ENCABEZADOS, ESTADO_ENCONTRADO, MAXIMO_RUTS, generar_xlsx, leer_ruts_archivo, leer_ruts_texto, lotes_resultado,
+)
 import os
 import re
 import json
 import requests
 
 
-def limpiar_logs(request, log_filename='app.log'):
-    log_file_path = os.path.join(settings.BASE_DIR, 'logs', log_filename)
-    
-    # Limpia el contenido del archivo de logs
-    with open(log_file_path, 'w'):
-        pass  # Esto borra el contenido del archivo de logs
-
-    # Redirige a la página de importación de beneficiarios
-    return redirect('../admin/serviuapp/beneficiarios/import/')
-
-def logs_view(request, log_filename='app.log'):
-    log_file_path = os.path.join(settings.BASE_DIR, 'logs', log_filename)
+@staff_member_required
+def importar(request):
+    """Sube un archivo y encola su importación; el avance se consulta en importacion_progreso"""
+    if request.method != 'POST':
+        context = {
+            'modos': MODOS,
+            'cargas': sorted(CARGAS),
+            'trabajos': TrabajoImportacion.objects.all()[:10],
+        }
+        return render(request, 'serviutemplate/import.html', context)
 
+    archivo = request.FILES.get('file')
+    if archivo is None:
+        return JsonResponse({'error': 'Seleccione un archivo'}, status=400)
     try:
-        with open(log_file_path, 'r') as log_file:
-            log_content = log_file.readlines()  # Leemos líneas en lugar de todo el contenido como una cadena
-    except FileNotFoundError:
-        log_content = ['El archivo de logs no se encontró.']
-
-    return render(request, 'serviutemplate/logs.html', {'log_content': log_content})
-
-
-def dashboard(request):
-    # Procesar filtros
-    comunas_filtro = request.GET.getlist('comunas')
-    provincias_filtro = request.GET.getlist('provincias')
-    ano_imputacion_filtro = request.GET.getlist('ano_imputacion')
-
-    base_query = """
-        SELECT * FROM beneficiarios b 
-        LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario 
-        LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
-    """
-    filters = []
-    params = []
-
-    if comunas_filtro:
-        filters.append("b.comuna IN ({})".format(','.join(['%s'] * len(comunas_filtro))))
-        params.extend(comunas_filtro)
-
-    if provincias_filtro:
-        filters.append("b.provincia IN ({})".format(','.join(['%s'] * len(provincias_filtro))))
-        params.extend(provincias_filtro)
-        
-    if ano_imputacion_filtro:
-        filters.append("r.ano_imputacion_res_of IN ({})".format(','.join(['%s'] * len(ano_imputacion_filtro))))
-        params.extend(ano_imputacion_filtro)
-
-    # Construir la consulta SQL con o sin filtros
-    if filters:
-        filter_sql = " WHERE " + " AND ".join(filters)
-    else:
-        filter_sql = ""
-
-    with connection.cursor() as cursor:
-        ##### CONSULTAS DS1 #####
-        # Arriendo Glosa 03
-        ag_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'arriendo glosa 03' AND decreto = 'DS-1'"
-        cursor.execute(ag_ds1_query, params)
-        ag_ds1 = cursor.fetchone()[0]
-
-        # AVC
-        avc_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'avc' AND decreto = 'DS-1'"
-        cursor.execute(avc_ds1_query, params)
-        avc_ds1 = cursor.fetchone()[0]
-        
-        # CSP
-        csp_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-1'"
-        cursor.execute(csp_ds1_query, params)
-        csp_ds1 = cursor.fetchone()[0]
-        
-        # Blancos
-        blanco_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-1'"
-        cursor.execute(blanco_ds1_query, params)
-        blanco_ds1 = cursor.fetchone()[0]
-
-        total_count_ds1 = ag_ds1 + avc_ds1 + csp_ds1 + blanco_ds1
-
-
-
-
-
-        ##### CONSULTAS DS10 #####
-        # CCH
-        cch_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CCH' AND decreto = 'DS-10'"
-        cursor.execute(cch_ds10_query, params)
-        cch_ds10 = cursor.fetchone()[0]
-
-        # CSR
-        csr_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSR' AND decreto = 'DS-10'"
-        cursor.execute(csr_ds10_query, params)
-        csr_ds10 = cursor.fetchone()[0]
-
-        # MAVE
-        mave_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'MAVE' AND decreto = 'DS-10'"
-        cursor.execute(mave_ds10_query, params)
-        mave_ds10 = cursor.fetchone()[0]
-
-        # Blancos DS-10
-        blanco_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-10'"
-        cursor.execute(blanco_ds10_query, params)
-        blanco_ds10 = cursor.fetchone()[0]
-        total_count_ds10 = cch_ds10 + csr_ds10 + mave_ds10 + blanco_ds10
-
-        ##### CONSULTAS DS19 #####
-        # PIST
-        pist_ds19_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'PIST' AND decreto = 'DS-19'"
-        cursor.execute(pist_ds19_query, params)
-        pist_ds19 = cursor.fetchone()[0]
-
-        # Blancos DS-19
-        blanco_ds19_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-19'"
-        cursor.execute(blanco_ds19_query, params)
-        blanco_ds19 = cursor.fetchone()[0]
-
-        total_count_ds19 = pist_ds19 + blanco_ds19
-
-        ##### CONSULTAS DS27 #####
-        # CAP I
-        cap1_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP I' AND decreto = 'DS-27'"
-        cursor.execute(cap1_ds27_query, params)
-        cap1_ds27 = cursor.fetchone()[0]
-
-        # CAP II
-        cap2_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP II' AND decreto = 'DS-27'"
-        cursor.execute(cap2_ds27_query, params)
-        cap2_ds27 = cursor.fetchone()[0]
-
-        # CAP III
-        cap3_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP III' AND decreto = 'DS-27'"
-        cursor.execute(cap3_ds27_query, params)
-        cap3_ds27 = cursor.fetchone()[0]
-
-        # Blancos DS-27
-        blanco_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-27'"
-        cursor.execute(blanco_ds27_query, params)
-        blanco_ds27 = cursor.fetchone()[0]
-
-        total_count_ds27 = cap1_ds27 + cap2_ds27 + cap3_ds27 + blanco_ds27
-
-
-
-
-
-        ##### CONSULTAS DS49 #####
-        # AVC
-        avc_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-49'"
-        cursor.execute(avc_ds49_query, params)
-        avc_ds49 = cursor.fetchone()[0]
-
-        # CNT
-        cnt_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT' AND decreto = 'DS-49'"
-        cursor.execute(cnt_ds49_query, params)
-        cnt_ds49 = cursor.fetchone()[0]
-
-        # CNT INDUST
-        cnti_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT INDUST' AND decreto = 'DS-49'"
-        cursor.execute(cnti_ds49_query, params)
-        cnti_ds49 = cursor.fetchone()[0]
-
-        # CSP
-        csp_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-49'"
-        cursor.execute(csp_ds49_query, params)
-        csp_ds49 = cursor.fetchone()[0]
-
-        # Blancos DS-49
-        blanco_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-49'"
-        cursor.execute(blanco_ds49_query, params)
-        blanco_ds49 = cursor.fetchone()[0]
-
-        total_count_ds49 = avc_ds49 + cnt_ds49 + cnti_ds49 + csp_ds49 + blanco_ds49
-
-        ##### CONSULTAS DS52 #####
-        # ARRIENDO
-        arriendo_ds52_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'ARRIENDO' AND decreto = 'DS-52'"
-        cursor.execute(arriendo_ds52_query, params)
-        arriendo_ds52 = cursor.fetchone()[0]
-
-        # Blancos DS-52
-        blanco_ds52_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-52'"
-        cursor.execute(blanco_ds52_query, params)
-        blanco_ds52 = cursor.fetchone()[0]
-
-        total_count_ds52 = arriendo_ds52 + blanco_ds52
-
-
-
-
-
-        ##### CONSULTAS DS255 #####
-        # CALEFACTOR
-        calefactor_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CALEFACTOR' AND decreto = 'DS-255'"
-        cursor.execute(calefactor_ds255_query, params)
-        calefactor_ds255 = cursor.fetchone()[0]
-
-        # CC.SS
-        ccss_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CC.SS' AND decreto = 'DS-255'"
-        cursor.execute(ccss_ds255_query, params)
-        ccss_ds255 = cursor.fetchone()[0]
-        
-        # COLECTOR
-        colector_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'colector' AND decreto = 'DS-255'"
-        cursor.execute(colector_ds255_query, params)
-        colector_ds255 = cursor.fetchone()[0]
-
-        # FOTOVOLTAICO
-        fotov_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'FOTOVOLTAICO' AND decreto = 'DS-255'"
-        cursor.execute(fotov_ds255_query, params)
-        fotov_ds255 = cursor.fetchone()[0]
-
-        # MEJORAMIENTO
-        mejoramiento_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'MEJORAMIENTO' AND decreto = 'DS-255'"
-        cursor.execute(mejoramiento_ds255_query, params)
-        mejoramiento_ds255 = cursor.fetchone()[0]
-
-        # PDA
-        pda_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'PDA' AND decreto = 'DS-255'"
-        cursor.execute(pda_ds255_query, params)
-        pda_ds255 = cursor.fetchone()[0]
-
-        # TBM
-        tbm_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TBM' AND decreto = 'DS-255'"
-        cursor.execute(tbm_ds255_query, params)
-        tbm_ds255 = cursor.fetchone()[0]
+        trabajo = encolar(
+            archivo, modo=request.POST.get('modo', 'completo'), carga=request.POST.get('carga', 'orm'),
+            usuario=request.user.get_username(),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-        # TÉRMICO
-        termico_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TÉRMICO' AND decreto = 'DS-255'"
-        cursor.execute(termico_ds255_query, params)
-        termico_ds255 = cursor.fetchone()[0]
+    return JsonResponse({
+        'id': trabajo.pk,
+        'progreso': reverse('importacion_progreso', args=[trabajo.pk]),
+        'resultados': reverse('resultados_importacion', args=[trabajo.pk]),
+    }, status=202)
 
-        # TÉRMICO PDA
-        termicopda_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TÉRMICO PDA' AND decreto = 'DS-255'"
-        cursor.execute(termicopda_ds255_query, params)
-        termicopda_ds255 = cursor.fetchone()[0]
 
-        # Blancos DS-255
-        blanco_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-255'"
-        cursor.execute(blanco_ds255_query, params)
-        blanco_ds255 = cursor.fetchone()[0]
+@staff_member_required
+def importacion_progreso(request, id_trabajo):
+    trabajo = get_object_or_404(TrabajoImportacion, pk=id_trabajo)
+    return JsonResponse(estado_trabajo(trabajo))
 
-        total_count_ds255 = calefactor_ds255 + ccss_ds255 + colector_ds255 + fotov_ds255 + mejoramiento_ds255 + pda_ds255 + tbm_ds255 + termico_ds255 + termicopda_ds255 + blanco_ds255
 
-        ##### CONSULTAS LEASING (DS-120) #####
-        # AVC
-        avc_leasing_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-120'"
-        cursor.execute(avc_leasing_query, params)
-        avc_leasing = cursor.fetchone()[0]
+@staff_member_required
+def limpiar_logs(request):
+    # Elimina los trabajos terminados con sus registros y filas rechazadas
+    TrabajoImportacion.objects.filter(
+        estado__in=[TrabajoImportacion.TERMINADO, TrabajoImportacion.FALLIDO]
+    ).delete()
+    return redirect('logs_view')
 
 
+@staff_member_required
+def logs_view(request, id_trabajo=None):
+    """Importaciones recientes o, con id_trabajo, el registro y las filas rechazadas de una"""
+    if id_trabajo is None:
+        trabajos = TrabajoImportacion.objects.defer('registro')[:50]
+        return render(request, 'serviutemplate/logs.html', {'trabajos': trabajos})
 
+    trabajo = get_object_or_404(TrabajoImportacion, pk=id_trabajo)
+    paginator = Paginator(trabajo.rechazadas.all(), 100)
+    return render(request, 'serviutemplate/logs.html', {
+        'trabajo': trabajo,
+        'estado': estado_trabajo(trabajo),
+        'registro': trabajo.registro.splitlines(),
+        'rechazadas': paginator.get_page(request.GET.get('page')),
+    })
 
 
-    
-# Pasar los datos al contexto de la plantilla
-    context = {
-        # DETALLE DS-1
-        'ag_ds1': ag_ds1,
-        'avc_ds1': avc_ds1,
-        'csp_ds1': csp_ds1,
-        'blanco_ds1': blanco_ds1,
-        'total_count_ds1': total_count_ds1,
+def dashboard(request):
+    # Procesar filtros
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
 
-        
-        # DETALLE DS-10
-        'cch_ds10': cch_ds10,
-        'csr_ds10': csr_ds10,
-        'mave_ds10': mave_ds10,
-        'blanco_ds10': blanco_ds10,  
-        'total_count_ds10': total_count_ds10,
-
-
-        # DETALLE DS-19
-        'pist_ds19': pist_ds19,
-        'blanco_ds19': blanco_ds19,
-        'total_count_ds19':total_count_ds19,  
-
-        # DETALLE DS-27
-        'cap1_ds27': cap1_ds27,
-        'cap2_ds27': cap2_ds27,
-        'cap3_ds27': cap3_ds27,
-        'blanco_ds27': blanco_ds27, 
-        'total_count_ds27': total_count_ds27,
-
-
-        # DETALLE DS-49
-        'avc_ds49': avc_ds49,
-        'cnt_ds49': cnt_ds49,
-        'cnti_ds49': cnti_ds49,
-        'csp_ds49': csp_ds49,
-        'blanco_ds49': blanco_ds49,  
-        'total_count_ds49': total_count_ds49,
-
-
-        # DETALLE DS-52
-        'arriendo_ds52': arriendo_ds52,
-        'blanco_ds52': blanco_ds52,
-        'total_count_ds52': total_count_ds52,
-    
+    # Todos los conteos del catálogo decreto × tipología en una sola consulta
+    conteos = contar_por_decreto(comunas_filtro, provincias_filtro, ano_imputacion_filtro)
 
-        # DETALLE DS-255
-        'calefactor_ds255': calefactor_ds255,
-        'ccss_ds255': ccss_ds255,
-        'colector_ds255': colector_ds255,
-        'fotov_ds255': fotov_ds255,
-        'mejoramiento_ds255': mejoramiento_ds255,
-        'pda_ds255': pda_ds255,
-        'tbm_ds255': tbm_ds255,
-        'termico_ds255': termico_ds255,
-        'termicopda_ds255': termicopda_ds255,
-        'blanco_ds255': blanco_ds255,  
-        'total_count_ds255': total_count_ds255,
-
-
-        # DETALLE LEASING
-        'avc_leasing': avc_leasing,
-        
+    # Pasar los datos al contexto de la plantilla
+    context = conteos.contexto('dashboard')
+    context.update({
+        # Reemplazos, renuncias, etc. por tipo (ver serviuapp.cambios)
+        'cambios': contar_cambios(comunas_filtro, provincias_filtro, ano_imputacion_filtro),
         # FILTROS SELECCIONADOS
         'selected_comunas': comunas_filtro,
         'selected_provincias': provincias_filtro,
         'selected_anos': ano_imputacion_filtro,
-    
-    }
+    })
 
-    
     return render(request, 'serviutemplate/dashboard.html', context)
 
 
@@ -351,286 +123,71 @@ def dashboard(request):
 
 
 def filtros(request):
-    comunas_filtro = request.GET.getlist('comunas')
-    provincias_filtro = request.GET.getlist('provincias')
-    ano_imputacion_filtro = request.GET.getlist('ano_imputacion')
-
-    base_query = """
-        SELECT * FROM beneficiarios b 
-        LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario 
-        LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
-    """
-    filters = []
-    params = []
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
 
-    if comunas_filtro:
-        filters.append("b.comuna IN ({})".format(','.join(['%s'] * len(comunas_filtro))))
-        params.extend(comunas_filtro)
+    # Solo agregados: la tabla de detalle se carga aparte desde filtros_detalle
+    conteos = contar_por_decreto(comunas_filtro, provincias_filtro, ano_imputacion_filtro)
 
-    if provincias_filtro:
-        filters.append("b.provincia IN ({})".format(','.join(['%s'] * len(provincias_filtro))))
-        params.extend(provincias_filtro)
-        
-    if ano_imputacion_filtro:
-        filters.append("r.ano_imputacion_res_of IN ({})".format(','.join(['%s'] * len(ano_imputacion_filtro))))
-        params.extend(ano_imputacion_filtro)
-
-    # Construir la consulta SQL con o sin filtros
-    if filters:
-        filter_sql = " WHERE " + " AND ".join(filters)
-        sql_query = base_query + filter_sql
-    else:
-        filter_sql = ""
-        sql_query = base_query
+    context = conteos.contexto('filtros')
+    context.update({
+        'total_filas': contar_filas(comunas_filtro, provincias_filtro, ano_imputacion_filtro),
+        'comunas_filtro': comunas_filtro,
+        'provincias_filtro': provincias_filtro,
         
-    #CONSULTAS DS-1
-    ds1_avc_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-1'"
-    ds1_arriendog3_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'ARRIENDO GLOSA 03' AND decreto = 'DS-1'"
-    ds1_csp_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-1'"
-    
-    
-    
-    
-    #CONSULTAS DS-10
-    ds10_cch_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CCH' AND decreto = 'DS-10'"
-    ds10_csr_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSR' AND decreto = 'DS-10'"
-    ds10_mave_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'MAVE' AND decreto = 'DS-10'"
-    
-    
-    
-    
-    #CONSULTAS DS-19
-    ds19_pist_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'PIST' AND decreto = 'DS-19'"
-    
-    
-    
-    #CONSULTAS DS-27
-    ds27_cap1_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP I' AND decreto = 'DS-27'"
-    ds27_cap2_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP II' AND decreto = 'DS-27'"
-    ds27_cap3_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP III' AND decreto = 'DS-27'"
-    
-    
-    
-    
-    #CONSULTAS DS-49
-    ds49_avc_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-49'"
-    ds49_cnt_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT' AND decreto = 'DS-49'"
-    ds49_cnti_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT INDUST' AND decreto = 'DS-49'"
-    ds49_csp_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-49'"
-    
-    
-    
-    
-    #CONSULTAS DS-52
-    ds52_arriendo_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'ARRIENDO' AND decreto = 'DS-52'"
-    
-    
-    
-    #CONSULTAS DS-255
-    ds255_calefactor_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CALEFACTOR' AND decreto = 'DS-255'"
-    ds255_ccss_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CC.SS' AND decreto = 'DS-255'"
-    ds255_colector_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'COLECTOR' AND decreto = 'DS-255'"
-    ds255_fotov_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'FOTOVOLTAICO' AND decreto = 'DS-255'"
-    ds255_mejoramiento_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'MEJORAMIENTO' AND decreto = 'DS-255'"
-    ds255_pda_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'PDA' AND decreto = 'DS-255'"
-    ds255_tbm_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TBM' AND decreto = 'DS-255'"
-    ds255_termico_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TERMICO' AND decreto = 'DS-255'"
-    ds255_termicopda_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'TÉRMICO PDA' AND decreto = 'DS-255'"
+        # Variables para checkboxes
+        'selected_comunas': comunas_filtro,
+        'selected_provincias': provincias_filtro,
+        'selected_anos': ano_imputacion_filtro,
 
-    
-    
-    
-    #CONSULTAS LEASING
-    ls_avc_count_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-120'"
+        # Exportación del detalle (ver filtros_exportar)
+        'decretos_catalogo': catalogo.codigos,
+        'exportar_parquet': parquet_disponible(),
+    })
 
-    with connection.cursor() as cursor:
-        
-        cursor.execute(sql_query, params)
-        rows = cursor.fetchall()
+    return render(request, 'serviutemplate/filtros.html', context)
 
-        # Obtener los nombres de las columnas
-        column_names = [col[0] for col in cursor.description]
 
+def filtros_detalle(request):
+    """Página de la tabla de detalle de filtros en JSON (keyset con ?despues=<id>)"""
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
 
+    filas, siguiente = pagina_tabla(
+        comunas_filtro, provincias_filtro, ano_imputacion_filtro,
+        despues=leer_cursor(request.GET.get('despues')),
+    )
 
+    return JsonResponse({
+        'columnas': [nombre for nombre, _ in COLUMNAS_TABLA],
+        'filas': filas,
+        'siguiente': siguiente,
+    })
 
-        # EJECUCION DE CONSULTAS COUNT DS-1
-        cursor.execute(ds1_avc_count_query, params)
-        ds1_avc_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds1_arriendog3_count_query, params)
-        ds1_arriendog3_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds1_csp_count_query, params)
-        ds1_csp_total_count = cursor.fetchone()[0]
-        
-        ds1_total = ds1_avc_total_count + ds1_arriendog3_total_count + ds1_csp_total_count
-        
-        
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-10
-        cursor.execute(ds10_cch_count_query, params)
-        ds10_cch_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds10_csr_count_query, params)
-        ds10_csr_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds10_mave_count_query, params)
-        ds10_mave_total_count = cursor.fetchone()[0]
-        
-        ds10_total = ds10_cch_total_count + ds10_csr_total_count + ds10_mave_total_count
-        
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-19
-        cursor.execute(ds19_pist_count_query, params)
-        ds19_pist_total_count = cursor.fetchone()[0]
-        
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-27
-        cursor.execute(ds27_cap1_count_query, params)
-        ds27_cap1_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds27_cap2_count_query, params)
-        ds27_cap2_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds27_cap3_count_query, params)
-        ds27_cap3_total_count = cursor.fetchone()[0]
-        
-        ds27_total = ds27_cap1_total_count + ds27_cap2_total_count + ds27_cap3_total_count
-        
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-49
-        cursor.execute(ds49_avc_count_query, params)
-        ds49_avc_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds49_cnt_count_query, params)
-        ds49_cnt_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds49_cnti_count_query, params)
-        ds49_cnti_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds49_csp_count_query, params)
-        ds49_csp_total_count = cursor.fetchone()[0]
-        
-        ds49_total = ds49_avc_total_count + ds49_cnt_total_count + ds49_cnti_total_count + ds49_csp_total_count
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-52
-        cursor.execute(ds52_arriendo_count_query, params)
-        ds52_arriendo_total_count = cursor.fetchone()[0]
-        
-        
-        
-        # EJECUCION DE CONSULTAS COUNT DS-255
-        cursor.execute(ds255_calefactor_count_query, params)
-        ds255_calefactor_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_ccss_count_query, params)
-        ds255_ccss_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_colector_count_query, params)
-        ds255_colector_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_fotov_count_query, params)
-        ds255_fotov_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_mejoramiento_count_query, params)
-        ds255_mejoramiento_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_pda_count_query, params)
-        ds255_pda_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_tbm_count_query, params)
-        ds255_tbm_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_termico_count_query, params)
-        ds255_termico_total_count = cursor.fetchone()[0]
-        
-        cursor.execute(ds255_termicopda_count_query, params)
-        ds255_termicopda_total_count = cursor.fetchone()[0]
-        
-        ds255_total = ds255_calefactor_total_count + ds255_ccss_total_count + ds255_colector_total_count + ds255_fotov_total_count + ds255_mejoramiento_total_count + ds255_pda_total_count + ds255_tbm_total_count + ds255_termico_total_count + ds255_termicopda_total_count
-        
-        
-        
-        # EJECUCION DE CONSULTAS LEASING
-        cursor.execute(ls_avc_count_query, params)
-        ls_avc_total_count = cursor.fetchone()[0]
-        
-        
 
+@login_required
+def filtros_exportar(request):
+    """Detalle de filtros completo para descargar: ?formato=csv (por defecto), xlsx o parquet.
 
+    Acepta los mismos filtros que filtros más ?decretos=; el CSV se envía
+    en streaming y XLSX/Parquet desde un archivo temporal (ver serviuapp.exportacion).
+    """
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
+    filtros_exportacion = (comunas_filtro, provincias_filtro, ano_imputacion_filtro, obtener_decretos(request))
 
-    datos = [dict(zip(column_names, row)) for row in rows]
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        return JsonResponse({'error': f'Formato no soportado: use {", ".join(FORMATOS)}'}, status=400)
+    if formato == 'parquet' and not parquet_disponible():
+        return JsonResponse({'error': 'La exportación Parquet requiere pyarrow (pip install pyarrow)'}, status=501)
 
-    context = {
-        'datos': datos,
-        'comunas_filtro': comunas_filtro,
-        'provincias_filtro': provincias_filtro,
-        
-        #DETALLE DS-1
-        'ds1_arriendog3_total_count': ds1_arriendog3_total_count,
-        'ds1_avc_total_count': ds1_avc_total_count,
-        'ds1_csp_total_count': ds1_csp_total_count,
-        'ds1_total': ds1_total,
-        
-        #DETALLE DS-10
-        'ds10_cch_total_count': ds10_cch_total_count,
-        'ds10_csr_total_count': ds10_csr_total_count,
-        'ds10_mave_total_count': ds10_mave_total_count,
-        'ds10_total': ds10_total,
-        
-        #DETALLE DS-19
-        'ds19_pist_total_count': ds19_pist_total_count,
-        
-        #DETALLE DS-27
-        'ds27_cap1_total_count': ds27_cap1_total_count,
-        'ds27_cap2_total_count': ds27_cap2_total_count,
-        'ds27_cap3_total_count': ds27_cap3_total_count,
-        'ds27_total': ds27_total,
-        
-        #DETALLE DS-49
-        'ds49_avc_total_count': ds49_avc_total_count,
-        'ds49_cnt_total_count': ds49_cnt_total_count,
-        'ds49_cnti_total_count': ds49_cnti_total_count,
-        'ds49_csp_total_count': ds49_csp_total_count,
-        'ds49_total': ds49_total,
-        
-        #DETALLE DS-52
-        'ds52_arriendo_total_count': ds52_arriendo_total_count,
-        
-        #DETALLE DS-255
-        'ds255_calefactor_total_count': ds255_calefactor_total_count,
-        'ds255_ccss_total_count': ds255_ccss_total_count,
-        'ds255_colector_total_count': ds255_colector_total_count,
-        'ds255_fotov_total_count': ds255_fotov_total_count,
-        'ds255_mejoramiento_total_count': ds255_mejoramiento_total_count,
-        'ds255_pda_total_count': ds255_pda_total_count,
-        'ds255_tbm_total_count': ds255_tbm_total_count,
-        'ds255_termico_total_count': ds255_termico_total_count,
-        'ds255_termicopda_total_count': ds255_termicopda_total_count,
-        'ds255_total': ds255_total,
-        
-        #DETALLE LEASING
-        'ls_avc_total_count': ls_avc_total_count,
-        
-        # Variables para checkboxes
-        'selected_comunas': comunas_filtro,
-        'selected_provincias': provincias_filtro,
-        'selected_anos': ano_imputacion_filtro,
-        
-    }
+    content_type, extension = FORMATOS[formato]
+    nombre = f'beneficiarios_{timezone.localdate():%Y%m%d}.{extension}'
+    if formato == 'csv':
+        response = StreamingHttpResponse(exportar_csv(*filtros_exportacion), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        return response
 
-    return render(request, 'serviutemplate/filtros.html', context)
+    exportar = exportar_xlsx if formato == 'xlsx' else exportar_parquet
+    return FileResponse(exportar(*filtros_exportacion), as_attachment=True, filename=nombre, content_type=content_type)
 
 
 
@@ -638,86 +195,155 @@ def filtros(request):
 
 
 def BeneficiariosLista(request):
-            
-    with connection.cursor() as cursor:
-
-        cursor.execute('''
-                SELECT * FROM beneficiarios b 
-        LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario 
-        LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
-        ''')
-        datos = cursor.fetchall()
-        
-        # Obtener el número de elementos por página del parámetro GET
-        per_page = request.GET.get('per_page', '10')
-        try:
-            per_page = int(per_page)
-            if per_page not in [5, 10, 20, 50]:
-                per_page = 10
-        except ValueError:
-            per_page = 10
-        
-        # Si se solicita mostrar todos los registros, no paginar
-        if request.GET.get('mostrar_todos') == 'true':
-            page_obj = datos
-            mostrar_todos = True
-        else:
-            paginator = Paginator(datos, per_page)
-            page_number = request.GET.get("page")
-            page_obj = paginator.get_page(page_number)
-            mostrar_todos = False
+    per_page = leer_por_pagina(request.GET.get('per_page'))
+
+    # Mostrar todos: se envía la tabla por lotes en vez de armarla completa en memoria
+    if request.GET.get('mostrar_todos') == 'true':
+        if request.GET.get('formato') == 'json':
+            return StreamingHttpResponse(_beneficiarios_json(), content_type='application/json')
+        return StreamingHttpResponse(_beneficiarios_html(request, per_page), content_type='text/html; charset=utf-8')
+
+    page_obj = obtener_pagina(
+        per_page,
+        despues=leer_cursor(request.GET.get('despues')),
+        antes=leer_cursor(request.GET.get('antes')),
+        ultima=request.GET.get('ultima') == 'true',
+    )
 
     context = {
         "datos": page_obj,
-        "mostrar_todos": mostrar_todos,
-        "total_beneficiarios": len(datos),
+        "mostrar_todos": False,
+        "total_beneficiarios": contar_filas(),
         "per_page": per_page
     }
     
     return render(request, 'serviutemplate/beneficiarios.html', context)
 
 
+def _beneficiarios_html(request, per_page):
+    """Página de beneficiarios completa, enviada en trozos: cabecera, filas por lote y pie"""
+    context = {
+        "datos": [],
+        "mostrar_todos": True,
+        "total_beneficiarios": contar_filas(),
+        "per_page": per_page
+    }
+    pagina = render_to_string('serviutemplate/beneficiarios.html', context, request)
+    cabecera, pie = pagina.split('<!--filas-->', 1)
+
+    yield cabecera
+    for filas in iterar_lotes():
+        yield render_to_string('serviutemplate/beneficiarios_filas.html', {'filas': filas}, request)
+    yield pie
+
+
+def _beneficiarios_json():
+    """Todas las filas del JOIN como arreglo JSON, serializado por lotes"""
+    columnas = [columna.split('.', 1)[1] for columna in COLUMNAS_DETALLE]
+    separador = ''
+    yield '['
+    for filas in iterar_lotes():
+        yield separador + ','.join(
+            json.dumps(dict(zip(columnas, fila)), default=str, ensure_ascii=False) for fila in filas
+        )
+        separador = ','
+    yield ']'
+
+
 
 
 def Busqueda(request):
     
-    rut_filtro = request.GET.getlist('rut_beneficiario')
-    
+    rut_filtro = request.GET.get('rut_beneficiario', '').strip()
     
-    with connection.cursor() as cursor:
-        cursor.execute(''' 
-                       SELECT * FROM beneficiarios b 
-        LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario 
-        LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario WHERE rut = %s
-                       ''', rut_filtro)
-    rut_filtrado = cursor.fetchall()
+    # Búsqueda exacta sobre la columna rut_normalizado indexada
+    rut_filtrado = buscar_rut(rut_filtro)
     
     context = {
-        'datos': rut_filtrado
+        'datos': rut_filtrado,
+        'search_term': rut_filtro,
+        'total_resultados': len({fila[0] for fila in rut_filtrado}),
+        # Quién reemplazó a este RUT o a quién reemplazó (índices de cambios_beneficiario)
+        'cambios': buscar_cambios(rut_filtro),
     }
     
     return render(request, 'serviutemplate/busqueda.html', context)
 
 
+@login_required
+def busquedaMasiva(request):
+    context = {
+        'maximo_ruts': MAXIMO_RUTS,
+        'encabezados': ENCABEZADOS,
+    }
+    if request.method != 'POST':
+        return render(request, 'serviutemplate/busqueda_masiva.html', context)
+
+    ruts_texto = request.POST.get('ruts', '')
+    context['ruts_texto'] = ruts_texto
+    try:
+        entradas = leer_ruts_texto(ruts_texto)
+        if request.FILES.get('archivo'):
+            entradas += leer_ruts_archivo(request.FILES['archivo'])
+    except Exception as e:
+        context['error'] = f'No se pudo leer el archivo: {e}'
+        return render(request, 'serviutemplate/busqueda_masiva.html', context)
+
+    if not entradas:
+        context['error'] = 'Ingrese al menos un RUT.'
+        return render(request, 'serviutemplate/busqueda_masiva.html', context)
+    if len(entradas) > MAXIMO_RUTS:
+        context['error'] = f'Se recibieron {len(entradas)} RUT; el máximo por búsqueda es {MAXIMO_RUTS}.'
+        return render(request, 'serviutemplate/busqueda_masiva.html', context)
+
+    if request.POST.get('formato') == 'xlsx':
+        return FileResponse(
+            generar_xlsx(entradas), as_attachment=True, filename='busqueda_ruts.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+    context['resultados'] = True
+    return StreamingHttpResponse(_busqueda_masiva_html(request, context, entradas),
+                                 content_type='text/html; charset=utf-8')
+
+
+def _busqueda_masiva_html(request, context, entradas):
+    """Resultados de la búsqueda masiva enviados lote a lote dentro de la página"""
+    pagina = render_to_string('serviutemplate/busqueda_masiva.html', context, request)
+    cabecera, resto = pagina.split('<!--filas-->', 1)
+    medio, pie = resto.split('<!--resumen-->', 1)
+
+    encontrados = set()
+    yield cabecera
+    for filas in lotes_resultado(entradas):
+        encontrados.update(fila[1] for fila in filas if fila[2] == ESTADO_ENCONTRADO)
+        yield render_to_string('serviutemplate/busqueda_masiva_filas.html', {'filas': filas}, request)
+    yield medio
+    yield f'{len(entradas)} RUT consultados, {len(encontrados)} encontrados.'
+    yield pie
+
+
 def actualizarBeneficiarioDecreto(request, id_decreto):
     decreto = get_object_or_404(Decretos, id_decreto=id_decreto)
     
     if request.method == 'POST':
         form = FormDecretos(request.POST, instance=decreto)
         if form.is_valid():
-            decreto_saved = form.save()
+            with registrar_cambios(decreto):
+                decreto_saved = form.save()
             
             # Verificar si existe una resolución asociada, si no, crearla
             try:
                 resolucion = Resoluciones.objects.get(resolucion_id_beneficiario=decreto_saved.decreto_id_beneficiario)
             except Resoluciones.DoesNotExist:
-                resolucion = Resoluciones.objects.create(
-                    resolucion_id_beneficiario=decreto_saved.decreto_id_beneficiario,
-                    resolucion=None,
-                    fecha_resolucion=None,
-                    seleccion='',
-                    ano_imputacion_res_of=None
-                )
+                with registrar_cambios(decreto_saved):
+                    resolucion = Resoluciones.objects.create(
+                        resolucion_id_beneficiario=decreto_saved.decreto_id_beneficiario,
+                        resolucion=None,
+                        fecha_resolucion=None,
+                        seleccion='',
+                        ano_imputacion_res_of=None
+                    )
             
             url = reverse('actualizar_resolucion', args=[resolucion.id_resolucion])
             return redirect(url)
@@ -739,7 +365,8 @@ def actualizarBeneficiarioResolucion(request, id_resolucion):
     if request.method == 'POST':
         form = FormResoluciones(request.POST, instance=resolucion)
         if form.is_valid():
-            form.save()
+            with registrar_cambios(resolucion):
+                form.save()
             return redirect('beneficiarios')
     else:
         # Usar solo la instancia de la resolución para prellenar el formulario
@@ -760,22 +387,24 @@ def actualizarBeneficiarios(request, id_beneficiario):
     # Obtener o crear decreto y resolución asociados
     decreto = Decretos.objects.filter(decreto_id_beneficiario=beneficiario).first()
     if not decreto:
-        decreto = Decretos.objects.create(
-            decreto_id_beneficiario=beneficiario,
-            decreto='',
-            tipologia='',
-            tramo=None
-        )
+        with registrar_cambios(beneficiario):
+            decreto = Decretos.objects.create(
+                decreto_id_beneficiario=beneficiario,
+                decreto='',
+                tipologia='',
+                tramo=None
+            )
     
     resolucion = Resoluciones.objects.filter(resolucion_id_beneficiario=beneficiario).first()
     if not resolucion:
-        resolucion = Resoluciones.objects.create(
-            resolucion_id_beneficiario=beneficiario,
-            resolucion=None,
-            fecha_resolucion=None,
-            seleccion='',
-            ano_imputacion_res_of=None
-        )
+        with registrar_cambios(beneficiario):
+            resolucion = Resoluciones.objects.create(
+                resolucion_id_beneficiario=beneficiario,
+                resolucion=None,
+                fecha_resolucion=None,
+                seleccion='',
+                ano_imputacion_res_of=None
+            )
     
     if request.method == 'POST':
         # Crear los tres formularios con los datos POST y las instancias existentes
@@ -785,13 +414,15 @@ def actualizarBeneficiarios(request, id_beneficiario):
         
         # Validar y guardar todos los formularios
         if form_beneficiario.is_valid():
-            form_beneficiario.save()
-            
-            if form_decreto.is_valid():
-                form_decreto.save()
-            
-            if form_resolucion.is_valid():
-                form_resolucion.save()
+            # Un solo ajuste del resumen para los tres formularios
+            with registrar_cambios(beneficiario):
+                form_beneficiario.save()
+
+                if form_decreto.is_valid():
+                    form_decreto.save()
+
+                if form_resolucion.is_valid():
+                    form_resolucion.save()
             
             # Redirigir a la lista de beneficiarios después de guardar todo
             return redirect('beneficiarios')
@@ -825,24 +456,25 @@ def anadirBeneficiario(request):
             # Guardar el beneficiario
             beneficiario = form_beneficiario.save()
             
-            # Crear y guardar el decreto asociado
-            decreto_data = form_decreto.cleaned_data if form_decreto.is_valid() else {}
-            decreto = Decretos.objects.create(
-                decreto_id_beneficiario=beneficiario,
-                decreto=decreto_data.get('decreto', ''),
-                tipologia=decreto_data.get('tipologia', ''),
-                tramo=decreto_data.get('tramo', None)
-            )
-            
-            # Crear y guardar la resolución asociada
-            resolucion_data = form_resolucion.cleaned_data if form_resolucion.is_valid() else {}
-            resolucion = Resoluciones.objects.create(
-                resolucion_id_beneficiario=beneficiario,
-                resolucion=resolucion_data.get('resolucion', None),
-                fecha_resolucion=resolucion_data.get('fecha_resolucion', None),
-                seleccion=resolucion_data.get('seleccion', ''),
-                ano_imputacion_res_of=resolucion_data.get('ano_imputacion_res_of', None)
-            )
+            with registrar_cambios(beneficiario):
+                # Crear y guardar el decreto asociado
+                decreto_data = form_decreto.cleaned_data if form_decreto.is_valid() else {}
+                decreto = Decretos.objects.create(
+                    decreto_id_beneficiario=beneficiario,
+                    decreto=decreto_data.get('decreto', ''),
+                    tipologia=decreto_data.get('tipologia', ''),
+                    tramo=decreto_data.get('tramo', None)
+                )
+                
+                # Crear y guardar la resolución asociada
+                resolucion_data = form_resolucion.cleaned_data if form_resolucion.is_valid() else {}
+                resolucion = Resoluciones.objects.create(
+                    resolucion_id_beneficiario=beneficiario,
+                    resolucion=resolucion_data.get('resolucion', None),
+                    fecha_resolucion=resolucion_data.get('fecha_resolucion', None),
+                    seleccion=resolucion_data.get('seleccion', ''),
+                    ano_imputacion_res_of=resolucion_data.get('ano_imputacion_res_of', None)
+                )
             
             # Redirigir a la lista de beneficiarios después de guardar todo
             return redirect('beneficiarios')
@@ -872,7 +504,11 @@ class ChatView(View):
             # Detectar si el mensaje contiene un RUT
             rut_pattern = r'\b\d{1,2}\.?\d{3}\.?\d{3}[-.]?[0-9kK]\b'
             rut_match = re.search(rut_pattern, user_message)
-            rut = rut_match.group().replace('.', '').replace('-', '') if rut_match else None
+            rut = None
+            if rut_match:
+                # El patrón siempre termina en el dígito verificador
+                texto_rut = rut_match.group().replace('.', '').replace('-', '')
+                rut = normalizar_rut(texto_rut[:-1], texto_rut[-1]) or texto_rut
             
             # Obtener IP del usuario
             user_ip = request.META.get('REMOTE_ADDR')
@@ -987,204 +623,39 @@ def api_analyze_text(request):
     except Exception as e:
         return JsonResponse({'error': f'Error en el análisis: {str(e)}'}, status=500)
 
-def get_chart_data(request, decreto):
-    """Vista para obtener datos de gráficos en formato JSON con filtros aplicados"""
-    # Procesar filtros de la misma manera que en dashboard
-    comunas_filtro = request.GET.getlist('comunas')
-    provincias_filtro = request.GET.getlist('provincias')
-    ano_imputacion_filtro = request.GET.getlist('ano_imputacion')
-
-    base_query = """
-        SELECT * FROM beneficiarios b 
-        LEFT JOIN resoluciones r ON b.id_beneficiario = r.resolucion_id_beneficiario 
-        LEFT JOIN decretos d ON b.id_beneficiario = d.decreto_id_beneficiario
+def etag_graficos(request, decreto=None):
+    """ETag de los datos de gráficos: filtros, decretos pedidos y versión de los datos"""
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
+    decretos = [decreto] if decreto else request.GET.getlist('decretos')
+    return clave_cache('graficos', comunas=comunas_filtro, provincias=provincias_filtro,
+                       anos=ano_imputacion_filtro, decretos=decretos)
+
+
+@cache_control(no_cache=True)
+@etag(etag_graficos)
+def get_charts_data(request):
+    """Series de gráficos de varios decretos en un solo JSON, con una sola consulta.
+
+    ?decretos=DS-1&decretos=DS-10 limita los decretos; sin parámetro se devuelven
+    todos los del catálogo. Responde 304 si el If-None-Match coincide.
     """
-    filters = []
-    params = []
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
+    decretos = request.GET.getlist('decretos') or catalogo.codigos
 
-    if comunas_filtro:
-        filters.append("b.comuna IN ({})".format(','.join(['%s'] * len(comunas_filtro))))
-        params.extend(comunas_filtro)
+    conteos = contar_por_decreto(comunas_filtro, provincias_filtro, ano_imputacion_filtro)
+    charts_data = {decreto: conteos.serie_grafico(decreto) for decreto in decretos}
 
-    if provincias_filtro:
-        filters.append("b.provincia IN ({})".format(','.join(['%s'] * len(provincias_filtro))))
-        params.extend(provincias_filtro)
-        
-    if ano_imputacion_filtro:
-        filters.append("r.ano_imputacion_res_of IN ({})".format(','.join(['%s'] * len(ano_imputacion_filtro))))
-        params.extend(ano_imputacion_filtro)
+    return JsonResponse(charts_data)
 
-    # Construir la consulta SQL con o sin filtros
-    if filters:
-        filter_sql = " WHERE " + " AND ".join(filters)
-    else:
-        filter_sql = ""
 
-    with connection.cursor() as cursor:
-        chart_data = {}
-        
-        if decreto == 'DS-1':
-            # Datos para DS-1 con filtros
-            ag_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'arriendo glosa 03' AND decreto = 'DS-1'"
-            cursor.execute(ag_ds1_query, params)
-            ag_ds1 = cursor.fetchone()[0]
-            
-            avc_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'avc' AND decreto = 'DS-1'"
-            cursor.execute(avc_ds1_query, params)
-            avc_ds1 = cursor.fetchone()[0]
-            
-            csp_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-1'"
-            cursor.execute(csp_ds1_query, params)
-            csp_ds1 = cursor.fetchone()[0]
-            
-            blanco_ds1_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-1'"
-            cursor.execute(blanco_ds1_query, params)
-            blanco_ds1 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['Arriendo glosa 03', 'AVC', 'CSP', 'Sin tipología'],
-                'data': [ag_ds1, avc_ds1, csp_ds1, blanco_ds1],
-                'title': 'Distribución DS-1'
-            }
-            
-        elif decreto == 'DS-10':
-            # Datos para DS-10 con filtros
-            cch_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CCH' AND decreto = 'DS-10'"
-            cursor.execute(cch_ds10_query, params)
-            cch_ds10 = cursor.fetchone()[0]
-            
-            csr_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSR' AND decreto = 'DS-10'"
-            cursor.execute(csr_ds10_query, params)
-            csr_ds10 = cursor.fetchone()[0]
-            
-            mave_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'MAVE' AND decreto = 'DS-10'"
-            cursor.execute(mave_ds10_query, params)
-            mave_ds10 = cursor.fetchone()[0]
-            
-            blanco_ds10_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-10'"
-            cursor.execute(blanco_ds10_query, params)
-            blanco_ds10 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['CCH', 'CSR', 'MAVE', 'Sin tipología'],
-                'data': [cch_ds10, csr_ds10, mave_ds10, blanco_ds10],
-                'title': 'Distribución DS-10'
-            }
-            
-        elif decreto == 'DS-19':
-            # Datos para DS-19 con filtros
-            pist_ds19_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'PIST' AND decreto = 'DS-19'"
-            cursor.execute(pist_ds19_query, params)
-            pist_ds19 = cursor.fetchone()[0]
-            
-            blanco_ds19_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-19'"
-            cursor.execute(blanco_ds19_query, params)
-            blanco_ds19 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['PIST', 'Sin tipología'],
-                'data': [pist_ds19, blanco_ds19],
-                'title': 'Distribución DS-19'
-            }
-            
-        elif decreto == 'DS-27':
-            # Datos para DS-27 con filtros
-            cap1_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP I' AND decreto = 'DS-27'"
-            cursor.execute(cap1_ds27_query, params)
-            cap1_ds27 = cursor.fetchone()[0]
-            
-            cap2_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP II' AND decreto = 'DS-27'"
-            cursor.execute(cap2_ds27_query, params)
-            cap2_ds27 = cursor.fetchone()[0]
-            
-            cap3_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CAP III' AND decreto = 'DS-27'"
-            cursor.execute(cap3_ds27_query, params)
-            cap3_ds27 = cursor.fetchone()[0]
-            
-            blanco_ds27_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-27'"
-            cursor.execute(blanco_ds27_query, params)
-            blanco_ds27 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['CAP I', 'CAP II', 'CAP III', 'Sin tipología'],
-                'data': [cap1_ds27, cap2_ds27, cap3_ds27, blanco_ds27],
-                'title': 'Distribución DS-27'
-            }
-            
-        elif decreto == 'DS-49':
-            # Datos para DS-49 con filtros
-            avc_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-49'"
-            cursor.execute(avc_ds49_query, params)
-            avc_ds49 = cursor.fetchone()[0]
-            
-            cnt_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT' AND decreto = 'DS-49'"
-            cursor.execute(cnt_ds49_query, params)
-            cnt_ds49 = cursor.fetchone()[0]
-            
-            cnti_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CNT INDUST' AND decreto = 'DS-49'"
-            cursor.execute(cnti_ds49_query, params)
-            cnti_ds49 = cursor.fetchone()[0]
-            
-            csp_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CSP' AND decreto = 'DS-49'"
-            cursor.execute(csp_ds49_query, params)
-            csp_ds49 = cursor.fetchone()[0]
-            
-            blanco_ds49_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-49'"
-            cursor.execute(blanco_ds49_query, params)
-            blanco_ds49 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['AVC', 'CNT', 'CNT INDUST', 'CSP', 'Sin tipología'],
-                'data': [avc_ds49, cnt_ds49, cnti_ds49, csp_ds49, blanco_ds49],
-                'title': 'Distribución DS-49'
-            }
-            
-        elif decreto == 'DS-52':
-            # Datos para DS-52 con filtros
-            arriendo_ds52_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'ARRIENDO' AND decreto = 'DS-52'"
-            cursor.execute(arriendo_ds52_query, params)
-            arriendo_ds52 = cursor.fetchone()[0]
-            
-            blanco_ds52_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-52'"
-            cursor.execute(blanco_ds52_query, params)
-            blanco_ds52 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['ARRIENDO', 'Sin tipología'],
-                'data': [arriendo_ds52, blanco_ds52],
-                'title': 'Distribución DS-52'
-            }
-            
-        elif decreto == 'DS-255':
-            # Datos para DS-255 con filtros
-            calefactor_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'CALEFACTOR' AND decreto = 'DS-255'"
-            cursor.execute(calefactor_ds255_query, params)
-            calefactor_ds255 = cursor.fetchone()[0]
-            
-            blanco_ds255_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-255'"
-            cursor.execute(blanco_ds255_query, params)
-            blanco_ds255 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['CALEFACTOR', 'Sin tipología'],
-                'data': [calefactor_ds255, blanco_ds255],
-                'title': 'Distribución DS-255'
-            }
-            
-        elif decreto == 'DS-120':
-            # Datos para DS-120 con filtros
-            avc_leasing_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE tipologia = 'AVC' AND decreto = 'DS-120'"
-            cursor.execute(avc_leasing_query, params)
-            avc_leasing = cursor.fetchone()[0]
-            
-            blanco_ds120_query = f"SELECT COUNT(*) FROM ({base_query + filter_sql}) AS subquery WHERE (tipologia = '' OR tipologia IS NULL) AND decreto = 'DS-120'"
-            cursor.execute(blanco_ds120_query, params)
-            blanco_ds120 = cursor.fetchone()[0]
-            
-            chart_data = {
-                'labels': ['AVC', 'Sin tipología'],
-                'data': [avc_leasing, blanco_ds120],
-                'title': 'Distribución DS-120'
-            }
+@cache_control(no_cache=True)
+@etag(etag_graficos)
+def get_chart_data(request, decreto):
+    """Vista para obtener datos de gráficos en formato JSON con filtros aplicados"""
+    # Procesar filtros de la misma manera que en dashboard
+    comunas_filtro, provincias_filtro, ano_imputacion_filtro = obtener_filtros(request)
+
+    conteos = contar_por_decreto(comunas_filtro, provincias_filtro, ano_imputacion_filtro)
+    chart_data = conteos.serie_grafico(decreto)
     
     return JsonResponse(chart_data)
@@ -1,3 +1,5 @@
 mkdir -p logs
 python manage.py collectstatic --noinput
+# Proceso trabajador de las importaciones encoladas desde la web
+python manage.py procesar_importaciones >> logs/importaciones.log 2>&1 &
 gunicorn --workers 17 --timeout 4000 serviu.wsgi --log-file logs/gunicorn.log
\ No newline at end of file